@@ -0,0 +1,306 @@
+# benchmark_transformer.py
+# transformer.py 中各个模块在 CPU 上的基准测试与性能剖析
+#
+# 用法示例:
+#   python benchmark_transformer.py --suite modules --seq-lens 128 512 --output baseline.json
+#   python benchmark_transformer.py --suite modules --modules attention --compile --profile traces/
+#   python benchmark_transformer.py --suite attention --seq-lens 1024 4096
+import argparse
+import itertools
+import json
+import multiprocessing as mp
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+
+import torch
+
+from transformer import (
+    PositionalEncoding, MultiHeadAttention, PositionWiseFeedForward, EncoderLayer, DecoderLayer, SDPA_AVAILABLE,
+)
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss 在 Linux 上以 KB 为单位，在 macOS 上以字节为单位
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+
+def time_call(fn, warmup: int = 2, repeat: int = 5):
+    """
+    先预热 warmup 次，再测量 repeat 次，返回每次的耗时 (秒)
+    """
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def percentile(values, q: float) -> float:
+    # 线性插值的百分位数，q 取值 0~100
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize_times(times, tokens: int) -> dict:
+    return {
+        "p50_ms": percentile(times, 50) * 1000,
+        "p90_ms": percentile(times, 90) * 1000,
+        "p99_ms": percentile(times, 99) * 1000,
+        "mean_ms": statistics.mean(times) * 1000,
+        "tokens_per_s": tokens / statistics.median(times),
+    }
+
+
+def environment() -> dict:
+    """
+    记录运行环境，便于比较不同时间、不同机器上的结果
+    """
+    return {
+        "torch": torch.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+        "sdpa_available": SDPA_AVAILABLE,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def run_isolated(worker, config: dict) -> dict:
+    """
+    在全新的子进程中运行一次测量。ru_maxrss 只增不减，同一进程中先测的配置会影响后测的配置，
+    因此每个配置单独使用一个进程，峰值内存才有可比性。
+    """
+    with mp.get_context("spawn").Pool(1) as pool:
+        return pool.apply(worker, (config,))
+
+
+# --- 各模块的构造方式、输入与 FLOPs 估算 ---
+# FLOPs 按一次乘加 = 2 FLOPs 估算，B=batch_size, S=seq_len, d=d_model, d_ff=4d；
+# 注意力得分按稠密矩阵计算，因果掩码实际可省去约一半
+def _attention_flops(B, S, d, S_kv=None):
+    S_kv = S_kv or S
+    projections = 2 * B * S * d * d * 2 + 2 * B * S_kv * d * d * 2 # Q、输出投影 + K、V 投影
+    scores = 2 * B * S * S_kv * d * 2 # QK^T 与 权重 * V
+    return projections + scores
+
+
+def _ffn_flops(B, S, d, d_ff):
+    return 2 * B * S * d * d_ff * 2
+
+
+MODULES = {
+    "positional_encoding": {
+        "build": lambda c: PositionalEncoding(c["d_model"], dropout=0.0),
+        "inputs": lambda c, x: (x,),
+        "flops": lambda B, S, d, d_ff: B * S * d,
+    },
+    "attention": {
+        "build": lambda c: MultiHeadAttention(c["d_model"], c["num_heads"], fused_qkv=c["fused_qkv"], attn_impl=c["attn_impl"]),
+        "inputs": lambda c, x: (x, x, x),
+        "kwargs": {"is_causal": True},
+        "flops": lambda B, S, d, d_ff: _attention_flops(B, S, d),
+    },
+    "feed_forward": {
+        "build": lambda c: PositionWiseFeedForward(c["d_model"], c["d_ff"]),
+        "inputs": lambda c, x: (x,),
+        "flops": lambda B, S, d, d_ff: _ffn_flops(B, S, d, d_ff),
+    },
+    "encoder_layer": {
+        "build": lambda c: EncoderLayer(c["d_model"], c["num_heads"], c["d_ff"], dropout=0.0,
+                                        fused_qkv=c["fused_qkv"], attn_impl=c["attn_impl"]),
+        "inputs": lambda c, x: (x, None),
+        "flops": lambda B, S, d, d_ff: _attention_flops(B, S, d) + _ffn_flops(B, S, d, d_ff),
+    },
+    "decoder_layer": {
+        "build": lambda c: DecoderLayer(c["d_model"], c["num_heads"], c["d_ff"], dropout=0.0,
+                                        fused_qkv=c["fused_qkv"], attn_impl=c["attn_impl"]),
+        # 编码器输出与目标序列等长
+        "inputs": lambda c, x: (x, torch.randn_like(x), None, None),
+        "kwargs": {"is_causal": True},
+        "flops": lambda B, S, d, d_ff: 2 * _attention_flops(B, S, d) + _ffn_flops(B, S, d, d_ff),
+    },
+}
+
+
+def _module_worker(config: dict) -> dict:
+    torch.manual_seed(0)
+    spec = MODULES[config["module"]]
+    module = spec["build"](config).eval()
+    if config.get("quantize"):
+        from inference import prepare_for_inference
+        module = prepare_for_inference(module, quantize=True, inplace=True)
+    x = torch.randn(config["batch_size"], config["seq_len"], config["d_model"])
+    args, kwargs = spec["inputs"](config, x), spec.get("kwargs", {})
+
+    result = {**config}
+    if config["compile"]:
+        # torch.compile 的首次调用包含编译耗时，单独记录
+        start = time.perf_counter()
+        module = torch.compile(module)
+        with torch.no_grad():
+            module(*args, **kwargs)
+        result["compile_s"] = time.perf_counter() - start
+
+    baseline = peak_rss_mb()
+    with torch.no_grad():
+        times = time_call(lambda: module(*args, **kwargs), config["warmup"], config["repeat"])
+
+    B, S, d = config["batch_size"], config["seq_len"], config["d_model"]
+    flops = spec["flops"](B, S, d, config["d_ff"])
+    result.update(summarize_times(times, tokens=B * S))
+    result.update({
+        "flops": flops,
+        "gflops_per_s": flops / statistics.median(times) / 1e9,
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_rss_delta_mb": peak_rss_mb() - baseline,
+    })
+
+    if config.get("profile_dir"):
+        from torch.profiler import profile, ProfilerActivity
+        os.makedirs(config["profile_dir"], exist_ok=True)
+        trace = os.path.join(config["profile_dir"], f"{config_name(config)}.json")
+        with torch.no_grad(), profile(activities=[ProfilerActivity.CPU], record_shapes=True, profile_memory=True) as prof:
+            module(*args, **kwargs)
+        prof.export_chrome_trace(trace)
+        result["trace"] = trace
+        result["top_ops"] = [
+            {"name": event.key, "self_cpu_ms": event.self_cpu_time_total / 1000, "calls": event.count}
+            for event in sorted(prof.key_averages(), key=lambda e: e.self_cpu_time_total, reverse=True)[:10]
+        ]
+    return result
+
+
+def config_name(config: dict) -> str:
+    mode = (("fused_" if config.get("fused_qkv") else "") + ("int8_" if config.get("quantize") else "")
+            + ("compile" if config.get("compile") else "eager"))
+    return (f"{config['module']}_{config['attn_impl']}_{mode}_b{config['batch_size']}_s{config['seq_len']}"
+            f"_d{config['d_model']}_h{config['num_heads']}")
+
+
+def benchmark_modules(modules, batch_sizes, seq_lens, d_models, num_heads_list, attn_impl="auto",
+                      compile_modes=(False,), warmup=2, repeat=10, profile_dir=None, quantize=False, fused_qkv=False):
+    """
+    在 batch_size × seq_len × d_model × num_heads 的网格上测量各个模块，
+    compile_modes 为 (False, True) 时同一配置分别测量 eager 与 torch.compile
+    """
+    results = []
+    grid = itertools.product(modules, batch_sizes, seq_lens, d_models, num_heads_list, compile_modes)
+    for module, batch_size, seq_len, d_model, num_heads, compiled in grid:
+        if d_model % num_heads != 0:
+            continue
+        config = {
+            "module": module, "batch_size": batch_size, "seq_len": seq_len, "d_model": d_model,
+            "num_heads": num_heads, "d_ff": 4 * d_model, "attn_impl": attn_impl, "compile": compiled,
+            "warmup": warmup, "repeat": repeat, "profile_dir": profile_dir, "quantize": quantize,
+            "fused_qkv": fused_qkv,
+        }
+        try:
+            result = run_isolated(_module_worker, config)
+        except Exception as e:
+            result = {**config, "error": str(e)}
+        results.append(result)
+
+        if "error" in result:
+            print(f"❌ {config_name(config)}: {result['error']}")
+        else:
+            print(f"📊 {config_name(config)}: p50 {result['p50_ms']:.2f} ms, p99 {result['p99_ms']:.2f} ms, "
+                  f"{result['tokens_per_s']:.0f} tokens/s, {result['gflops_per_s']:.1f} GFLOP/s, "
+                  f"峰值内存 {result['peak_rss_mb']:.0f} MB")
+    return results
+
+
+def _attention_worker(config: dict) -> dict:
+    torch.manual_seed(0)
+    attn = MultiHeadAttention(config["d_model"], config["num_heads"], attn_impl=config["impl"],
+                              chunk_size=config["chunk_size"]).eval()
+    x = torch.randn(config["batch_size"], config["seq_len"], config["d_model"])
+
+    # 基线包含模型、输入与 torch 自身占用的内存，增量即为注意力计算的峰值开销
+    baseline = peak_rss_mb()
+    with torch.no_grad():
+        times = time_call(lambda: attn(x, x, x, is_causal=True), config["warmup"], config["repeat"])
+
+    return {
+        **config,
+        "median_ms": statistics.median(times) * 1000,
+        "min_ms": min(times) * 1000,
+        "peak_rss_delta_mb": peak_rss_mb() - baseline,
+    }
+
+
+def benchmark_attention(seq_lens, impls, batch_size=1, d_model=512, num_heads=8, chunk_size=128, warmup=1, repeat=3):
+    """
+    对比不同注意力实现在各个序列长度下的耗时与峰值内存
+    """
+    results = []
+    for seq_len in seq_lens:
+        for impl in impls:
+            config = {
+                "impl": impl, "batch_size": batch_size, "seq_len": seq_len, "d_model": d_model,
+                "num_heads": num_heads, "chunk_size": chunk_size, "warmup": warmup, "repeat": repeat,
+            }
+            try:
+                result = run_isolated(_attention_worker, config)
+            except Exception as e:
+                # 序列过长时稠密实现可能因内存不足而失败，记录下来继续测试其他配置
+                result = {**config, "error": str(e)}
+            results.append(result)
+
+            if "error" in result:
+                print(f"❌ {impl:>9} seq={seq_len:>6}: {result['error']}")
+            else:
+                print(f"📊 {impl:>9} seq={seq_len:>6}: {result['median_ms']:9.2f} ms, "
+                      f"峰值内存增量 {result['peak_rss_delta_mb']:8.1f} MB")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="transformer.py 基准测试与性能剖析")
+    parser.add_argument("--suite", choices=["modules", "attention"], default="modules",
+                        help="modules: 各模块网格测试；attention: 注意力实现随序列长度的对比")
+    parser.add_argument("--modules", nargs="+", choices=list(MODULES), default=list(MODULES))
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--seq-lens", type=int, nargs="+", default=None)
+    parser.add_argument("--d-models", type=int, nargs="+", default=[256, 512])
+    parser.add_argument("--num-heads", type=int, nargs="+", default=[8])
+    parser.add_argument("--attn-impl", default="auto", help="modules 测试中注意力使用的实现")
+    parser.add_argument("--impls", nargs="+", default=["reference", "chunked"] + (["sdpa"] if SDPA_AVAILABLE else []),
+                        help="attention 测试中参与对比的实现")
+    parser.add_argument("--chunk-size", type=int, default=128)
+    parser.add_argument("--compile", action="store_true", help="同时测量 torch.compile 版本，与 eager 对比")
+    parser.add_argument("--fused-qkv", action="store_true", help="modules 测试中使用合并的 W_qkv 投影")
+    parser.add_argument("--quantize", action="store_true", help="测量 nn.Linear 动态 int8 量化后的模块 (见 inference.py)")
+    parser.add_argument("--profile", metavar="DIR", help="使用 torch.profiler 为每个配置导出 Chrome trace")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--output", help="将结果写入 JSON 文件，用于回归对比")
+    args = parser.parse_args()
+
+    if args.suite == "modules":
+        results = benchmark_modules(
+            args.modules, args.batch_sizes, args.seq_lens or [128, 512], args.d_models, args.num_heads,
+            attn_impl=args.attn_impl, compile_modes=(False, True) if args.compile else (False,),
+            repeat=args.repeat, profile_dir=args.profile, quantize=args.quantize,
+            fused_qkv=args.fused_qkv,
+        )
+    else:
+        results = benchmark_attention(args.seq_lens or [512, 1024, 2048, 4096], args.impls, args.batch_sizes[0],
+                                      args.d_models[-1], args.num_heads[0], args.chunk_size, repeat=args.repeat)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"environment": environment(), "suite": args.suite, "results": results},
+                      f, ensure_ascii=False, indent=2)
+        print(f"✅ 结果已写入 {args.output}")
@@ -1,5 +1,11 @@
+import queue
+import threading
+import time
+from typing import List, Dict, Optional, Iterator
+
 import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import AutoModelForCausalLM, AutoTokenizer, TextIteratorStreamer, StoppingCriteria, StoppingCriteriaList
+from transformers.generation.streamers import BaseStreamer
 
 from huggingface_hub import snapshot_download
 
@@ -28,10 +34,9 @@ with open(current_dir.parent.parent.parent / 'config.yaml', 'r') as f:
 # 指定模型ID
 model_id = "Qwen/Qwen1.5-0.5B-Chat"
 # 该模型需要申请访问
-model_id = "meta-llama/Llama-3.2-3B"
-model_id = "jinaai/jina-embeddings-v3"
+# model_id = "meta-llama/Llama-3.2-3B"
 
-model_dir = Path('/Volumes/pssd/llm/') / model_id
+model_dir = Path(config.get('HF_MODEL_DIR', '/Volumes/pssd/llm/')) / model_id
 
 # NOTE: 下载模型到本地缓存 (如果容易断连，手动从网站下载)
 # snapshot_download(
@@ -43,52 +48,298 @@ model_dir = Path('/Volumes/pssd/llm/') / model_id
 # print("模型下载完成！")
 
 
-# 设置设备，优先使用GPU
-device = "cuda" if torch.cuda.is_available() else "cpu"
-print(f"Using device: {device}")
+class GenerationRequest:
+    """
+    一次排队中的生成请求。生成的文本通过 streamer 逐段读出，读完后可查看 token 统计与错误。
+    """
+
+    def __init__(self, messages: List[Dict[str, str]], streamer: TextIteratorStreamer,
+                 max_new_tokens: int, temperature: float, top_p: float):
+        self.messages = messages
+        self.streamer = streamer
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.error: Optional[Exception] = None
+        self.cancelled = False
+
+    @property
+    def sampling_key(self):
+        # 同一批次只能使用同一组采样参数，参数相同的请求才能合并
+        return (self.temperature > 0, self.temperature, self.top_p)
+
+    @property
+    def finish_reason(self) -> str:
+        return "length" if self.completion_tokens >= self.max_new_tokens else "stop"
+
+    def cancel(self):
+        """
+        客户端断开时调用，批次中的这一行不再输出，其余请求不受影响。
+        """
+        self.cancelled = True
+
+    def __iter__(self) -> Iterator[str]:
+        for text in self.streamer:
+            yield text
+        if self.error is not None:
+            raise RuntimeError(f"本地模型生成失败: {self.error}")
+
+
+class _BatchStreamer(BaseStreamer):
+    """
+    model.generate 每一步都会把整个批次新生成的 token 交给 streamer。
+    这里按行拆开，转发给各个请求自己的 TextIteratorStreamer，
+    并在某一行遇到结束符或达到它自己的 max_new_tokens 时提前结束这一行的流。
+    """
+
+    def __init__(self, requests: List[GenerationRequest], eos_token_ids):
+        self.requests = requests
+        self.eos_token_ids = set(eos_token_ids)
+        self.finished = [False] * len(requests)
+        self._prompt_seen = False
+
+    def put(self, value):
+        # 第一次调用传入的是提示词本身
+        if not self._prompt_seen:
+            self._prompt_seen = True
+            return
+        value = value.view(len(self.requests), -1)
+        for i, request in enumerate(self.requests):
+            if self.finished[i]:
+                continue
+            if request.cancelled:
+                self._finish(i)
+                continue
+            for token in value[i].tolist():
+                if token in self.eos_token_ids:
+                    self._finish(i)
+                    break
+                request.completion_tokens += 1
+                request.streamer.put(torch.tensor([token]))
+                if request.completion_tokens >= request.max_new_tokens:
+                    self._finish(i)
+                    break
+
+    def _finish(self, i: int):
+        self.finished[i] = True
+        self.requests[i].streamer.end()
+
+    def end(self):
+        for i in range(len(self.requests)):
+            if not self.finished[i]:
+                self._finish(i)
+
+    @property
+    def all_finished(self) -> bool:
+        return all(self.finished)
+
+
+class _StopWhenAllFinished(StoppingCriteria):
+    """
+    批次中所有请求都已结束 (包括被取消、达到各自的长度上限) 时停止生成。
+    """
+
+    def __init__(self, streamer: _BatchStreamer):
+        self.streamer = streamer
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.streamer.all_finished, dtype=torch.bool, device=input_ids.device)
+
+
+class LocalLLMEngine:
+    """
+    本地 CPU/GPU 推理引擎:
+    - 模型在第一个请求到来时才加载 (safetensors + low_cpu_mem_usage)，导入模块不再有任何开销；
+    - 后台调度线程把并发到达的聊天请求合并成批次，左侧填充后一次 generate，批次运行期间新到的请求排队进入下一批；
+    - 每个请求通过自己的 TextIteratorStreamer 逐段返回文本。
+    """
+
+    def __init__(self, model_path: str = None, device: str = None, max_batch_size: int = 8,
+                 batch_wait_ms: float = 10, max_new_tokens: int = 512, torch_dtype: torch.dtype = None):
+        """
+        参数:
+        - model_path (str): 本地模型目录或 Hugging Face 模型ID，默认使用上面配置的 model_dir。
+        - device (str): 推理设备，默认优先使用GPU。
+        - max_batch_size (int): 单个批次最多合并的请求数。
+        - batch_wait_ms (float): 收到第一个请求后，等待更多请求加入同一批次的最长时间 (毫秒)。
+        - max_new_tokens (int): 请求未指定时默认的最大生成 token 数。
+        - torch_dtype (torch.dtype): 模型精度，默认 CPU 上为 float32、GPU 上为 float16。
+        """
+        self.model_path = str(model_path or model_dir)
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.max_batch_size = max_batch_size
+        self.batch_wait = batch_wait_ms / 1000
+        self.max_new_tokens = max_new_tokens
+        self.torch_dtype = torch_dtype or (torch.float16 if self.device == "cuda" else torch.float32)
+
+        self.model = None
+        self.tokenizer = None
+        self._load_lock = threading.Lock()
+        self._pending: "queue.Queue[Optional[GenerationRequest]]" = queue.Queue()
+        self._deferred: List[GenerationRequest] = [] # 采样参数与当前批次不同，留到下一批
+        self._closed = False
+        self._scheduler = threading.Thread(target=self._schedule_loop, daemon=True)
+        self._scheduler.start()
+
+    def load(self):
+        """
+        加载分词器与模型，只会执行一次。
+        """
+        with self._load_lock:
+            if self.model is not None:
+                return
+            print(f"🧠 正在加载本地模型 {self.model_path} (device={self.device})...")
+            start = time.perf_counter()
+            # 批量生成时必须左侧填充，这样每一行新生成的 token 都紧跟在各自的提示词之后
+            self.tokenizer = AutoTokenizer.from_pretrained(self.model_path, padding_side="left")
+            if self.tokenizer.pad_token is None:
+                self.tokenizer.pad_token = self.tokenizer.eos_token
+            self.model = AutoModelForCausalLM.from_pretrained(
+                self.model_path,
+                torch_dtype=self.torch_dtype,
+                use_safetensors=True,
+                low_cpu_mem_usage=True,
+            ).to(self.device).eval()
+            print(f"✅ 模型和分词器加载完成，耗时 {time.perf_counter() - start:.1f}s")
+
+    def submit(self, messages: List[Dict[str, str]], max_new_tokens: int = None,
+               temperature: float = 0.0, top_p: float = 1.0) -> GenerationRequest:
+        """
+        提交一个聊天请求并立即返回，迭代返回的 GenerationRequest 即可逐段读取生成的文本。
+        """
+        if self._closed:
+            raise RuntimeError("本地推理引擎已关闭。")
+        self.load()
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=False, skip_special_tokens=True)
+        request = GenerationRequest(messages, streamer, max_new_tokens or self.max_new_tokens, temperature, top_p)
+        self._pending.put(request)
+        return request
+
+    def stream(self, messages: List[Dict[str, str]], **kwargs) -> Iterator[str]:
+        request = self.submit(messages, **kwargs)
+        try:
+            yield from request
+        finally:
+            # 调用方提前停止迭代时，不再为这个请求生成内容
+            request.cancel()
+
+    def generate(self, messages: List[Dict[str, str]], **kwargs) -> str:
+        return "".join(self.submit(messages, **kwargs))
+
+    def _next_batch(self) -> List[GenerationRequest]:
+        """
+        阻塞等待第一个请求，然后在 batch_wait 时间内继续收集采样参数相同的请求。
+        """
+        if self._deferred:
+            first = self._deferred.pop(0)
+        else:
+            first = self._pending.get()
+            if first is None:
+                self._closed = True
+                return []
+
+        batch, deferred = [first], []
+        for request in list(self._deferred):
+            if len(batch) < self.max_batch_size and request.sampling_key == first.sampling_key:
+                batch.append(request)
+                self._deferred.remove(request)
+
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                request = self._pending.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if request is None:
+                self._closed = True
+                break
+            (batch if request.sampling_key == first.sampling_key else deferred).append(request)
+
+        self._deferred.extend(deferred)
+        for request in batch:
+            if request.cancelled:
+                request.streamer.end()
+        return [request for request in batch if not request.cancelled]
+
+    def _schedule_loop(self):
+        while not (self._closed and not self._deferred and self._pending.empty()):
+            batch = self._next_batch()
+            if batch:
+                self._run_batch(batch)
 
-# 加载分词器
-tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    def _run_batch(self, batch: List[GenerationRequest]):
+        streamer = _BatchStreamer(batch, self._eos_token_ids())
+        try:
+            texts = [
+                self.tokenizer.apply_chat_template(request.messages, tokenize=False, add_generation_prompt=True)
+                for request in batch
+            ]
+            inputs = self.tokenizer(texts, return_tensors="pt", padding=True).to(self.device)
+            for request, mask in zip(batch, inputs.attention_mask):
+                request.prompt_tokens = int(mask.sum())
 
-# 加载模型，并将其移动到指定设备
-model = AutoModelForCausalLM.from_pretrained(model_dir).to(device)
+            first = batch[0]
+            sampling = {"do_sample": True, "temperature": first.temperature, "top_p": first.top_p} \
+                if first.temperature > 0 else {"do_sample": False}
+            with torch.inference_mode():
+                self.model.generate(
+                    **inputs,
+                    max_new_tokens=max(request.max_new_tokens for request in batch),
+                    pad_token_id=self.tokenizer.pad_token_id,
+                    streamer=streamer,
+                    stopping_criteria=StoppingCriteriaList([_StopWhenAllFinished(streamer)]),
+                    **sampling,
+                )
+        except Exception as e:
+            print(f"❌ 本地模型生成时发生错误: {e}")
+            for request in batch:
+                request.error = e
+        finally:
+            streamer.end()
 
-print("模型和分词器加载完成！")
+    def _eos_token_ids(self):
+        eos = self.model.generation_config.eos_token_id
+        eos = eos if isinstance(eos, list) else [eos]
+        return [token for token in eos + [self.tokenizer.eos_token_id] if token is not None]
 
-# 准备对话输入
-messages = [
-    {"role": "system", "content": "You are a helpful assistant."},
-    {"role": "user", "content": "你好，请介绍你自己。"}
-]
+    def close(self):
+        """
+        停止调度线程。已经排队的请求会先处理完。
+        """
+        if self._scheduler.is_alive():
+            self._pending.put(None)
+            self._scheduler.join()
+        self._closed = True
 
-# 使用分词器的模板格式化输入
-text = tokenizer.apply_chat_template(
-    messages,
-    tokenize=False,
-    add_generation_prompt=True
-)
 
-# 编码输入文本
-model_inputs = tokenizer([text], return_tensors="pt").to(device)
+# --- 引擎使用示例 ---
+if __name__ == '__main__':
+    from concurrent.futures import ThreadPoolExecutor
 
-print("编码后的输入文本:")
-print(model_inputs)
+    engine = LocalLLMEngine(max_new_tokens=512)
 
-# 使用模型生成回答
-# max_new_tokens 控制了模型最多能生成多少个新的Token
-generated_ids = model.generate(
-    model_inputs.input_ids,
-    max_new_tokens=512
-)
+    # 准备对话输入
+    messages = [
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": "你好，请介绍你自己。"}
+    ]
 
-# 将生成的 Token ID 截取掉输入部分
-# NOTE: 这样我们只解码模型新生成的部分 (decoder 解码器的输出包含原始输入的上下文)
-generated_ids = [
-    output_ids[len(input_ids):] for input_ids, output_ids in zip(model_inputs.input_ids, generated_ids)
-]
+    print("\n模型的回答 (流式):")
+    for text in engine.stream(messages):
+        print(text, end="", flush=True)
+    print()
 
-# 解码生成的 Token ID
-response = tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
+    # 并发提交的请求会被合并到同一个批次中
+    questions = ["什么是 Transformer？", "用一句话介绍 Python。", "1 + 1 等于几？", "推荐一本机器学习的书。"]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(questions)) as pool:
+        answers = list(pool.map(
+            lambda q: engine.generate([{"role": "user", "content": q}], max_new_tokens=64), questions
+        ))
+    print(f"\n⚡ 并发 {len(questions)} 个请求耗时 {time.perf_counter() - start:.1f}s")
+    for question, answer in zip(questions, answers):
+        print(f"[{question}] {answer}")
 
-print("\n模型的回答:")
-print(response)
\ No newline at end of file
+    engine.close()
@@ -0,0 +1,122 @@
+"""
+本地模型的 OpenAI 兼容接口
+
+启动: python hf_server.py
+之后 HelloAgentsLLM 可以直接指向本地模型进行离线测试，例如在 config.yaml 中添加:
+
+Local:
+  MODEL_NAME: Qwen/Qwen1.5-0.5B-Chat
+  API_KEY: local
+  BASE_URL: http://127.0.0.1:8000/v1
+
+然后使用 HelloAgentsLLM(Provider='Local')。
+"""
+import json
+import time
+import uuid
+from typing import List, Dict, Any, Optional
+
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from hf_llm import LocalLLMEngine, model_id
+
+app = FastAPI(title="HelloAgents Local LLM API", version="1.0.0")
+
+# 模型在第一个请求到来时才加载，服务启动很快
+engine = LocalLLMEngine()
+
+
+class ChatCompletionRequest(BaseModel):
+    model: Optional[str] = None
+    messages: List[Dict[str, Any]]
+    temperature: float = 0.0
+    top_p: float = 1.0
+    max_tokens: Optional[int] = None
+    stream: bool = False
+
+
+def _chunk(completion_id: str, created: int, delta: dict, finish_reason: Optional[str] = None) -> str:
+    # 按 OpenAI 的 Server-Sent Events 格式输出一个增量片段
+    payload = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model_id,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+@app.get("/")
+async def root():
+    return {"message": "HelloAgents Local LLM API is running"}
+
+
+@app.get("/health")
+async def health_check():
+    return {"status": "healthy", "model_loaded": engine.model is not None}
+
+
+@app.get("/v1/models")
+async def list_models():
+    return {"object": "list", "data": [{"id": model_id, "object": "model", "owned_by": "local"}]}
+
+
+# 使用同步函数：FastAPI 会在线程池中执行它，等待生成结果时不会阻塞事件循环
+@app.post("/v1/chat/completions")
+def chat_completions(body: ChatCompletionRequest):
+    try:
+        request = engine.submit(
+            body.messages, max_new_tokens=body.max_tokens, temperature=body.temperature, top_p=body.top_p
+        )
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"本地模型不可用: {e}")
+
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+
+    if body.stream:
+        def event_stream():
+            try:
+                yield _chunk(completion_id, created, {"role": "assistant", "content": ""})
+                for text in request:
+                    if text:
+                        yield _chunk(completion_id, created, {"content": text})
+                yield _chunk(completion_id, created, {}, request.finish_reason)
+            except RuntimeError as e:
+                yield f"data: {json.dumps({'error': {'message': str(e)}}, ensure_ascii=False)}\n\n"
+            finally:
+                # 客户端断开时生成器被关闭，通知引擎不再为这个请求生成内容
+                request.cancel()
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+    try:
+        content = "".join(request)
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": created,
+        "model": model_id,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": request.finish_reason,
+        }],
+        "usage": {
+            "prompt_tokens": request.prompt_tokens,
+            "completion_tokens": request.completion_tokens,
+            "total_tokens": request.prompt_tokens + request.completion_tokens,
+        },
+    }
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="127.0.0.1", port=8000, log_level="info")
@@ -0,0 +1,112 @@
+# inference.py
+# transformer.py 模型的 CPU 推理导出：去掉 Dropout、nn.Linear 动态 int8 量化、可选 torch.compile，
+# 并给出与 fp32 模型的精度差异报告
+import copy
+import io
+import time
+
+import torch
+import torch.nn as nn
+
+from transformer import EncoderLayer, DecoderLayer, TransformerDecoder, greedy_decode
+
+try:
+    from torch.ao.quantization import quantize_dynamic
+except ImportError: # PyTorch < 1.10
+    from torch.quantization import quantize_dynamic
+
+
+def strip_dropout(model: nn.Module) -> nn.Module:
+    """
+    把所有 nn.Dropout 替换为 nn.Identity。
+    eval 模式下 Dropout 本来就是恒等变换，替换后前向计算中不再有这一层调用，torch.compile 的图也更简单
+    """
+    for name, child in list(model.named_children()):
+        if isinstance(child, nn.Dropout):
+            setattr(model, name, nn.Identity())
+        else:
+            strip_dropout(child)
+    return model
+
+
+def compile_layers(model: nn.Module, **compile_kwargs) -> nn.Module:
+    """
+    用 torch.compile 包装模型中的每个 EncoderLayer/DecoderLayer；模型中没有这两种层时包装整个模型。
+    按层编译时，解码循环、K/V 缓存的管理等 Python 逻辑仍保持 eager 执行
+    """
+    compiled_any = False
+    for parent in model.modules():
+        for name, child in list(parent.named_children()):
+            if isinstance(child, (EncoderLayer, DecoderLayer)):
+                setattr(parent, name, torch.compile(child, **compile_kwargs))
+                compiled_any = True
+    return model if compiled_any else torch.compile(model, **compile_kwargs)
+
+
+def prepare_for_inference(model: nn.Module, quantize: bool = True, compile: bool = False, inplace: bool = False) -> nn.Module:
+    """
+    导出用于 CPU 推理的模型。
+
+    参数:
+    - model (nn.Module): fp32 模型，例如 TransformerDecoder、EncoderLayer 等。
+    - quantize (bool): 对所有 nn.Linear (W_qkv/W_q/W_k/W_v/W_o、linear1/linear2、fc_out) 做动态 int8 量化：
+      权重离线量化为 int8，激活在运行时按批次动态量化，不需要校准数据。
+    - compile (bool): 是否用 torch.compile 包装编码器/解码器层。
+    - inplace (bool): 是否直接修改传入的模型，默认先复制一份，保留 fp32 模型用于精度对比。
+    """
+    if not inplace:
+        model = copy.deepcopy(model)
+    model = strip_dropout(model.eval())
+    if quantize:
+        model = quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    if compile:
+        model = compile_layers(model)
+    return model
+
+
+def model_size_mb(model: nn.Module) -> float:
+    # 以序列化后的 state_dict 大小衡量模型占用，量化后的打包权重也能正确统计
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 1024 / 1024
+
+
+@torch.no_grad()
+def accuracy_report(reference: nn.Module, candidate: nn.Module, *inputs, **kwargs) -> dict:
+    """
+    在相同输入上比较两个模型的输出，返回误差统计。
+    最后一维被视为 logits 时，top1_agreement 表示两者 argmax 一致的比例
+    """
+    expected = reference(*inputs, **kwargs).float()
+    actual = candidate(*inputs, **kwargs).float()
+    diff = (expected - actual).abs()
+    return {
+        "max_abs_error": diff.max().item(),
+        "mean_abs_error": diff.mean().item(),
+        "relative_error": (diff.norm() / expected.norm().clamp_min(1e-12)).item(),
+        "cosine_similarity": torch.nn.functional.cosine_similarity(
+            expected.flatten(), actual.flatten(), dim=0).item(),
+        "top1_agreement": (expected.argmax(dim=-1) == actual.argmax(dim=-1)).float().mean().item(),
+    }
+
+
+if __name__ == '__main__':
+    torch.manual_seed(0)
+    vocab_size, d_model, num_heads, d_ff, num_layers = 8000, 512, 8, 2048, 6
+    fp32_model = TransformerDecoder(vocab_size, d_model, num_heads, d_ff, num_layers).eval()
+    int8_model = prepare_for_inference(fp32_model, quantize=True)
+
+    encoder_output = torch.randn(4, 64, d_model)
+    tgt = torch.randint(0, vocab_size, (4, 64))
+
+    report = accuracy_report(fp32_model, int8_model, tgt, encoder_output, is_causal=True)
+    print("📊 int8 相对 fp32 的精度差异:")
+    for key, value in report.items():
+        print(f"   {key}: {value:.6f}")
+    print(f"🗜️ 模型大小: fp32 {model_size_mb(fp32_model):.1f} MB -> int8 {model_size_mb(int8_model):.1f} MB")
+
+    for name, model in (("fp32", fp32_model), ("int8", int8_model)):
+        start = time.perf_counter()
+        ys = greedy_decode(model, encoder_output, None, bos_id=1, eos_id=-1, max_len=64)
+        elapsed = time.perf_counter() - start
+        print(f"⚡ {name}: {ys.numel() / elapsed:.1f} tokens/s")
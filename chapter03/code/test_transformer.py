@@ -0,0 +1,144 @@
+# test_transformer.py
+# 验证 transformer.py 中各个优化路径与逐步计算的参照实现数值一致
+import torch
+
+from transformer import (
+    MultiHeadAttention, TransformerDecoder, causal_mask, chunked_attention, greedy_decode, set_attn_impl,
+)
+
+ATOL = 1e-5
+
+
+def make_attention_pair(d_model=64, num_heads=4):
+    """
+    创建一对权重相同的多头注意力：参照实现 (三个独立投影 + 手写注意力) 与融合实现 (W_qkv + SDPA)
+    """
+    reference = MultiHeadAttention(d_model, num_heads, fused_qkv=False, attn_impl="reference")
+    fused = MultiHeadAttention(d_model, num_heads, fused_qkv=True, attn_impl="auto")
+    # 分开的 W_q/W_k/W_v 加载时自动合并为 W_qkv
+    fused.load_state_dict(reference.state_dict())
+    return reference, fused
+
+
+def test_state_dict_loads_across_layouts():
+    torch.manual_seed(0)
+    reference, fused = make_attention_pair()
+    expected_qkv = torch.cat([reference.W_q.weight, reference.W_k.weight, reference.W_v.weight])
+    assert torch.equal(fused.W_qkv.weight, expected_qkv)
+
+    # 反方向：合并的 W_qkv 也能加载到分开的投影中
+    separate = MultiHeadAttention(64, 4, fused_qkv=False)
+    separate.load_state_dict(fused.state_dict())
+    assert torch.equal(separate.W_k.weight, reference.W_k.weight)
+    assert torch.equal(separate.W_v.bias, reference.W_v.bias)
+
+
+def test_fused_self_attention_matches_reference():
+    torch.manual_seed(0)
+    reference, fused = make_attention_pair()
+    x = torch.randn(2, 10, 64)
+
+    expected = reference(x, x, x, causal_mask(10))
+    # 融合实现使用 is_causal，不再显式构造掩码
+    actual = fused(x, x, x, is_causal=True)
+    assert torch.allclose(expected, actual, atol=ATOL), (expected - actual).abs().max()
+
+
+def test_fused_cross_attention_matches_reference():
+    torch.manual_seed(0)
+    reference, fused = make_attention_pair()
+    x = torch.randn(2, 6, 64)
+    memory = torch.randn(2, 9, 64)
+    # 第二个样本的最后 3 个位置是填充
+    src_mask = torch.ones(2, 1, 1, 9, dtype=torch.bool)
+    src_mask[1, ..., 6:] = False
+
+    expected = reference(x, memory, memory, src_mask)
+    actual = fused(x, memory, memory, src_mask)
+    assert torch.allclose(expected, actual, atol=ATOL), (expected - actual).abs().max()
+
+
+def test_causal_combined_with_padding_mask():
+    torch.manual_seed(0)
+    reference, fused = make_attention_pair()
+    x = torch.randn(2, 10, 64)
+    # 第二个样本的最后 4 个位置是填充，同时要求因果关系
+    pad_mask = torch.ones(2, 1, 1, 10, dtype=torch.bool)
+    pad_mask[1, ..., 6:] = False
+
+    expected = reference(x, x, x, pad_mask & causal_mask(10))
+    chunked = MultiHeadAttention(64, 4, attn_impl="chunked", chunk_size=4)
+    chunked.load_state_dict(reference.state_dict())
+    for module in (reference, fused, chunked):
+        actual = module(x, x, x, pad_mask, is_causal=True)
+        assert torch.allclose(expected, actual, atol=ATOL), (module.attn_impl, (expected - actual).abs().max())
+
+
+def test_kv_cache_matches_full_decoding():
+    torch.manual_seed(0)
+    decoder = TransformerDecoder(vocab_size=50, d_model=32, num_heads=4, d_ff=64, num_layers=2).eval()
+    encoder_output = torch.randn(2, 7, 32)
+
+    full = greedy_decode(decoder, encoder_output, None, bos_id=1, eos_id=-1, max_len=12, use_cache=False)
+    cached = greedy_decode(decoder, encoder_output, None, bos_id=1, eos_id=-1, max_len=12, use_cache=True)
+    assert torch.equal(full, cached)
+
+    set_attn_impl(decoder, "reference")
+    assert torch.equal(full, greedy_decode(decoder, encoder_output, None, bos_id=1, eos_id=-1, max_len=12))
+
+
+def test_chunked_attention_matches_dense():
+    torch.manual_seed(0)
+    reference = MultiHeadAttention(64, 4, attn_impl="reference")
+    # 序列长度 37 不是 chunk_size 的整数倍，覆盖最后一个不完整的块
+    x = torch.randn(2, 37, 64)
+    memory = torch.randn(2, 53, 64)
+    src_mask = torch.ones(2, 1, 1, 53, dtype=torch.bool)
+    src_mask[1, ..., 40:] = False
+
+    for chunk_size in (1, 8, 16, 64):
+        chunked = MultiHeadAttention(64, 4, attn_impl="chunked", chunk_size=chunk_size)
+        chunked.load_state_dict(reference.state_dict())
+        for args, kwargs in [((x, x, x), {"is_causal": True}),
+                             ((x, memory, memory, src_mask), {}),
+                             ((x, x, x, causal_mask(37)), {})]:
+            expected = reference(*args, **kwargs)
+            actual = chunked(*args, **kwargs)
+            assert torch.allclose(expected, actual, atol=ATOL), (chunk_size, (expected - actual).abs().max())
+
+
+def test_chunked_causal_with_cached_prefix():
+    torch.manual_seed(0)
+    # 查询比键短 (增量解码时一次输入多个新 token)，查询对齐到键序列的末尾
+    Q, K, V = torch.randn(1, 2, 5, 16), torch.randn(1, 2, 21, 16), torch.randn(1, 2, 21, 16)
+    scores = torch.matmul(Q, K.transpose(-2, -1)) / 4.0
+    scores = scores.masked_fill(~causal_mask(5, k_size=21), -1e9)
+    expected = torch.matmul(torch.softmax(scores, dim=-1), V)
+    actual = chunked_attention(Q, K, V, is_causal=True, chunk_size=4)
+    assert torch.allclose(expected, actual, atol=ATOL), (expected - actual).abs().max()
+
+
+def test_int8_inference_close_to_fp32():
+    from inference import prepare_for_inference, accuracy_report
+
+    for fused_qkv in (False, True):
+        torch.manual_seed(0)
+        decoder = TransformerDecoder(vocab_size=100, d_model=64, num_heads=4, d_ff=128, num_layers=2,
+                                     fused_qkv=fused_qkv).eval()
+        int8_decoder = prepare_for_inference(decoder, quantize=True)
+        assert not any(isinstance(m, torch.nn.Dropout) for m in int8_decoder.modules())
+
+        tgt = torch.randint(0, 100, (2, 12))
+        encoder_output = torch.randn(2, 9, 64)
+        report = accuracy_report(decoder, int8_decoder, tgt, encoder_output, is_causal=True)
+        assert report["cosine_similarity"] > 0.99, (fused_qkv, report)
+
+        # 量化后的 W_qkv 也要支持交叉注意力的部分投影与增量解码
+        greedy_decode(int8_decoder, encoder_output, None, bos_id=1, eos_id=-1, max_len=6)
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"✅ {name}")
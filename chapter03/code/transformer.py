@@ -1,7 +1,65 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 import math
 
+# PyTorch 2.0 起提供融合的 scaled_dot_product_attention，不会显式生成完整的注意力矩阵
+SDPA_AVAILABLE = hasattr(F, "scaled_dot_product_attention")
+
+
+def chunked_attention(Q, K, V, mask=None, is_causal=False, chunk_size=128):
+    '''
+    Desc:
+        分块计算的缩放点积注意力 (online softmax)，结果与逐步计算的参照实现一致。
+        查询和键都按 chunk_size 分块，对每个查询块依次累加各个键块，并维护每行的运行最大值 m 与指数和 l：
+            m_new = max(m, 当前块得分的最大值)
+            l = l * exp(m - m_new) + sum(exp(s - m_new))
+            acc = acc * exp(m - m_new) + exp(s - m_new) @ V_块
+        最后 acc / l 即为 softmax(QK^T / sqrt(d_k)) V。
+        同一时刻只存在 (chunk_size, chunk_size) 大小的得分块，峰值内存为 O(seq·chunk) 而不是 O(seq²)。
+    '''
+    q_len, k_len, d_k = Q.size(-2), K.size(-2), Q.size(-1)
+    scale = 1.0 / math.sqrt(d_k)
+    # 带缓存时查询对齐到键序列的末尾，第 i 个查询的绝对位置是 offset + i
+    offset = k_len - q_len
+    if mask is not None:
+        # expand 只改变视图，不复制数据；这样 (batch, 1, 1, seq) 之类可广播的掩码也能按块切片
+        if mask.dtype != torch.bool:
+            mask = mask != 0
+        mask = mask.expand(*mask.shape[:-2], q_len, k_len)
+
+    output = torch.empty(*Q.shape[:-1], V.size(-1), dtype=Q.dtype, device=Q.device)
+    for q_start in range(0, q_len, chunk_size):
+        q_end = min(q_start + chunk_size, q_len)
+        q = Q[..., q_start:q_end, :] * scale
+        row_max = torch.full((*q.shape[:-1], 1), float("-inf"), dtype=Q.dtype, device=Q.device)
+        row_sum = torch.zeros_like(row_max)
+        acc = torch.zeros(*q.shape[:-1], V.size(-1), dtype=Q.dtype, device=Q.device)
+
+        for k_start in range(0, k_len, chunk_size):
+            # 因果注意力中，位于对角线右上方的整个键块都看不到，直接跳过
+            if is_causal and k_start > offset + q_end - 1:
+                break
+            k_end = min(k_start + chunk_size, k_len)
+            scores = torch.matmul(q, K[..., k_start:k_end, :].transpose(-2, -1))
+
+            if mask is not None:
+                scores = scores.masked_fill(~mask[..., q_start:q_end, k_start:k_end], -1e9)
+            if is_causal and k_end - 1 > offset + q_start:
+                q_pos = torch.arange(offset + q_start, offset + q_end, device=Q.device).unsqueeze(1)
+                k_pos = torch.arange(k_start, k_end, device=Q.device)
+                scores = scores.masked_fill(k_pos > q_pos, -1e9)
+
+            new_max = torch.maximum(row_max, scores.amax(dim=-1, keepdim=True))
+            probs = torch.exp(scores - new_max)
+            correction = torch.exp(row_max - new_max)
+            row_sum = row_sum * correction + probs.sum(dim=-1, keepdim=True)
+            acc = acc * correction + torch.matmul(probs, V[..., k_start:k_end, :])
+            row_max = new_max
+
+        output[..., q_start:q_end, :] = acc / row_sum
+    return output
+
 # --- 占位符模块，将在后续小节中实现 ---
 class PositionalEncoding(nn.Module):
     """
@@ -25,31 +83,75 @@ class PositionalEncoding(nn.Module):
         # 将 pe 注册为 buffer，这样它就不会被视为模型参数，但会随模型移动（例如 to(device)）
         self.register_buffer('pe', pe.unsqueeze(0))
 
-    def forward(self, x: torch.Tensor) -> torch.Tensor:
+    def forward(self, x: torch.Tensor, offset: int = 0) -> torch.Tensor:
         # x.size(1) 是当前输入的序列长度
+        # offset 是输入第一个位置的下标，增量解码时每次只输入一个新 token，需要从已生成的长度开始取位置编码
         # 将位置编码加到输入向量上
-        x = x + self.pe[:, :x.size(1)]
+        x = x + self.pe[:, offset:offset + x.size(1)]
         return self.dropout(x)
 
 class MultiHeadAttention(nn.Module):
     """
     多头注意力机制模块
+    - 默认使用独立的 W_q/W_k/W_v 投影；fused_qkv=True 时合并为一个 W_qkv 线性层，自注意力只需一次矩阵乘法，
+      两种布局的 state_dict 可以互相加载；
+    - attn_impl 选择注意力的计算方式: "auto" (有 SDPA 时使用 SDPA)、"sdpa"、"reference" (逐步计算的教学版本)、
+      "chunked" (分块 online softmax，适合长序列，峰值内存不随序列长度平方增长)。
     """
-    def __init__(self, d_model, num_heads):
+    def __init__(self, d_model, num_heads, fused_qkv=False, attn_impl="auto", chunk_size=128):
         super(MultiHeadAttention, self).__init__()
         assert d_model % num_heads == 0, "d_model 必须能被 num_heads 整除"
+        assert attn_impl in ("auto", "sdpa", "reference", "chunked"), f"未知的 attn_impl: {attn_impl}"
+        if attn_impl == "sdpa" and not SDPA_AVAILABLE:
+            raise RuntimeError("当前 PyTorch 版本没有 scaled_dot_product_attention，请升级到 2.0 以上或使用 'reference'。")
 
         self.d_model = d_model
         self.num_heads = num_heads
         self.d_k = d_model // num_heads
+        self.fused_qkv = fused_qkv
+        self.attn_impl = attn_impl
+        self.chunk_size = chunk_size
 
         # 定义 Q, K, V 和输出的线性变换层
-        self.W_q = nn.Linear(d_model, d_model)
-        self.W_k = nn.Linear(d_model, d_model)
-        self.W_v = nn.Linear(d_model, d_model)
+        if fused_qkv:
+            # 权重按 [W_q; W_k; W_v] 的顺序上下拼接，形状 (3 * d_model, d_model)
+            self.W_qkv = nn.Linear(d_model, 3 * d_model)
+        else:
+            self.W_q = nn.Linear(d_model, d_model)
+            self.W_k = nn.Linear(d_model, d_model)
+            self.W_v = nn.Linear(d_model, d_model)
         self.W_o = nn.Linear(d_model, d_model)
 
-    def scaled_dot_product_attention(self, Q, K, V, mask=None):
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # 兼容两种参数布局：分开的 W_q/W_k/W_v 与合并的 W_qkv 可以互相加载，旧的 state_dict 依然可用
+        separate = [f"{prefix}{name}." for name in ("W_q", "W_k", "W_v")]
+        fused = f"{prefix}W_qkv."
+        for suffix in ("weight", "bias"):
+            if self.fused_qkv and all(p + suffix in state_dict for p in separate):
+                state_dict[fused + suffix] = torch.cat([state_dict.pop(p + suffix) for p in separate], dim=0)
+            elif not self.fused_qkv and fused + suffix in state_dict:
+                for p, part in zip(separate, state_dict.pop(fused + suffix).chunk(3, dim=0)):
+                    state_dict[p + suffix] = part
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+    def scaled_dot_product_attention(self, Q, K, V, mask=None, is_causal=False):
+        if self.attn_impl == "chunked":
+            return chunked_attention(Q, K, V, mask, is_causal, self.chunk_size)
+
+        # 同时有填充掩码与因果关系，或查询比键短 (内置的 is_causal 按左上角对齐) 时，合并成一个显式掩码，两者都生效
+        if is_causal and (mask is not None or Q.size(-2) != K.size(-2)):
+            causal = causal_mask(Q.size(-2), Q.device, K.size(-2))
+            mask, is_causal = causal if mask is None else (mask != 0) & causal, False
+
+        if self.attn_impl != "reference" and SDPA_AVAILABLE:
+            # 融合实现不会显式生成 -1e9 的掩码副本；掩码约定为 True/非 0 表示可以关注
+            if mask is not None and mask.dtype != torch.bool:
+                mask = mask != 0
+            return F.scaled_dot_product_attention(Q, K, V, attn_mask=mask, is_causal=is_causal)
+
+        if is_causal:
+            mask = causal_mask(Q.size(-2), Q.device, K.size(-2))
+
         # 1. 计算注意力得分 (Q * K^T)
         # K.transpose(-2, -1) 最后两个维度互换位置
         # d_k 为嵌入层的维度，即词表的大小
@@ -81,14 +183,51 @@ class MultiHeadAttention(nn.Module):
         # contiguous() 函数实现将张量在内存中连续存储，保障可以进行 view 操作(针对维度聚合情况)
         return x.transpose(1, 2).contiguous().view(batch_size, seq_length, self.d_model)
 
-    def forward(self, Q, K, V, mask=None):
+    def _project(self, x, start, end):
+        # 使用 W_qkv 中第 start..end 个投影 (0/1/2 分别对应 Q/K/V)，权重切片是视图，不会复制
+        # 返回形状 (end - start, batch_size, num_heads, seq_length, d_k)
+        if self.fused_qkv and (start, end) == (0, 3):
+            out = self.W_qkv(x)
+        elif self.fused_qkv and isinstance(self.W_qkv, nn.Linear):
+            rows = slice(start * self.d_model, end * self.d_model)
+            out = F.linear(x, self.W_qkv.weight[rows], self.W_qkv.bias[rows])
+        elif self.fused_qkv:
+            # 量化后的线性层 (见 inference.py) 不能按行切片权重，只能计算完整投影后再截取
+            out = self.W_qkv(x)[..., start * self.d_model:end * self.d_model]
+        else:
+            out = torch.cat([layer(x) for layer in (self.W_q, self.W_k, self.W_v)[start:end]], dim=-1)
+        batch_size, seq_length, _ = x.size()
+        return out.view(batch_size, seq_length, end - start, self.num_heads, self.d_k).permute(2, 0, 3, 1, 4)
+
+    def forward(self, Q, K, V, mask=None, cache=None, static_kv=False, is_causal=False):
+        '''
+        Desc:
+            cache 为增量解码使用的 K/V 缓存字典 (可选):
+            - 自注意力 (static_kv=False): 只对新输入的 token 计算 K/V，并拼接到缓存的 K/V 之后；
+            - 交叉注意力 (static_kv=True): encoder_output 在解码过程中不变，K/V 只在第一步计算一次，之后直接复用。
+            is_causal=True 时按因果关系屏蔽未来位置，可以代替显式传入的下三角 tgt_mask。
+        '''
         # 1. 对 Q, K, V 进行线性变换
-        Q = self.split_heads(self.W_q(Q))
-        K = self.split_heads(self.W_k(K))
-        V = self.split_heads(self.W_v(V))
+        if Q is K and K is V and not static_kv:
+            # 自注意力: 一次矩阵乘法同时得到 Q, K, V
+            Q, K, V = self._project(Q, 0, 3)
+        else:
+            Q = self._project(Q, 0, 1)[0]
+            if not (static_kv and cache is not None and "k" in cache):
+                K, V = self._project(K, 1, 3) if K is V else (self._project(K, 1, 2)[0], self._project(V, 2, 3)[0])
+
+        if cache is not None:
+            if static_kv and "k" in cache:
+                K, V = cache["k"], cache["v"]
+            else:
+                if not static_kv and "k" in cache:
+                    # 在序列维度 (dim=2) 上拼接历史 K/V，形状为 (batch_size, num_heads, seq_length, d_k)
+                    K = torch.cat([cache["k"], K], dim=2)
+                    V = torch.cat([cache["v"], V], dim=2)
+                cache["k"], cache["v"] = K, V
 
         # 2. 计算缩放点积注意力
-        attn_output = self.scaled_dot_product_attention(Q, K, V, mask)
+        attn_output = self.scaled_dot_product_attention(Q, K, V, mask, is_causal)
 
         # 3. 合并多头输出并进行最终的线性变换
         output = self.W_o(self.combine_heads(attn_output))
@@ -118,9 +257,9 @@ class PositionWiseFeedForward(nn.Module):
 
 # --- 编码器核心层 ---
 class EncoderLayer(nn.Module):
-    def __init__(self, d_model, num_heads, d_ff, dropout):
+    def __init__(self, d_model, num_heads, d_ff, dropout, fused_qkv=False, attn_impl="auto"):
         super(EncoderLayer, self).__init__()
-        self.self_attn = MultiHeadAttention(d_model, num_heads)
+        self.self_attn = MultiHeadAttention(d_model, num_heads, fused_qkv=fused_qkv, attn_impl=attn_impl)
         self.feed_forward = PositionWiseFeedForward(d_model, d_ff)
         self.norm1 = nn.LayerNorm(d_model)
         self.norm2 = nn.LayerNorm(d_model)
@@ -140,33 +279,184 @@ class EncoderLayer(nn.Module):
 
 # --- 解码器核心层 ---
 class DecoderLayer(nn.Module):
-    def __init__(self, d_model, num_heads, d_ff, dropout):
+    def __init__(self, d_model, num_heads, d_ff, dropout, fused_qkv=False, attn_impl="auto"):
         super(DecoderLayer, self).__init__()
-        self.self_attn = MultiHeadAttention(d_model, num_heads)
-        self.cross_attn = MultiHeadAttention(d_model, num_heads)
+        self.self_attn = MultiHeadAttention(d_model, num_heads, fused_qkv=fused_qkv, attn_impl=attn_impl)
+        self.cross_attn = MultiHeadAttention(d_model, num_heads, fused_qkv=fused_qkv, attn_impl=attn_impl)
         self.feed_forward = PositionWiseFeedForward(d_model, d_ff)
         self.norm1 = nn.LayerNorm(d_model)
         self.norm2 = nn.LayerNorm(d_model)
         self.norm3 = nn.LayerNorm(d_model)
         self.dropout = nn.Dropout(dropout)
 
-    def forward(self, x, encoder_output, src_mask, tgt_mask):
+    def forward(self, x, encoder_output, src_mask, tgt_mask, cache=None, is_causal=False):
         '''
         Desc:
             解码器的输出也从 <BOS> 开始，例如：翻译任务
+            cache 为该层的增量解码缓存 (由 TransformerDecoder.init_cache 创建)。
+            使用缓存时 x 只包含新生成的 token，之前 token 的 K/V 从缓存中读取，
+            单个新 token 可以看到全部历史，因此不再需要 tgt_mask。
+            is_causal=True 时不需要构造 tgt_mask，由注意力内部按因果关系屏蔽未来位置。
         '''
+        self_cache = cache.setdefault("self", {}) if cache is not None else None
+        cross_cache = cache.setdefault("cross", {}) if cache is not None else None
+
         # 1. 掩码多头自注意力 (对自己)
         # 每次解码器更新输出后，掩码矩阵 tgt_mask 新增一行
-        attn_output = self.self_attn(x, x, x, tgt_mask)
+        attn_output = self.self_attn(x, x, x, tgt_mask, cache=self_cache, is_causal=is_causal)
         x = self.norm1(x + self.dropout(attn_output))
 
         # 2. 交叉注意力 (对编码器输出)
         # 解码器的输出字符是一个个预测的，也就是说，每次预测下一个词，都需要结合全局的上下文信息
-        cross_attn_output = self.cross_attn(x, encoder_output, encoder_output, src_mask)
+        cross_attn_output = self.cross_attn(x, encoder_output, encoder_output, src_mask, cache=cross_cache, static_kv=True)
         x = self.norm2(x + self.dropout(cross_attn_output))
 
         # 3. 前馈网络
         ff_output = self.feed_forward(x)
         x = self.norm3(x + self.dropout(ff_output))
 
-        return x
\ No newline at end of file
+        return x
+
+
+def causal_mask(size: int, device=None, k_size: int = None) -> torch.Tensor:
+    # 下三角矩阵，形状 (1, 1, size, k_size)，位置 i 只能看到 0..i
+    # k_size 大于 size 时 (前面有缓存的 K/V)，查询对齐到键序列的末尾
+    k_size = k_size or size
+    return torch.tril(torch.ones(1, 1, size, k_size, dtype=torch.bool, device=device), diagonal=k_size - size)
+
+def set_attn_impl(model: nn.Module, attn_impl: str):
+    # 切换模型中所有多头注意力的计算方式，例如教学演示时改回 "reference"
+    for module in model.modules():
+        if isinstance(module, MultiHeadAttention):
+            module.attn_impl = attn_impl
+    return model
+
+# --- 解码器堆栈与自回归生成 ---
+class TransformerDecoder(nn.Module):
+    """
+    词嵌入 + 位置编码 + N 层 DecoderLayer + 输出投影，支持 K/V 缓存的增量解码
+    """
+    def __init__(self, vocab_size, d_model, num_heads, d_ff, num_layers, dropout=0.1, max_len=5000,
+                 fused_qkv=False, attn_impl="auto"):
+        super(TransformerDecoder, self).__init__()
+        self.d_model = d_model
+        self.embedding = nn.Embedding(vocab_size, d_model)
+        self.positional_encoding = PositionalEncoding(d_model, dropout, max_len)
+        self.layers = nn.ModuleList([
+            DecoderLayer(d_model, num_heads, d_ff, dropout, fused_qkv=fused_qkv, attn_impl=attn_impl)
+            for _ in range(num_layers)
+        ])
+        self.fc_out = nn.Linear(d_model, vocab_size)
+
+    def init_cache(self):
+        # 每层一个缓存字典: {"self": {"k", "v"}, "cross": {"k", "v"}}
+        return [{} for _ in self.layers]
+
+    def forward(self, tgt, encoder_output, src_mask=None, tgt_mask=None, cache=None, offset=0, is_causal=False):
+        '''
+        Desc:
+            不使用缓存时 tgt 为完整的目标前缀；使用缓存时 tgt 只包含新 token，offset 为它们的起始位置。
+            返回形状 (batch_size, tgt_length, vocab_size) 的 logits
+        '''
+        x = self.positional_encoding(self.embedding(tgt) * math.sqrt(self.d_model), offset=offset)
+        for i, layer in enumerate(self.layers):
+            x = layer(x, encoder_output, src_mask, tgt_mask, cache=cache[i] if cache is not None else None, is_causal=is_causal)
+        return self.fc_out(x)
+
+@torch.no_grad()
+def greedy_decode(decoder, encoder_output, src_mask, bos_id, eos_id, max_len=50, use_cache=True):
+    '''
+    Desc:
+        贪心解码。use_cache=True 时每步只处理一个新 token，复用各层缓存的 K/V，每步计算量为 O(n)；
+        use_cache=False 时每步重新计算整个前缀 (教学用的参照实现)，每步计算量为 O(n²)。
+    '''
+    batch_size = encoder_output.size(0)
+    device = encoder_output.device
+    ys = torch.full((batch_size, 1), bos_id, dtype=torch.long, device=device)
+    finished = torch.zeros(batch_size, dtype=torch.bool, device=device)
+    cache = decoder.init_cache() if use_cache else None
+
+    for step in range(max_len - 1):
+        if use_cache:
+            logits = decoder(ys[:, -1:], encoder_output, src_mask, None, cache=cache, offset=step)
+        else:
+            logits = decoder(ys, encoder_output, src_mask, None, is_causal=True)
+
+        next_token = logits[:, -1].argmax(dim=-1)
+        # 已经结束的序列持续填充 <EOS>
+        next_token = next_token.masked_fill(finished, eos_id)
+        ys = torch.cat([ys, next_token.unsqueeze(1)], dim=1)
+        finished |= next_token == eos_id
+        if finished.all():
+            break
+
+    return ys
+
+@torch.no_grad()
+def beam_search(decoder, encoder_output, src_mask, bos_id, eos_id, max_len=50, beam_size=4, length_penalty=1.0):
+    '''
+    Desc:
+        使用 K/V 缓存的束搜索，仅支持 batch_size = 1。
+        每一步选出的候选可能来自不同的旧束，因此自注意力缓存需要按 beam_idx 重新排列；
+        交叉注意力缓存在各个束之间完全相同，无需重排。
+    '''
+    assert encoder_output.size(0) == 1, "beam_search 仅支持 batch_size = 1"
+    device = encoder_output.device
+    encoder_output = encoder_output.expand(beam_size, -1, -1)
+    if src_mask is not None:
+        src_mask = src_mask.expand(beam_size, *src_mask.shape[1:])
+
+    ys = torch.full((beam_size, 1), bos_id, dtype=torch.long, device=device)
+    # 初始时只有第一个束有效，避免选出 beam_size 个完全相同的候选
+    scores = torch.full((beam_size,), float("-inf"), device=device)
+    scores[0] = 0.0
+    cache = decoder.init_cache()
+    finished = [] # (归一化得分, 序列)
+
+    for step in range(max_len - 1):
+        logits = decoder(ys[:, -1:], encoder_output, src_mask, None, cache=cache, offset=step)
+        log_probs = torch.log_softmax(logits[:, -1], dim=-1)
+        vocab_size = log_probs.size(-1)
+
+        total = (scores.unsqueeze(1) + log_probs).view(-1)
+        top_scores, top_idx = total.topk(beam_size)
+        beam_idx = torch.div(top_idx, vocab_size, rounding_mode="floor")
+        tokens = top_idx % vocab_size
+
+        ys = torch.cat([ys[beam_idx], tokens.unsqueeze(1)], dim=1)
+        scores = top_scores
+        for layer_cache in cache:
+            self_cache = layer_cache["self"]
+            self_cache["k"] = self_cache["k"].index_select(0, beam_idx)
+            self_cache["v"] = self_cache["v"].index_select(0, beam_idx)
+
+        # 以 <EOS> 结尾的束进入结果集合，并从后续搜索中移除
+        for i in (tokens == eos_id).nonzero().flatten().tolist():
+            if torch.isfinite(scores[i]):
+                finished.append((scores[i].item() / (ys.size(1) ** length_penalty), ys[i]))
+            scores[i] = float("-inf")
+
+        if len(finished) >= beam_size or not torch.isfinite(scores).any():
+            break
+
+    if not finished:
+        finished = [(scores[i].item() / (ys.size(1) ** length_penalty), ys[i]) for i in range(beam_size)]
+    return max(finished, key=lambda item: item[0])[1].unsqueeze(0)
+
+
+if __name__ == '__main__':
+    import time
+
+    torch.manual_seed(0)
+    vocab_size, d_model, num_heads, d_ff, num_layers = 1000, 256, 8, 1024, 4
+    decoder = TransformerDecoder(vocab_size, d_model, num_heads, d_ff, num_layers).eval()
+    encoder_output = torch.randn(1, 32, d_model)
+
+    for use_cache in (False, True):
+        start = time.perf_counter()
+        # eos_id 取一个不会被生成的值，保证两种方式都生成满 max_len 个 token
+        ys = greedy_decode(decoder, encoder_output, None, bos_id=1, eos_id=-1, max_len=128, use_cache=use_cache)
+        elapsed = time.perf_counter() - start
+        print(f"use_cache={use_cache}: {ys.size(1)} tokens, {elapsed:.3f}s, {ys.size(1) / elapsed:.1f} tokens/s")
+
+    print("beam search:", beam_search(decoder, encoder_output, None, bos_id=1, eos_id=2, max_len=20).tolist())
@@ -1,30 +1,63 @@
 from llm import HelloAgentsLLM
 from tool import ToolExecutor
+from sandbox import SandboxPool, SnippetCache
 
-import sys
 import re
-import subprocess
 import ast
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 
 PLANNER_PROMPT_TEMPLATE = """
 你是一个顶级的AI规划专家。你的任务是将用户提出的复杂问题分解成一个由多个简单步骤组成的行动计划。
 请确保计划中的每个步骤都是一个独立的、可执行的子任务，并且严格按照逻辑顺序排列。
 你的输出必须是一个Python列表，其中每个元素都是一个描述子任务的字符串。
+如果某些步骤之间相互独立，可以把该步骤写成字典 {{"step": "子任务描述", "depends_on": [所依赖步骤的编号]}}，
+步骤编号从 1 开始，只能依赖排在它前面的步骤；depends_on 为空列表表示该步骤不依赖任何步骤，可以与其他步骤并行执行。
+直接写成字符串的步骤默认依赖它的前一个步骤。
 
 问题: {question}
 
 请严格按照以下格式输出你的计划, ```python、与```作为前后缀是必要的:
 ```python
-["步骤1", "步骤2", "步骤3", ...]
+["步骤1", {{"step": "步骤2", "depends_on": []}}, {{"step": "步骤3", "depends_on": [1, 2]}}, ...]
 ```
 """
 
+
+def normalize_plan(plan: list) -> list[dict]:
+    """
+    将计划统一转换为 {"id", "step", "depends_on"} 形式的步骤列表。
+    - 字符串步骤依赖它的前一个步骤，保持原先顺序执行的语义；
+    - 只保留指向更早步骤的依赖，保证计划是一个有向无环图；
+    - 计划来自模型输出，depends_on 可能是单个数字或包含任意值，无法识别的依赖被忽略，
+      全部无效时退回默认的"依赖前一个步骤"。
+    """
+    steps = []
+    for i, item in enumerate(plan, start=1):
+        default = [i - 1] if i > 1 else []
+        if isinstance(item, dict):
+            step = str(item.get("step", ""))
+            depends_on = item.get("depends_on", default)
+            if not isinstance(depends_on, (list, tuple)):
+                depends_on = [depends_on]
+        else:
+            step = str(item)
+            depends_on = default
+
+        valid = sorted({d for d in depends_on if isinstance(d, int) and not isinstance(d, bool) and 1 <= d < i})
+        if len(valid) != len(depends_on):
+            print(f"⚠️ 步骤 {i} 的依赖 {depends_on} 中包含无效或重复的编号，已忽略。")
+            if not valid:
+                valid = default
+        steps.append({"id": i, "step": step, "depends_on": valid})
+    return steps
+
 class Planner:
     def __init__(self, llm_client):
         self.llm_client = llm_client
 
-    def plan(self, question: str) -> list[str]:
+    def plan(self, question: str) -> list:
         """
         根据用户问题生成一个行动计划。
         """
@@ -91,64 +124,141 @@ EXECUTOR_PROMPT_TEMPLATE = """
 
 
 class Executor:
-    def __init__(self, llm_client):
+    def __init__(self, llm_client, sandbox: SandboxPool = None, max_parallel: int = 4):
+        """
+        sandbox 为执行生成代码所用的预热沙箱进程池，未提供时在首次执行代码时创建，并由 close() 负责关闭。
+        max_parallel 为可同时执行的最大步骤数。
+        """
         self.llm_client = llm_client
+        self.sandbox = sandbox
+        self.max_parallel = max_parallel
+        self._owns_sandbox = False
+        self._sandbox_lock = threading.Lock() # 并发执行的步骤可能同时第一次用到沙箱
+
+    def _get_sandbox(self) -> SandboxPool:
+        with self._sandbox_lock:
+            if self.sandbox is None:
+                self.sandbox = SandboxPool(size=self.max_parallel, timeout=30)
+                self._owns_sandbox = True
+            return self.sandbox
+
+    def close(self):
+        """
+        关闭执行器自己创建的沙箱进程池；外部传入的进程池由调用方负责关闭。
+        """
+        with self._sandbox_lock:
+            if self._owns_sandbox:
+                self.sandbox.close()
+                self.sandbox = None
+                self._owns_sandbox = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
-    def execute(self, question: str, plan: list[str]) -> str:
+    def _run_code(self, code: str) -> str:
         """
-        根据计划，逐步执行并解决问题。
+        在沙箱中执行代码，返回标准输出；执行失败时返回错误信息。
         """
-        history = "" # 用于存储历史步骤和结果的字符串
+        result = self._get_sandbox().run(code)
+        print(f"⏱️ 代码执行耗时 {result.runtime * 1000:.1f} ms，退出码 {result.exit_code}")
+        if result.exit_code != 0:
+            print(f"⚠️ 代码执行出错:\n{result.stderr}")
+            return result.stdout.strip() or f"代码执行出错:\n{result.stderr.strip()}"
+        return result.stdout.strip()
+
+    def execute(self, question: str, plan: list) -> str:
+        """
+        根据计划执行并解决问题。
+        计划被视为一个依赖图：所有依赖都已完成的步骤会被并发执行，
+        每个步骤只看到它的祖先步骤的结果，而不是完整的历史记录。
+        """
+        steps = normalize_plan(plan)
+        plan_desc = [step["step"] for step in steps]
+        results = {}
 
         print("\n--- 正在执行计划 ---")
 
-        for i, step in enumerate(plan):
-            print(f"\n-> 正在执行步骤 {i+1}/{len(plan)}: {step}")
-
-            prompt = EXECUTOR_PROMPT_TEMPLATE.format(
-                question=question,
-                plan=plan,
-                history=history if history else "无", # 如果是第一步，则历史为空
-                current_step=step
-            )
-
-            messages = [{"role": "user", "content": prompt}]
-            response_text = self.llm_client.think(messages=messages) or ""
-
-            if '```python' in response_text:
-                print(f'🧮 该问题优先使用编程解决')
-                # 匹配 ```python 开头，``` 结尾的代码块
-                pattern = r'```python(.*?)```'
-                matches = re.findall(pattern, response_text, re.DOTALL)
-
-                # 清理每段代码（去除前后空白）
-                code_blocks = [match.strip() for match in matches]
-                # 将代码保存到临时文件执行
-                with open('temp_code.py', 'w', encoding='utf-8') as f:
-                    f.write(code_blocks[0])
-
-                # 执行并捕获输出
-                result = subprocess.run([sys.executable, 'temp_code.py'],
-                                    capture_output=True, text=True, timeout=30)
-                response_text = result.stdout.strip()
-
-            # NOTE: 更新历史记录，为下一步做准备
-            history += f"步骤 {i+1}: {step}\n结果: {response_text}\n\n"
-            print(f"✅ 步骤 {i+1} 已完成，结果: {response_text}")
-
-        # 循环结束后，最后一步的响应就是最终答案
-        final_answer = response_text
+        with ThreadPoolExecutor(max_workers=self.max_parallel) as pool:
+            running = {}
+            pending = list(steps)
+            while pending or running:
+                # 提交所有依赖已经满足的步骤
+                ready = [step for step in pending if all(d in results for d in step["depends_on"])]
+                for step in ready:
+                    pending.remove(step)
+                    print(f"\n-> 正在执行步骤 {step['id']}/{len(steps)}: {step['step']}")
+                    history = self._ancestor_history(step, steps, results)
+                    future = pool.submit(self._execute_step, question, plan_desc, history, step["step"])
+                    running[future] = step
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    step = running.pop(future)
+                    results[step["id"]] = future.result()
+                    print(f"✅ 步骤 {step['id']} 已完成，结果: {results[step['id']]}")
+
+        # 最后一步的响应就是最终答案
+        final_answer = results[steps[-1]["id"]] if steps else ""
         return final_answer
 
+    def _ancestor_history(self, step: dict, steps: list[dict], results: dict) -> str:
+        """
+        收集某个步骤所有祖先步骤 (直接与间接依赖) 的结果，按步骤编号排序。
+        """
+        ancestors = set()
+        frontier = list(step["depends_on"])
+        while frontier:
+            d = frontier.pop()
+            if d not in ancestors:
+                ancestors.add(d)
+                frontier.extend(steps[d - 1]["depends_on"])
+
+        return "".join(
+            f"步骤 {d}: {steps[d - 1]['step']}\n结果: {results[d]}\n\n"
+            for d in sorted(ancestors)
+        )
+
+    def _execute_step(self, question: str, plan: list[str], history: str, current_step: str) -> str:
+        """
+        执行单个步骤：调用LLM，如果返回的是代码则在沙箱中运行。
+        并发执行时逐块打印会相互穿插，因此这里静默收集完整响应。
+        """
+        prompt = EXECUTOR_PROMPT_TEMPLATE.format(
+            question=question,
+            plan=plan,
+            history=history if history else "无", # 没有祖先步骤时，历史为空
+            current_step=current_step
+        )
+
+        messages = [{"role": "user", "content": prompt}]
+        response_text = "".join(self.llm_client.stream_think(messages=messages))
+
+        if '```python' in response_text:
+            print(f'🧮 该问题优先使用编程解决')
+            # 匹配 ```python 开头，``` 结尾的代码块
+            pattern = r'```python(.*?)```'
+            matches = re.findall(pattern, response_text, re.DOTALL)
+
+            # 清理每段代码（去除前后空白）
+            code_blocks = [match.strip() for match in matches]
+            # 直接把代码提交到预热的沙箱进程中执行并捕获输出
+            response_text = self._run_code(code_blocks[0])
+
+        return response_text
+
 
 class PlanAndSolveAgent:
-    def __init__(self, llm_client: HelloAgentsLLM):
+    def __init__(self, llm_client: HelloAgentsLLM, sandbox: SandboxPool = None):
         """
         初始化智能体，同时创建规划器和执行器实例。
+        多个智能体可以共享同一个沙箱进程池。
         """
         self.llm_client = llm_client
         self.planner = Planner(self.llm_client)
-        self.executor = Executor(self.llm_client)
+        self.executor = Executor(self.llm_client, sandbox)
 
     def run(self, question: str):
         """
@@ -168,11 +278,21 @@ class PlanAndSolveAgent:
         final_answer = self.executor.execute(question, plan)
         print(f"\n--- 任务完成 ---\n最终答案: {final_answer}")
 
+    def close(self):
+        self.executor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
 
 
 if __name__ == '__main__':
     llm_client = HelloAgentsLLM(Provider='ModelScope')
     tool_executor = ToolExecutor()
 
-    plan_solve_agent = PlanAndSolveAgent(llm_client)
-    plan_solve_agent.run('Zorro每周一、三、五游泳，游泳馆的票价为40元/次，请问在2025年11月份，Zorro游泳一共需要花多少钱？')
\ No newline at end of file
+    with SandboxPool(size=2, timeout=30, cache=SnippetCache()) as sandbox:
+        plan_solve_agent = PlanAndSolveAgent(llm_client, sandbox)
+        plan_solve_agent.run('Zorro每周一、三、五游泳，游泳馆的票价为40元/次，请问在2025年11月份，Zorro游泳一共需要花多少钱？')
\ No newline at end of file
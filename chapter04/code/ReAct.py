@@ -3,13 +3,15 @@ from tool import (
     search,
     )
 from llm import HelloAgentsLLM
+from compaction import HistoryCompactor, SlidingWindowCompactor
 
 import re
 
 
 
-# ReAct 提示词模板
-REACT_PROMPT_TEMPLATE = """
+# ReAct 系统提示词模板 (静态前缀)
+# 只依赖工具集，每个工具集版本只渲染一次，保证多轮请求的前缀完全一致，便于服务端复用 Prompt 缓存
+REACT_SYSTEM_PROMPT_TEMPLATE = """
 请注意，你是一个有能力调用外部工具的智能助手，特别是当你掌握的知识范围、或时效性不足以回答用户的问题时。
 
 可用工具如下:
@@ -22,92 +24,248 @@ Action: 你决定采取的行动，必须是以下格式之一:
 - `{{tool_name}}[{{tool_input}}]`: 调用一个可用工具。
 - `Finish[最终答案]`: 当你认为已经获得最终答案时。
 
+如果需要多个相互独立的工具调用 (例如同时搜索几个不同的问题)，可以连续输出多行 Action，每行一个调用，它们会被并行执行。
+Finish 必须单独作为唯一的 Action 出现。
+
 回应的格式范例：
 Thought: 搜索[今天的天气]
 Action: Finish[小雨]
+"""
 
+# 问题模板，历史记录以独立的 assistant / user 消息追加在其后
+REACT_QUESTION_TEMPLATE = """
 现在，请开始解决以下问题:
 Question: {question}
-History: {history}
 """
 
 
+class ReActStreamParser:
+    """
+    ReAct 输出的增量解析器。
+    逐块接收模型的流式输出，收集连续出现的 `Action: tool[input]` 行。
+    出现 `Action: Finish[...]`，或在 Action 之后出现了其他内容 (例如模型编造的 Observation) 时，
+    就通知调用方停止生成，避免浪费输出 token。
+    """
+    THOUGHT_PATTERN = re.compile(r"Thought: (.*)")
+    ACTION_PATTERN = re.compile(r"Action: (.*)")
+    CALL_PATTERN = re.compile(r"\w+\[.*\]")
+
+    def __init__(self):
+        self.chunks = []
+        self.thought = None
+        self.actions = []
+        self._tail = "" # 尚未遇到换行符的最后一行
+
+    @property
+    def text(self) -> str:
+        return "".join(self.chunks)
+
+    def feed(self, chunk: str) -> bool:
+        """
+        输入一块新的输出，返回 True 表示 Action 已经完整，可以停止生成。
+        """
+        self.chunks.append(chunk)
+        lines = (self._tail + chunk).split("\n")
+        self._tail = lines.pop()
+
+        for line in lines:
+            if self._consume_line(line):
+                return True
+        return self._check_tail()
+
+    def finish(self):
+        """
+        流结束后调用，返回 (thought, actions)。
+        """
+        if self._tail:
+            self._consume_line(self._tail)
+            self._tail = ""
+        return self.thought, self.actions
+
+    def _consume_line(self, line: str) -> bool:
+        """
+        处理一个完整的行，返回是否可以停止生成。
+        """
+        if self.thought is None and not self.actions:
+            thought_match = self.THOUGHT_PATTERN.search(line)
+            if thought_match:
+                self.thought = thought_match.group(1).strip()
+
+        action_match = self.ACTION_PATTERN.search(line)
+        if action_match:
+            action = action_match.group(1).strip()
+            self.actions.append(action)
+            return action.startswith("Finish")
+
+        # 已经拿到 Action 后又出现了其他非空内容，说明 Action 段落已经结束
+        return bool(self.actions and line.strip())
+
+    def _check_tail(self) -> bool:
+        """
+        检查尚未结束的最后一行，尽早判断是否可以停止生成。
+        """
+        stripped = self._tail.strip()
+        if not stripped:
+            return False
+
+        action_match = self.ACTION_PATTERN.search(stripped)
+        if action_match:
+            action = action_match.group(1).strip()
+            # Finish 必须单独出现；只有括号已经闭合才算完整，防止答案中的 ']' 被误判
+            if (action.startswith("Finish") and self.CALL_PATTERN.fullmatch(action)
+                    and action.count("[") == action.count("]")):
+                self.actions.append(action)
+                self._tail = ""
+                return True
+            return False
+
+        # 已有 Action，且当前行不可能是新的 Action 行
+        return bool(self.actions and not "Action: ".startswith(stripped[:len("Action: ")]))
+
+
 class ReActAgent:
-    def __init__(self, llm_client: HelloAgentsLLM, tool_executor: ToolExecutor, max_steps: int = 5):
+    def __init__(self, llm_client: HelloAgentsLLM, tool_executor: ToolExecutor, max_steps: int = 5, compactor: HistoryCompactor = None):
         self.llm_client = llm_client
         self.tool_executor = tool_executor
         self.max_steps = max_steps
-        self.history = []
+        self.compactor = compactor # 可选的历史压缩策略，控制历史消息的 token 预算
+        self.rounds = [] # 只追加的历史记录，每一轮是一个消息列表 (assistant 的 Action + user 的 Observation，或一条摘要)
+        self._system_message = None
+        self._system_version = None
+
+    @property
+    def history(self) -> list:
+        """按时间顺序展开的历史消息"""
+        return [message for r in self.rounds for message in r]
+
+    def _get_system_message(self) -> dict:
+        """
+        获取缓存的系统消息，仅在工具集版本变化时重新渲染。
+        """
+        version = self.tool_executor.version
+        if self._system_message is None or self._system_version != version:
+            tools_desc = self.tool_executor.getAvailableTools()
+            self._system_message = {
+                "role": "system",
+                "content": REACT_SYSTEM_PROMPT_TEMPLATE.format(tools=tools_desc),
+            }
+            self._system_version = version
+        return self._system_message
 
     def run(self, question: str):
         """
         运行ReAct智能体来回答一个问题。
         """
-        self.history = [] # 每次运行时重置历史记录
+        self.rounds = [] # 每次运行时重置历史记录
+        question_message = {"role": "user", "content": REACT_QUESTION_TEMPLATE.format(question=question)}
         current_step = 0
 
         while current_step < self.max_steps:
             current_step += 1
             print(f"--- 第 {current_step} 步 ---")
 
-            # 1. 格式化提示词
-            tools_desc = self.tool_executor.getAvailableTools()
-            history_str = "\n".join(self.history)
-
-            prompt = REACT_PROMPT_TEMPLATE.format(
-                tools=tools_desc,
-                question=question,
-                history=history_str
-            )
+            # 1. 组装消息：静态前缀 (系统提示词 + 问题) + 只追加的历史消息
+            messages = [self._get_system_message(), question_message, *self.history]
 
-            # 2. 调用LLM进行思考
-            messages = [{"role": "user", "content": prompt}]
-            response_text = self.llm_client.think(messages=messages)
+            # 2. 调用LLM进行思考，边生成边解析，Action 完整后立即停止生成
+            response_text, thought, actions = self._think_until_action(messages)
 
             if not response_text:
                 print("错误:LLM未能返回有效响应。")
                 break
 
-            # 3. 解析LLM的输出
-            thought, action = self._parse_output(response_text)
-
             if thought:
                 print(f"思考: {thought}")
 
-            if not action:
+            if not actions:
                 print("⛔️ 警告:未能解析出有效的Action，流程终止。")
                 break
 
-            # 4. 执行Action
-            if action.startswith("Finish"):
+            # 3. 执行Action
+            finish_action = next((action for action in actions if action.startswith("Finish")), None)
+            if finish_action:
                 # 如果是Finish指令，提取最终答案并结束
-                final_answer = re.match(r"Finish\[(.*)\]", action).group(1)
+                final_answer = re.match(r"Finish\[(.*)\]", finish_action).group(1)
                 print(f"🎉 最终答案: {final_answer}")
                 return final_answer
 
-            tool_name, tool_input = self._parse_action(action)
-            if not tool_name or not tool_input:
-                # ... 处理无效Action格式 ...
-                continue
+            calls = []
+            for action in actions:
+                tool_name, tool_input = self._parse_action(action)
+                if not tool_name or not tool_input:
+                    # ... 处理无效Action格式 ...
+                    continue
+                print(f"🎬 行动: {tool_name}[{tool_input}]")
+                calls.append((tool_name, tool_input))
 
-            print(f"🎬 行动: {tool_name}[{tool_input}]")
+            if not calls:
+                continue
 
-            tool_function = self.tool_executor.getTool(tool_name)
-            if not tool_function:
-                observation = f"错误:未找到名为 '{tool_name}' 的工具。"
+            # 相互独立的工具调用并行执行，结果按 Action 的顺序返回
+            observations = self.tool_executor.executeMany(calls)
+            if len(calls) == 1:
+                observation = observations[0]
             else:
-                observation = tool_function(tool_input) # 调用真实工具
+                observation = "\n\n".join(
+                    f"[{i+1}] {tool_name}[{tool_input}]:\n{result}"
+                    for i, ((tool_name, tool_input), result) in enumerate(zip(calls, observations))
+                )
 
             print(f"👀 观察:\n{observation}")
 
-            # 将本轮的Action和Observation添加到历史记录中
-            self.history.append(f"Action: {action}")
-            self.history.append(f"Observation: {observation}")
+            # 将本轮的Action和Observation作为新消息追加到历史记录中
+            action_lines = "\n".join(f"Action: {tool_name}[{tool_input}]" for tool_name, tool_input in calls)
+            assistant_content = f"Thought: {thought}\n{action_lines}" if thought else action_lines
+            self.rounds.append([
+                {"role": "assistant", "content": assistant_content},
+                {"role": "user", "content": f"Observation: {observation}"},
+            ])
+            if self.compactor is not None:
+                self._compact_history()
 
         # 循环结束
         print("已达到最大步数，流程终止。")
         return None
 
+    def _compact_history(self):
+        """
+        以"一轮 Action + Observation"为单位压缩历史消息，保证不会拆散同一轮的两条消息。
+        摘要本身也作为单独的一轮保存，之后再次压缩时不会与其他消息错位。
+        """
+        self.rounds = self.compactor.compact(
+            self.rounds,
+            render=lambda r: "\n".join(message["content"] for message in r),
+            make_summary=lambda summary: [{"role": "user", "content": f"此前步骤的摘要:\n{summary}"}],
+        )
+
+    def _think_until_action(self, messages: list):
+        """
+        流式调用LLM并增量解析输出 (对应原先的调用 + 解析两步)。
+        返回 (已生成的文本, thought, actions)。
+        """
+        parser = ReActStreamParser()
+        print(f"🧠 正在调用 {self.llm_client.model} 模型...")
+
+        stream = self.llm_client.stream_think(messages=messages)
+        try:
+            for chunk in stream:
+                print(chunk, end="", flush=True)
+                if parser.feed(chunk):
+                    print("\n✂️ 已解析到完整的 Action，提前结束生成。")
+                    break
+            else:
+                print()
+        finally:
+            # 关闭生成器即关闭底层 HTTP 流
+            stream.close()
+
+        thought, actions = parser.finish()
+        if not actions and parser.text:
+            # 兜底：按完整文本再解析一次
+            thought, action = self._parse_output(parser.text)
+            actions = [action] if action else []
+        return parser.text, thought, actions
+
     def _parse_output(self, text: str):
         """解析LLM的输出，提取Thought和Action。"""
         thought_match = re.search(r"Thought: (.*)", text)
@@ -137,5 +295,5 @@ if __name__ == '__main__':
     tool_list = tool_executor.getAvailableTools()
     # print(f'🔧: 当前可用的工具列表:\n{tool_list}')
 
-    react_agent = ReActAgent(llm_client, tool_executor)
+    react_agent = ReActAgent(llm_client, tool_executor, compactor=SlidingWindowCompactor(max_tokens=3000))
     react_agent.run('2025年的最新款苹果手机有哪些型号?')
\ No newline at end of file
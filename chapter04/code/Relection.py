@@ -1,19 +1,77 @@
-from llm import HelloAgentsLLM
+from llm import HelloAgentsLLM, RateLimiter
+from compaction import HistoryCompactor, LastExecutionCompactor
+from benchmark import CodeBenchmark, BenchmarkReport, extract_code
+from sandbox import SandboxPool
 
-from typing import List, Dict, Any, Optional
+import ast
+import asyncio
+import json
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
 
 
 
+class MemoryRecord:
+    """
+    一条记忆记录。使用 __slots__ 存储，避免每条记录都携带一个字典。
+    同时支持 record['type'] 形式的访问，兼容之前基于字典的用法。
+    """
+    __slots__ = ("type", "content")
+
+    def __init__(self, record_type: str, content: str):
+        self.type = record_type
+        self.content = content
+
+    def __getitem__(self, key: str):
+        return getattr(self, key)
+
+    def to_dict(self) -> Dict[str, str]:
+        return {"type": self.type, "content": self.content}
+
+
+# 轨迹文本中各类型记录的标题
+RECORD_TITLES = {
+    "execution": "--- 上一轮尝试 (代码) ---",
+    "reflection": "--- 评审员反馈 ---",
+    "summary": "--- 历史摘要 ---",
+}
+
+
 class Memory:
     """
     一个简单的短期记忆模块，用于存储智能体的行动与反思轨迹。
+    - 按类型维护"最后一条记录"索引，get_last_execution() 为 O(1)；
+    - 轨迹文本在新增记录时增量追加，不再每次重新格式化全部记录；
+    - 可选地把所有记录追加写入 JSONL 文件，内存中只保留最近的若干条。
     """
 
-    def __init__(self):
+    def __init__(self, compactor: HistoryCompactor = None, spill_path: str = None, max_in_memory: int = None):
         """
-        初始化一个空列表来存储所有记录。
+        参数:
+        - compactor (HistoryCompactor): 可选的压缩策略，记录超出 token 预算时自动压缩。
+        - spill_path (str): 可选的 JSONL 文件路径。提供后所有记录都会被追加写入该文件，
+          并记录每条记录的字节偏移量，以便按序号读回。
+        - max_in_memory (int): 内存中保留的最近记录条数，仅在提供 spill_path 时生效。
+          更早的记录只保存在磁盘上，不再出现在轨迹文本中。
         """
-        self.records: List[Dict[str, Any]] = []
+        self.compactor = compactor
+        self.max_in_memory = max_in_memory if spill_path else None
+        self.records: "deque[MemoryRecord]" = deque(maxlen=self.max_in_memory)
+        self._parts: "deque[str]" = deque(maxlen=self.max_in_memory) # 与 records 一一对应的轨迹片段
+        self._trajectory: Optional[str] = "" # 缓存的轨迹文本，None 表示需要重建
+        self._last_by_type: Dict[str, MemoryRecord] = {}
+        self._recent: "deque[MemoryRecord]" = deque(maxlen=self.max_in_memory) # 按写入顺序保存的最近原始记录，不受压缩影响
+        self._count = 0 # 记录总数 (包括只保存在磁盘上的记录)
+
+        self._spill_file = None
+        self._offsets: List[int] = []
+        if spill_path:
+            self._spill_file = open(spill_path, "a+b")
+
+    def __len__(self) -> int:
+        return self._count
 
     def add_record(self, record_type: str, content: str):
         """
@@ -23,32 +81,129 @@ class Memory:
         - record_type (str): 记录的类型 ('execution' 或 'reflection')。
         - content (str): 记录的具体内容 (例如，生成的代码或反思的反馈)。
         """
-        record = {"type": record_type, "content": content}
-        self.records.append(record)
+        record = MemoryRecord(record_type, content)
+        self._append(record)
+        self._recent.append(record)
+        self._count += 1
+        if self._spill_file is not None:
+            self._spill(record)
         print(f"📝 记忆已更新，新增一条 '{record_type}' 记录。")
 
+        if self.compactor is not None:
+            compacted = self.compactor.compact(
+                list(self.records),
+                render=self._format_record,
+                make_summary=lambda summary: MemoryRecord("summary", summary),
+            )
+            # 压缩策略只会减少记录数量，数量不变说明无需重建索引
+            if len(compacted) != len(self.records):
+                self._rebuild(compacted)
+
+    def _append(self, record: MemoryRecord):
+        part = self._format_record(record)
+        evicted = self.max_in_memory is not None and len(self.records) == self.max_in_memory
+        self.records.append(record)
+        self._parts.append(part)
+        self._last_by_type[record.type] = record
+
+        if evicted:
+            # 最旧的片段被挤出窗口，轨迹需要在下次读取时重建
+            self._trajectory = None
+        elif self._trajectory is not None and part:
+            self._trajectory = f"{self._trajectory}\n\n{part}" if self._trajectory else part
+
+    def _rebuild(self, records: List[MemoryRecord]):
+        """
+        压缩之后根据新的记录列表重建索引与轨迹缓存。
+        被压缩掉的类型仍保留其最后一条记录，保证 get_last_execution() 始终可用。
+        """
+        previous = dict(self._last_by_type)
+        self.records.clear()
+        self._parts.clear()
+        self._last_by_type.clear()
+        self._trajectory = ""
+        for record in records:
+            self._append(record)
+        for record_type, record in previous.items():
+            self._last_by_type.setdefault(record_type, record)
+
+    def _spill(self, record: MemoryRecord):
+        """
+        以追加方式写入 JSONL 文件，并记录该行的起始偏移量。
+        """
+        self._spill_file.seek(0, 2)
+        self._offsets.append(self._spill_file.tell())
+        line = json.dumps(record.to_dict(), ensure_ascii=False) + "\n"
+        self._spill_file.write(line.encode("utf-8"))
+        self._spill_file.flush()
+
+    def get_record(self, index: int) -> Optional[MemoryRecord]:
+        """
+        按写入顺序读取第 index 条记录；仍在内存中的记录直接返回，
+        只在磁盘上的记录通过偏移量索引直接定位读取。
+        """
+        if not 0 <= index < self._count:
+            return None
+        first_recent = self._count - len(self._recent)
+        if index >= first_recent:
+            return self._recent[index - first_recent]
+        if self._spill_file is None:
+            return None
+        self._spill_file.seek(self._offsets[index])
+        data = json.loads(self._spill_file.readline().decode("utf-8"))
+        return MemoryRecord(data["type"], data["content"])
+
     def get_trajectory(self) -> str:
         """
         将所有记忆记录格式化为一个连贯的字符串文本，用于构建提示词。
         """
-        trajectory_parts = []
-        for record in self.records:
-            if record['type'] == 'execution':
-                trajectory_parts.append(f"--- 上一轮尝试 (代码) ---\n{record['content']}")
-            elif record['type'] == 'reflection':
-                trajectory_parts.append(f"--- 评审员反馈 ---\n{record['content']}")
+        if self._trajectory is None:
+            self._trajectory = "\n\n".join(part for part in self._parts if part)
+        return self._trajectory
 
-        return "\n\n".join(trajectory_parts)
+    @staticmethod
+    def _format_record(record: MemoryRecord) -> str:
+        """
+        将单条记录格式化为轨迹文本片段。
+        """
+        title = RECORD_TITLES.get(record.type)
+        return f"{title}\n{record.content}" if title else ""
+
+    def get_last(self, record_type: str) -> Optional[str]:
+        """
+        获取某个类型最近一条记录的内容，不存在时返回 None。
+        """
+        record = self._last_by_type.get(record_type)
+        return record.content if record else None
 
     def get_last_execution(self) -> Optional[str]:
         """
         获取最近一次的执行结果 (例如，最新生成的代码)。
         如果不存在，则返回 None。
         """
-        for record in reversed(self.records):
-            if record['type'] == 'execution':
-                return record['content']
-        return None
+        return self.get_last("execution")
+
+    def close(self):
+        """
+        关闭溢出文件。之后只在磁盘上的记录无法再读回。
+        """
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+
+# 在沙箱中统计候选代码通过了多少条测试断言
+TEST_HARNESS_TEMPLATE = """
+{code}
+
+_passed = 0
+for _test in {tests!r}:
+    try:
+        exec(_test, globals())
+        _passed += 1
+    except Exception:
+        pass
+print(_passed)
+"""
 
 # 初始程序员输出
 INITIAL_PROMPT_TEMPLATE = """
@@ -73,7 +228,10 @@ REFLECT_PROMPT_TEMPLATE = """
 {code}
 ```
 
-请分析该代码的时间复杂度，并思考是否存在一种<strong>算法上更优</strong>的解决方案来显著提升性能。
+# 实测性能数据 (在沙箱中以递增的输入规模运行得到):
+{benchmark}
+
+请结合实测数据分析该代码的时间复杂度与内存占用，并思考是否存在一种<strong>算法上更优</strong>的解决方案来显著提升性能。
 如果存在，请清晰地指出当前算法的不足，并提出具体的、可行的改进算法建议（例如，使用筛法替代试除法）。
 如果代码在算法层面已经达到最优，才能回答“无需改进”。
 
@@ -100,12 +258,73 @@ REFINE_PROMPT_TEMPLATE = """
 
 
 class ReflectionAgent:
-    def __init__(self, llm_client, max_iterations=3):
+    def __init__(self, llm_client, max_iterations=3, compactor: HistoryCompactor = None,
+                 benchmark: CodeBenchmark = None, min_speedup: float = 1.1,
+                 num_candidates: int = 1, candidate_temperature: float = 0.7, tests: List[str] = None):
+        """
+        参数:
+        - benchmark (CodeBenchmark): 可选的基准测试器。提供后每个候选版本都会被实际运行，
+          实测数据会写入反思提示词，并在提速不明显时自动停止迭代。
+        - min_speedup (float): 新版本相对上一版本的最小加速比，低于该值时停止迭代。
+        - num_candidates (int): 每轮并发生成的优化候选数量 (Best-of-N)，为 1 时与原流程一致。
+          并发请求受 llm_client 上共享的 RateLimiter 约束。
+        - candidate_temperature (float): 生成多个候选时使用的温度，保证候选之间有差异。
+        - tests (list): 可选的测试断言语句，例如 "assert find_primes(10) == [2, 3, 5, 7]"，用于给候选打分。
+        """
         self.llm_client = llm_client
-        self.memory = Memory()
+        self.memory = Memory(compactor)
         self.max_iterations = max_iterations
+        self.benchmark = benchmark
+        self.min_speedup = min_speedup
+        self.num_candidates = num_candidates
+        self.candidate_temperature = candidate_temperature
+        self.tests = tests or []
+        self.sandbox = benchmark.sandbox if benchmark else None
+        self._owns_sandbox = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None # Best-of-N 并发请求所用的事件循环，仅在 run() 期间存在
 
     def run(self, task: str):
+        # Best-of-N 的并发请求在一个后台事件循环中执行：整个 run() 复用同一个异步客户端，
+        # 结束时在该循环中关闭它；调用方自己处于事件循环中时也不会与之冲突
+        if self.num_candidates > 1:
+            self._start_loop()
+        try:
+            return self._run(task)
+        finally:
+            if self._loop is not None:
+                self._stop_loop()
+
+    def _start_loop(self):
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_forever, name="reflection-loop", daemon=True)
+        self._loop_thread.start()
+
+    def _stop_loop(self):
+        loop, self._loop = self._loop, None
+        try:
+            asyncio.run_coroutine_threadsafe(self.llm_client.aclose(), loop).result()
+        finally:
+            loop.call_soon_threadsafe(loop.stop)
+            self._loop_thread.join()
+            loop.close()
+
+    def close(self):
+        """
+        关闭记忆的溢出文件以及智能体自己创建的沙箱进程池；外部传入的进程池与基准测试器由调用方负责关闭。
+        """
+        self.memory.close()
+        if self._owns_sandbox:
+            self.sandbox.close()
+            self.sandbox = None
+            self._owns_sandbox = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self, task: str):
         print(f"\n--- 开始处理任务 ---\n任务: {task}")
 
         # --- 1. 初始执行 ---
@@ -114,6 +333,9 @@ class ReflectionAgent:
         initial_code = self._get_llm_response(initial_prompt)
         self.memory.add_record("execution", initial_code)
 
+        report = self._benchmark(initial_code)
+        best_code, best_time = initial_code, report.largest_time if report else None
+
         # --- 2. 迭代循环:反思与优化 ---
         for i in range(self.max_iterations):
             print(f"\n--- 第 {i+1}/{self.max_iterations} 轮迭代 ---")
@@ -121,7 +343,11 @@ class ReflectionAgent:
             # a. 反思
             print("\n-> 正在进行反思...")
             last_code = self.memory.get_last_execution()
-            reflect_prompt = REFLECT_PROMPT_TEMPLATE.format(task=task, code=last_code)
+            reflect_prompt = REFLECT_PROMPT_TEMPLATE.format(
+                task=task,
+                code=last_code,
+                benchmark=report.to_prompt() if report else "未进行实测。"
+            )
             feedback = self._get_llm_response(reflect_prompt)
             self.memory.add_record("reflection", feedback)
 
@@ -137,13 +363,108 @@ class ReflectionAgent:
                 last_code_attempt=last_code,
                 feedback=feedback
             )
-            refined_code = self._get_llm_response(refine_prompt)
+            if self.num_candidates > 1:
+                refined_code, new_report = self._refine_best_of_n(refine_prompt)
+            else:
+                refined_code = self._get_llm_response(refine_prompt)
+                new_report = self._benchmark(refined_code)
+
+            # 没有拿到可用的新版本时保留上一版本的代码与实测数据，进入下一轮
+            if not refined_code:
+                print("\n⚠️ 本轮没有生成可用的优化代码，保留上一版本。")
+                continue
+            if self.benchmark is not None and new_report is None:
+                print("\n⚠️ 本轮候选均未能完成基准测试，保留上一版本。")
+                continue
             self.memory.add_record("execution", refined_code)
 
-        final_code = self.memory.get_last_execution()
+            # d. 根据实测结果判断是否继续，提速不明显时停止
+            if self.benchmark is None:
+                continue
+            previous_time = report.largest_time if report else None
+            report = new_report
+            if report.largest_time is None:
+                continue
+            if best_time is None or report.largest_time < best_time:
+                best_code, best_time = refined_code, report.largest_time
+            if previous_time:
+                speedup = previous_time / max(report.largest_time, 1e-12)
+                print(f"\n⚡ 实测加速比: {speedup:.2f}x")
+                if speedup < self.min_speedup:
+                    print(f"\n✅ 加速比低于阈值 {self.min_speedup}x，优化已收敛，任务完成。")
+                    break
+
+        # 有实测数据时返回实测最快的版本，否则返回最后一个版本
+        final_code = best_code if best_time is not None else self.memory.get_last_execution()
         print(f"\n--- 任务完成 ---\n最终生成的代码:\n```python\n{final_code}\n```")
         return final_code
 
+    def _refine_best_of_n(self, refine_prompt: str) -> Tuple[str, Optional[BenchmarkReport]]:
+        """
+        针对同一份反馈并发生成 N 个候选，用本地的廉价信号打分，只保留最好的一个。
+        打分依次比较：语法是否正确 > 测试通过率 > 实测耗时。
+        返回 (最佳候选, 最佳候选的基准测试报告)。
+        """
+        messages = [{"role": "user", "content": refine_prompt}]
+        generate = self.llm_client.think_many(
+            [messages] * self.num_candidates, temperature=self.candidate_temperature
+        )
+        candidates = [c for c in asyncio.run_coroutine_threadsafe(generate, self._loop).result() if c]
+        if not candidates:
+            return "", None
+
+        if self.tests and self.sandbox is None:
+            self.sandbox = SandboxPool(size=min(len(candidates), 4))
+            self._owns_sandbox = True
+
+        # 语法检查与测试可以并发进行；基准测试串行进行，避免候选之间争抢 CPU 导致耗时失真
+        with ThreadPoolExecutor(max_workers=len(candidates)) as pool:
+            checks = list(pool.map(self._check_candidate, candidates))
+
+        top = max(checks)
+        reports = [
+            self._benchmark(candidate) if check == top and check[0] else None
+            for candidate, check in zip(candidates, checks)
+        ]
+        scores = [
+            (*check, -(report.largest_time if report and report.largest_time is not None else float("inf")))
+            for check, report in zip(checks, reports)
+        ]
+
+        best_index = max(range(len(candidates)), key=lambda i: scores[i])
+        for i, (syntax_ok, pass_rate, neg_runtime) in enumerate(scores):
+            marker = "🏆" if i == best_index else "  "
+            print(f"{marker} 候选 {i+1}: 语法正确={syntax_ok}, 测试通过率={pass_rate:.0%}, 耗时={-neg_runtime:.4f}s")
+        return candidates[best_index], reports[best_index]
+
+    def _check_candidate(self, candidate: str) -> Tuple[bool, float]:
+        """
+        廉价的本地检查，返回 (语法是否正确, 测试通过率)。
+        """
+        code = extract_code(candidate)
+        try:
+            ast.parse(code)
+        except SyntaxError:
+            return False, 0.0
+
+        if not self.tests:
+            return True, 1.0
+
+        harness = TEST_HARNESS_TEMPLATE.format(code=code, tests=self.tests)
+        result = self.sandbox.run(harness)
+        try:
+            return True, int(result.stdout.strip().splitlines()[-1]) / len(self.tests)
+        except (ValueError, IndexError):
+            return True, 0.0
+
+    def _benchmark(self, code: str) -> Optional[BenchmarkReport]:
+        """
+        对候选代码进行基准测试；未配置基准测试器时返回 None。
+        """
+        if self.benchmark is None:
+            return None
+        return self.benchmark.run(code)
+
     def _get_llm_response(self, prompt: str) -> str:
         """一个辅助方法，用于调用LLM并获取完整的流式响应。"""
         messages = [{"role": "user", "content": prompt}]
@@ -153,6 +474,13 @@ class ReflectionAgent:
 
 
 if __name__ == '__main__':
-    llm_client = HelloAgentsLLM()
-    relection_agent = ReflectionAgent(llm_client)
-    relection_agent.run('编写一个Python函数，找出1到n之间所有的素数 (prime numbers)')
\ No newline at end of file
+    llm_client = HelloAgentsLLM(rate_limiter=RateLimiter(rate=2, burst=4))
+    sandbox = SandboxPool(size=3)
+    relection_agent = ReflectionAgent(
+        llm_client,
+        compactor=LastExecutionCompactor(max_tokens=3000),
+        benchmark=CodeBenchmark(sandbox=sandbox, sizes=[1000, 10000, 100000, 1000000]),
+        num_candidates=3,
+    )
+    with sandbox, relection_agent:
+        relection_agent.run('编写一个Python函数，找出1到n之间所有的素数 (prime numbers)')
\ No newline at end of file
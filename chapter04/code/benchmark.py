@@ -0,0 +1,187 @@
+import ast
+import json
+import math
+import re
+from typing import List, Dict, Any, Optional, NamedTuple
+
+from sandbox import SandboxPool
+
+# 候选的复杂度模型：名称 -> f(n)
+COMPLEXITY_MODELS = {
+    "O(1)": lambda n: 1.0,
+    "O(log n)": lambda n: math.log(n),
+    "O(n)": lambda n: float(n),
+    "O(n log n)": lambda n: n * math.log(n),
+    "O(n^2)": lambda n: float(n) ** 2,
+    "O(n^3)": lambda n: float(n) ** 3,
+}
+
+# 在沙箱中运行的基准测试脚本：先测耗时 (取多次中的最小值)，再单独测峰值内存，
+# 因为 tracemalloc 本身会显著拖慢执行速度
+HARNESS_TEMPLATE = """
+{code}
+
+import json as _json
+import time as _time
+import tracemalloc as _tracemalloc
+
+_func = {func_name}
+_make_input = {input_generator}
+_results = []
+for _n in {sizes}:
+    _args = _make_input(_n)
+    _best = float("inf")
+    for _ in range({repeat}):
+        _start = _time.perf_counter()
+        _func(*_args)
+        _best = min(_best, _time.perf_counter() - _start)
+    _tracemalloc.start()
+    _func(*_args)
+    _, _peak = _tracemalloc.get_traced_memory()
+    _tracemalloc.stop()
+    _results.append({{"n": _n, "time": _best, "peak_memory": _peak}})
+print(_json.dumps(_results))
+"""
+
+
+class BenchmarkReport(NamedTuple):
+    """
+    一次基准测试的结果。error 不为空时表示测试失败。
+    """
+    points: List[Dict[str, Any]]
+    complexity: Optional[str] = None
+    slope: Optional[float] = None
+    error: Optional[str] = None
+
+    @property
+    def largest_time(self) -> Optional[float]:
+        """最大输入规模下的耗时，用于比较两个版本的快慢。"""
+        return self.points[-1]["time"] if self.points else None
+
+    def to_prompt(self) -> str:
+        """
+        格式化为可以直接放入提示词的文本。
+        """
+        if self.error:
+            return f"基准测试失败:\n{self.error}"
+        lines = ["| n | 耗时 (ms) | 峰值内存 (KB) |", "|---|---|---|"]
+        for point in self.points:
+            lines.append(f"| {point['n']} | {point['time'] * 1000:.3f} | {point['peak_memory'] / 1024:.1f} |")
+        lines.append(f"\n经验复杂度: 约 {self.complexity} (log-log 斜率 {self.slope:.2f})")
+        return "\n".join(lines)
+
+
+def extract_code(text: str) -> str:
+    """
+    从LLM的回答中提取代码；没有 ``` 代码块时按整段文本处理。
+    """
+    match = re.search(r"```(?:python)?\s*\n(.*?)```", text, re.DOTALL)
+    return match.group(1).strip() if match else text.strip()
+
+
+def find_entry_function(code: str) -> Optional[str]:
+    """
+    找到代码中第一个顶层的公开函数，作为基准测试的入口。
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    functions = [node.name for node in tree.body if isinstance(node, ast.FunctionDef)]
+    public = [name for name in functions if not name.startswith("_")]
+    return (public or functions or [None])[0]
+
+
+def fit_complexity(sizes: List[int], times: List[float]):
+    """
+    对 (规模, 耗时) 数据拟合经验复杂度。
+    对每个模型用最小二乘求 t ≈ c·f(n)，取相对残差最小的模型；同时给出 log-log 斜率。
+    """
+    best_name, best_residual = None, float("inf")
+    total = sum(t * t for t in times) or 1e-30
+    for name, f in COMPLEXITY_MODELS.items():
+        fs = [f(n) for n in sizes]
+        c = sum(t * v for t, v in zip(times, fs)) / (sum(v * v for v in fs) or 1e-30)
+        residual = sum((t - c * v) ** 2 for t, v in zip(times, fs)) / total
+        if residual < best_residual:
+            best_name, best_residual = name, residual
+
+    xs = [math.log(n) for n in sizes]
+    ys = [math.log(max(t, 1e-9)) for t in times]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    denominator = sum((x - mean_x) ** 2 for x in xs) or 1e-30
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / denominator
+    return best_name, slope
+
+
+class CodeBenchmark:
+    """
+    在沙箱中以递增的输入规模运行候选代码，测量耗时与峰值内存，并拟合经验复杂度。
+    """
+
+    def __init__(self, sandbox: SandboxPool = None, sizes: List[int] = None,
+                 input_generator: str = "lambda n: (n,)", func_name: str = None, repeat: int = 3, timeout: float = 60):
+        """
+        参数:
+        - sandbox (SandboxPool): 执行基准测试的沙箱进程池，未提供时在首次运行时创建，并由 close() 负责关闭。
+        - sizes (list): 递增的输入规模。
+        - input_generator (str): 生成输入参数的 Python 表达式，接收规模 n，返回参数元组。
+        - func_name (str): 被测函数名，默认取代码中第一个顶层公开函数。
+        - repeat (int): 每个规模重复测量的次数，取最小耗时。
+        - timeout (float): 单次基准测试的超时时间 (秒)。
+        """
+        self.sandbox = sandbox
+        self.sizes = sizes or [1000, 4000, 16000, 64000]
+        self.input_generator = input_generator
+        self.func_name = func_name
+        self.repeat = repeat
+        self.timeout = timeout
+        self._owns_sandbox = False
+
+    def close(self):
+        """
+        关闭基准测试器自己创建的沙箱进程池；外部传入的进程池由调用方负责关闭。
+        """
+        if self._owns_sandbox:
+            self.sandbox.close()
+            self.sandbox = None
+            self._owns_sandbox = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def run(self, code: str) -> BenchmarkReport:
+        code = extract_code(code)
+        func_name = self.func_name or find_entry_function(code)
+        if func_name is None:
+            return BenchmarkReport([], error="代码中没有找到可测试的函数。")
+
+        if self.sandbox is None:
+            self.sandbox = SandboxPool(size=1, timeout=self.timeout)
+            self._owns_sandbox = True
+
+        harness = HARNESS_TEMPLATE.format(
+            code=code,
+            func_name=func_name,
+            input_generator=self.input_generator,
+            sizes=list(self.sizes),
+            repeat=self.repeat,
+        )
+        print(f"📏 正在对函数 '{func_name}' 进行基准测试，输入规模: {self.sizes}")
+        result = self.sandbox.run(harness, timeout=self.timeout)
+        if result.exit_code != 0:
+            return BenchmarkReport([], error=result.stderr.strip() or "基准测试执行失败。")
+
+        try:
+            # 候选代码自身可能也有输出，基准测试结果位于最后一行
+            points = json.loads(result.stdout.strip().splitlines()[-1])
+        except (ValueError, IndexError):
+            return BenchmarkReport([], error=f"无法解析基准测试输出:\n{result.stdout[-500:]}")
+
+        complexity, slope = fit_complexity([p["n"] for p in points], [p["time"] for p in points])
+        report = BenchmarkReport(points, complexity, slope)
+        print(f"📊 基准测试完成:\n{report.to_prompt()}")
+        return report
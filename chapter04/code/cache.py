@@ -0,0 +1,198 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Dict, Optional, Any
+
+
+def make_cache_key(model: str, messages: List[Dict[str, str]], temperature: float) -> str:
+    """
+    根据请求内容生成规范化的哈希键。
+    字典按键排序后序列化，保证语义相同的请求得到相同的键。
+    """
+    payload = json.dumps(
+        {"model": model, "messages": messages, "temperature": temperature},
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    LLM 响应缓存的基类，子类只需实现 _get / _set / clear。
+    基类负责统计命中、未命中次数。
+    """
+
+    def __init__(self, ttl: Optional[float] = None, max_bytes: Optional[int] = None):
+        """
+        参数:
+        - ttl (float): 缓存条目的存活时间（秒），None 表示永不过期。
+        - max_bytes (int): 缓存内容的最大总字节数，None 表示不限制。
+        """
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            self._set(key, value)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        返回命中统计信息。
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl is not None and time.time() - created_at > self.ttl
+
+    def _get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def _set(self, key: str, value: str):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class LRUCache(ResponseCache):
+    """
+    基于 OrderedDict 的内存 LRU 缓存。
+    """
+
+    def __init__(self, ttl: Optional[float] = None, max_bytes: Optional[int] = 64 * 1024 * 1024):
+        super().__init__(ttl, max_bytes)
+        # key -> (value, created_at, size)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._size = 0
+
+    def _get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, created_at, size = entry
+        if self._expired(created_at):
+            self._pop(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _set(self, key: str, value: str):
+        size = len(value.encode("utf-8"))
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._pop(key)
+        self._entries[key] = (value, time.time(), size)
+        self._size += size
+        # 超出容量时从最久未使用的一端淘汰
+        while self.max_bytes is not None and self._size > self.max_bytes:
+            self._pop(next(iter(self._entries)))
+
+    def _pop(self, key: str):
+        _, _, size = self._entries.pop(key)
+        self._size -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+class SQLiteCache(ResponseCache):
+    """
+    基于 SQLite 的磁盘缓存，进程重启后依然有效。
+    按最近访问时间执行 LRU 淘汰。
+    """
+
+    def __init__(self, path: str = ".llm_cache.sqlite3", ttl: Optional[float] = None, max_bytes: Optional[int] = 512 * 1024 * 1024):
+        super().__init__(ttl, max_bytes)
+        self.path = Path(path)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON responses (accessed_at)")
+        self._conn.commit()
+
+    def _get(self, key: str) -> Optional[str]:
+        row = self._conn.execute(
+            "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, created_at = row
+        if self._expired(created_at):
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.commit()
+            return None
+        self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        self._conn.commit()
+        return value
+
+    def _set(self, key: str, value: str):
+        size = len(value.encode("utf-8"))
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        now = time.time()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO responses (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (key, value, size, now, now),
+        )
+        if self.max_bytes is not None:
+            self._evict()
+        self._conn.commit()
+
+    def _evict(self):
+        """
+        总大小超过上限时，按访问时间从旧到新删除条目。
+        """
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall()
+        stale = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            stale.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,161 @@
+import re
+from typing import List, Callable, Any, Optional
+
+# 优先使用 tiktoken 做本地分词计数，未安装时退回到基于字符的估算
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _ENCODING = None
+
+_CJK_PATTERN = re.compile(r"[\u2e80-\u9fff\uac00-\ud7af\uff00-\uffef]")
+
+
+def count_tokens(text: str) -> int:
+    """
+    统计文本的 token 数。
+    没有 tiktoken 时按 "一个中日韩字符约 1 个 token，其余约 4 个字符 1 个 token" 估算。
+    """
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+SUMMARY_PROMPT_TEMPLATE = """
+请将以下智能体的历史执行记录压缩成一段简洁的摘要。
+- 保留关键的行动、工具返回的重要事实与数字、以及已经得出的中间结论。
+- 删除重复、无关或冗长的内容。
+
+# 历史记录:
+{history}
+
+请直接输出摘要，不要包含任何额外的解释。
+"""
+
+
+class HistoryCompactor:
+    """
+    历史记录压缩策略的基类。
+    所有策略都以"整条记录"为单位进行取舍，不会把一条记录截断到一半。
+    记录的具体格式由调用方决定，调用方通过 render / make_summary 告诉策略如何处理它。
+    """
+
+    def __init__(self, max_tokens: int = 4000):
+        """
+        参数:
+        - max_tokens (int): 历史记录允许占用的最大 token 数。
+        """
+        self.max_tokens = max_tokens
+
+    def compact(self, records: List[Any], render: Callable[[Any], str],
+                make_summary: Optional[Callable[[str], Any]] = None) -> List[Any]:
+        """
+        返回压缩后的记录列表，未超出预算时原样返回。
+
+        参数:
+        - records (list): 按时间顺序排列的记录。
+        - render (callable): 将一条记录转换为文本的函数，用于计算 token 数。
+        - make_summary (callable): 将摘要文本包装成一条记录的函数，仅摘要策略使用。
+        """
+        raise NotImplementedError
+
+    def tokens_of(self, records: List[Any], render: Callable[[Any], str]) -> int:
+        return sum(count_tokens(render(record)) for record in records)
+
+    def _sliding_window(self, records: List[Any], render: Callable[[Any], str]) -> List[Any]:
+        """
+        从最新的记录开始向前保留，直到预算用完；至少保留最后一条记录。
+        """
+        kept = []
+        total = 0
+        for record in reversed(records):
+            tokens = count_tokens(render(record))
+            if kept and total + tokens > self.max_tokens:
+                break
+            kept.append(record)
+            total += tokens
+        kept.reverse()
+        return kept
+
+
+class SlidingWindowCompactor(HistoryCompactor):
+    """
+    滑动窗口策略：只保留预算内最近的若干条记录。
+    """
+
+    def compact(self, records, render, make_summary=None):
+        if self.tokens_of(records, render) <= self.max_tokens:
+            return records
+        kept = self._sliding_window(records, render)
+        print(f"🗜️ 历史记录已压缩: 保留最近 {len(kept)}/{len(records)} 条记录。")
+        return kept
+
+
+class SummarizingCompactor(HistoryCompactor):
+    """
+    摘要策略：超出预算时，调用一个廉价模型把最旧的 N 条记录压缩成一条摘要记录。
+    """
+
+    def __init__(self, llm_client, max_tokens: int = 4000, summarize_oldest: int = 4):
+        """
+        参数:
+        - llm_client: 用于生成摘要的 LLM 客户端，建议使用更便宜、更快的模型。
+        - summarize_oldest (int): 每次合并进摘要的最旧记录条数，至少为 2，否则摘要不会减少记录条数。
+        """
+        if summarize_oldest < 2:
+            raise ValueError("summarize_oldest 至少为 2。")
+        super().__init__(max_tokens)
+        self.llm_client = llm_client
+        self.summarize_oldest = summarize_oldest
+
+    def compact(self, records, render, make_summary=None):
+        records = list(records)
+        # 至少保留最新的一条记录不参与摘要
+        while make_summary and self.tokens_of(records, render) > self.max_tokens:
+            n = min(self.summarize_oldest, len(records) - 1)
+            if n < 2:
+                break
+            history = "\n\n".join(render(record) for record in records[:n])
+            summary = self._summarize(history)
+            if not summary:
+                break
+            records = [make_summary(summary)] + records[n:]
+            print(f"🗜️ 历史记录已压缩: 最旧的 {n} 条记录合并为一条摘要。")
+
+        # 摘要之后仍然超出预算，则退回滑动窗口
+        if self.tokens_of(records, render) > self.max_tokens:
+            records = self._sliding_window(records, render)
+        return records
+
+    def _summarize(self, history: str) -> Optional[str]:
+        prompt = SUMMARY_PROMPT_TEMPLATE.format(history=history)
+        messages = [{"role": "user", "content": prompt}]
+        return self.llm_client.think(messages=messages)
+
+
+class LastExecutionCompactor(HistoryCompactor):
+    """
+    Reflection 专用策略：只保留最后一次 'execution' 记录及其之后的反馈。
+    旧版本代码对下一轮优化几乎没有价值，却占据了大部分提示词。
+    """
+
+    def __init__(self, max_tokens: int = 4000, get_type: Callable[[Any], str] = lambda record: record["type"]):
+        super().__init__(max_tokens)
+        self.get_type = get_type
+
+    def compact(self, records, render, make_summary=None):
+        if self.tokens_of(records, render) <= self.max_tokens:
+            return records
+        for i in range(len(records) - 1, -1, -1):
+            if self.get_type(records[i]) == "execution":
+                kept = records[i:]
+                break
+        else:
+            kept = records
+        if self.tokens_of(kept, render) > self.max_tokens:
+            kept = self._sliding_window(kept, render)
+        print(f"🗜️ 历史记录已压缩: 保留最后一次执行及其反馈，共 {len(kept)}/{len(records)} 条记录。")
+        return kept
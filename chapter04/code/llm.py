@@ -1,28 +1,95 @@
 import os
-from openai import OpenAI
+import time
+import asyncio
+import threading
+import weakref
+import importlib.util
+import httpx
+from openai import OpenAI, AsyncOpenAI
 # from dotenv import load_dotenv
-from typing import List, Dict
+from typing import List, Dict, Optional, Iterator
 import yaml
 
+from cache import ResponseCache, LRUCache, make_cache_key
+
 from pathlib import Path
 current_dir = Path(__file__).parent
 
-# 读取配置文件
-with open(current_dir.parent.parent.parent / 'config.yaml', 'r') as f:
-    config = yaml.safe_load(f)
+# 读取配置文件；文件不存在时 (例如离线运行测试) 使用空配置，各参数取默认值
+config = {}
+config_path = current_dir.parent.parent.parent / 'config.yaml'
+if config_path.exists():
+    with open(config_path, 'r') as f:
+        config = yaml.safe_load(f) or {}
 
 # 加载 .env 文件中的环境变量
 # load_dotenv()
 
+# HTTP/2 依赖可选的 h2 包，未安装时自动退回 HTTP/1.1
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+def _build_http_limits() -> httpx.Limits:
+    """
+    构建连接池参数：保持长连接，避免每次请求都重新进行 TCP/TLS 握手。
+    """
+    return httpx.Limits(
+        max_connections=config.get('LLM_MAX_CONNECTIONS', 100),
+        max_keepalive_connections=config.get('LLM_MAX_KEEPALIVE', 20),
+        keepalive_expiry=config.get('LLM_KEEPALIVE_EXPIRY', 30),
+    )
+
+
+class RateLimiter:
+    """
+    线程安全的令牌桶限流器，可在多个 LLM 客户端、多个智能体之间共享，
+    同时支持同步 (acquire) 与异步 (aacquire) 两种等待方式。
+    """
+
+    def __init__(self, rate: float, burst: int = None):
+        """
+        参数:
+        - rate (float): 每秒允许发起的请求数。
+        - burst (int): 桶容量，即允许的瞬时突发请求数，默认等于 rate。
+        """
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _try_acquire(self) -> float:
+        """
+        尝试取走一个令牌，成功返回 0，否则返回需要等待的秒数。
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        while (wait := self._try_acquire()) > 0:
+            time.sleep(wait)
+
+    async def aacquire(self):
+        while (wait := self._try_acquire()) > 0:
+            await asyncio.sleep(wait)
+
 
 class HelloAgentsLLM:
     """
     为本书 "Hello Agents" 定制的LLM客户端。
     它用于调用任何兼容OpenAI接口的服务，并默认使用流式响应。
     """
-    def __init__(self, model: str = None, apiKey: str = None, baseUrl: str = None, timeout: int = None, Provider :str = 'ModelScope'):
+    def __init__(self, model: str = None, apiKey: str = None, baseUrl: str = None, timeout: int = None, Provider :str = 'ModelScope', cache: ResponseCache = None, rate_limiter: RateLimiter = None):
         """
         初始化客户端。优先使用传入参数，如果未提供，则从环境变量加载。
+        传入 cache 后，temperature 为 0 的确定性请求会优先从缓存中读取响应。
+        传入 rate_limiter 后，每次真实的网络请求都会先获取令牌，多个客户端可共享同一个限流器。
         """
         self.model = model or config[Provider]['MODEL_NAME']
         apiKey = apiKey or config[Provider]['API_KEY']
@@ -32,14 +99,71 @@ class HelloAgentsLLM:
         if not all([self.model, apiKey, baseUrl]):
             raise ValueError("模型ID、API密钥和服务地址必须被提供或在.env文件中定义。")
 
-        self.client = OpenAI(api_key=apiKey, base_url=baseUrl, timeout=timeout)
+        self._apiKey = apiKey
+        self._baseUrl = baseUrl
+        self._timeout = timeout
+        self.max_concurrency = config.get('LLM_MAX_CONCURRENCY', 16)
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+
+        # 同步客户端复用同一个连接池
+        self.client = OpenAI(
+            api_key=apiKey,
+            base_url=baseUrl,
+            timeout=timeout,
+            http_client=httpx.Client(
+                http2=HTTP2_AVAILABLE, limits=_build_http_limits(), timeout=timeout
+            ),
+        )
+
+        # 异步客户端在首次调用 athink() 时按事件循环懒加载，每个事件循环一个
+        # 以事件循环为弱引用键：循环被回收后对应的客户端也随之释放
+        self._async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI]" = weakref.WeakKeyDictionary()
+
+    def _cache_key(self, messages: List[Dict[str, str]], temperature: float) -> Optional[str]:
+        """
+        仅为确定性请求 (temperature == 0) 生成缓存键，其余请求绕过缓存。
+        """
+        if self.cache is None or temperature != 0:
+            return None
+        return make_cache_key(self.model, messages, temperature)
+
+    def _get_async_client(self) -> AsyncOpenAI:
+        """
+        获取绑定到当前事件循环的异步客户端。
+        httpx.AsyncClient 的连接无法跨事件循环复用，因此每个事件循环使用各自的客户端，
+        并在该循环中通过 aclose() 关闭。
+        """
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = AsyncOpenAI(
+                api_key=self._apiKey,
+                base_url=self._baseUrl,
+                timeout=self._timeout,
+                http_client=httpx.AsyncClient(
+                    http2=HTTP2_AVAILABLE, limits=_build_http_limits(), timeout=self._timeout
+                ),
+            )
+            self._async_clients[loop] = client
+        return client
 
     def think(self, messages: List[Dict[str, str]], temperature: float = 0) -> str:
         """
         调用大语言模型进行思考，并返回其响应。
         """
+        cache_key = self._cache_key(messages, temperature)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                print(f"⚡ 命中 {self.model} 响应缓存:")
+                print(cached)
+                return cached
+
         print(f"🧠 正在调用 {self.model} 模型...")
         try:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
             response = self.client.chat.completions.create(
                 model=self.model,
                 messages=messages,
@@ -63,17 +187,144 @@ class HelloAgentsLLM:
                     collected_content.append(content)
 
             print()  # 在流式输出结束后换行
-            return "".join(collected_content)
+            result = "".join(collected_content)
+            if cache_key is not None:
+                self.cache.set(cache_key, result)
+            return result
+
+        except Exception as e:
+            print(f"❌ 调用LLM API时发生错误: {e}")
+            return None
+
+    def stream_think(self, messages: List[Dict[str, str]], temperature: float = 0) -> Iterator[str]:
+        """
+        以生成器形式逐块返回模型输出，不做打印。
+        调用方可以随时停止迭代 (或调用 close())，此时底层 HTTP 流会被立即关闭，
+        服务端随之停止生成，从而节省输出 token。
+        只有完整读完的响应才会写入缓存，避免把被截断的内容缓存下来。
+        """
+        cache_key = self._cache_key(messages, temperature)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+
+        try:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=temperature,
+                stream=True,
+            )
+        except Exception as e:
+            print(f"❌ 调用LLM API时发生错误: {e}")
+            return
+
+        collected_content = []
+        try:
+            for chunk in response:
+                if (chunk.choices and
+                    len(chunk.choices) > 0 and
+                    chunk.choices[0].delta.content is not None
+                    ):
+                    content = chunk.choices[0].delta.content or ""
+                    collected_content.append(content)
+                    yield content
+            if cache_key is not None:
+                self.cache.set(cache_key, "".join(collected_content))
+        except Exception as e:
+            print(f"❌ 读取LLM流式响应时发生错误: {e}")
+        finally:
+            # 提前结束迭代时 GeneratorExit 会走到这里，关闭连接以中止生成
+            response.close()
+
+    async def athink(self, messages: List[Dict[str, str]], temperature: float = 0, verbose: bool = False) -> Optional[str]:
+        """
+        think() 的异步版本，可在同一事件循环中并发发起多个请求。
+        并发场景下逐块打印会相互穿插，因此默认不打印流式内容。
+        """
+        cache_key = self._cache_key(messages, temperature)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        if verbose:
+            print(f"🧠 正在调用 {self.model} 模型...")
+        try:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.aacquire()
+            client = self._get_async_client()
+            response = await client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                temperature=temperature,
+                stream=True,
+            )
+            collected_content = []
+
+            async for chunk in response:
+                if (chunk.choices and
+                    len(chunk.choices) > 0 and
+                    chunk.choices[0].delta.content is not None
+                    ):
+                    content = chunk.choices[0].delta.content or ""
+                    if verbose:
+                        print(content, end="", flush=True)
+                    collected_content.append(content)
+
+            if verbose:
+                print()
+            result = "".join(collected_content)
+            if cache_key is not None:
+                self.cache.set(cache_key, result)
+            return result
 
         except Exception as e:
             print(f"❌ 调用LLM API时发生错误: {e}")
             return None
 
+    async def think_many(self, batch: List[List[Dict[str, str]]], temperature: float = 0, max_concurrency: int = None) -> List[Optional[str]]:
+        """
+        并发地处理一批消息列表，返回结果与输入顺序一一对应。
+
+        参数:
+        - batch: 多组 messages，每组对应一次独立的对话请求。
+        - max_concurrency: 同时在途的最大请求数，默认读取配置 LLM_MAX_CONCURRENCY。
+        """
+        semaphore = asyncio.Semaphore(max_concurrency or self.max_concurrency)
+
+        async def _run(messages):
+            async with semaphore:
+                return await self.athink(messages, temperature=temperature)
+
+        print(f"🧠 正在并发调用 {self.model} 模型，共 {len(batch)} 个请求...")
+        results = await asyncio.gather(*(_run(messages) for messages in batch))
+        print(f"✅ 批量请求完成，成功 {sum(r is not None for r in results)}/{len(batch)} 个")
+        return list(results)
+
+    async def aclose(self):
+        """
+        关闭当前事件循环上的异步客户端的连接池，应在 asyncio.run() 结束之前调用。
+        """
+        client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.close()
+
+    def close(self):
+        """
+        关闭同步客户端的连接池。
+        """
+        self.client.close()
+
 
 # --- 客户端使用示例 ---
 if __name__ == '__main__':
     try:
-        llmClient = HelloAgentsLLM()
+        llmClient = HelloAgentsLLM(cache=LRUCache(ttl=3600))
 
         exampleMessages = [
             {"role": "system", "content": "You are a helpful assistant that writes Python code."},
@@ -86,5 +337,25 @@ if __name__ == '__main__':
             print("\n\n--- 完整模型响应 ---")
             print(responseText)
 
+        print("\n--- 并发调用LLM ---")
+        batchMessages = [
+            [{"role": "user", "content": f"用一句话介绍数字 {i}"}]
+            for i in range(1, 6)
+        ]
+
+        async def runBatch():
+            try:
+                return await llmClient.think_many(batchMessages, max_concurrency=3)
+            finally:
+                await llmClient.aclose()
+
+        batchResults = asyncio.run(runBatch())
+        for i, text in enumerate(batchResults, 1):
+            print(f"[{i}] {text}")
+
+        print("\n--- 重复调用命中缓存 ---")
+        llmClient.think(exampleMessages)
+        print(f"缓存统计: {llmClient.cache.stats()}")
+
     except ValueError as e:
         print(e)
@@ -0,0 +1,313 @@
+import ast
+import hashlib
+import json
+import queue
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+from cache import SQLiteCache
+
+current_dir = Path(__file__).parent
+WORKER_SCRIPT = current_dir / "sandbox_worker.py"
+
+# 导入这些模块的代码结果可能随时间、随机数、网络或文件系统而变化，不允许缓存
+NONDETERMINISTIC_MODULES = {
+    "time", "random", "secrets", "uuid", "os", "sys", "shutil", "pathlib", "tempfile", "glob",
+    "socket", "ssl", "http", "urllib", "requests", "httpx", "aiohttp",
+    "subprocess", "multiprocessing", "threading", "asyncio", "concurrent", "signal",
+}
+# 调用这些函数/方法会引入外部状态，例如 datetime.now()、open()、input()
+NONDETERMINISTIC_CALLS = {"now", "today", "utcnow", "open", "input", "id", "hash", "__import__", "eval", "exec"}
+
+
+class SandboxResult(NamedTuple):
+    """
+    一次代码执行的结果。
+    """
+    stdout: str
+    stderr: str
+    exit_code: int
+    runtime: float
+
+
+class _DocstringStripper(ast.NodeTransformer):
+    """
+    删除模块、类与函数的文档字符串，它们不影响执行结果。
+    """
+
+    def _strip(self, node):
+        self.generic_visit(node)
+        body = node.body
+        if body and isinstance(body[0], ast.Expr) and isinstance(getattr(body[0], "value", None), ast.Constant) \
+                and isinstance(body[0].value.value, str):
+            node.body = body[1:] or [ast.Pass()]
+        return node
+
+    visit_Module = visit_ClassDef = visit_FunctionDef = visit_AsyncFunctionDef = _strip
+
+
+def is_deterministic(tree: ast.AST) -> bool:
+    """
+    通过静态分析判断代码是否只依赖自身输入：
+    不导入时间、随机数、网络、文件系统等模块，也不调用 now()/open() 之类的函数。
+    """
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            names = [node.module or ""]
+        elif isinstance(node, ast.Call):
+            func = node.func
+            name = func.attr if isinstance(func, ast.Attribute) else getattr(func, "id", None)
+            if name in NONDETERMINISTIC_CALLS:
+                return False
+            continue
+        else:
+            continue
+
+        if any(name.split(".")[0] in NONDETERMINISTIC_MODULES for name in names):
+            return False
+    return True
+
+
+def snippet_key(code: str) -> Optional[str]:
+    """
+    计算代码片段规范化 AST 的哈希：注释、空白、格式与文档字符串的差异都不会影响结果。
+    无法解析或不是确定性的代码返回 None，表示不可缓存。
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    if not is_deterministic(tree):
+        return None
+
+    tree = _DocstringStripper().visit(tree)
+    normalized = ast.dump(tree, annotate_fields=False, include_attributes=False)
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class SnippetCache:
+    """
+    代码片段执行结果的磁盘缓存 (基于 SQLiteCache，按最近访问时间做 LRU 淘汰)。
+    只缓存确定性代码正常结束 (包括抛出异常) 的结果，超时和进程崩溃的结果不缓存。
+    """
+
+    def __init__(self, path: str = ".snippet_cache.sqlite3", max_bytes: int = 64 * 1024 * 1024):
+        self.store = SQLiteCache(path, max_bytes=max_bytes)
+
+    def get(self, code: str) -> Optional[SandboxResult]:
+        key = snippet_key(code)
+        if key is None:
+            return None
+        value = self.store.get(key)
+        return SandboxResult(**json.loads(value)) if value is not None else None
+
+    def put(self, code: str, result: SandboxResult):
+        key = snippet_key(code)
+        if key is None or result.exit_code < 0:
+            return
+        self.store.set(key, json.dumps(result._asdict(), ensure_ascii=False))
+
+    def stats(self) -> dict:
+        return self.store.stats()
+
+
+class _Worker:
+    """
+    一个常驻的 Python 解释器进程。后台线程负责读取它的输出，
+    这样主线程可以带超时地等待结果。
+    每个工作进程在自己的临时目录中运行，并发执行时不会互相覆盖文件；目录在 kill() 时删除。
+    """
+
+    def __init__(self, memory_limit_mb: int, file_size_limit_mb: int):
+        self._workdir = tempfile.TemporaryDirectory(prefix="sandbox_")
+        self.process = subprocess.Popen(
+            [sys.executable, "-I", "-u", str(WORKER_SCRIPT), str(memory_limit_mb), str(file_size_limit_mb)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            cwd=self._workdir.name,
+            text=True,
+            encoding="utf-8",
+        )
+        self._lines: "queue.Queue[Optional[str]]" = queue.Queue()
+        threading.Thread(target=self._read_loop, daemon=True).start()
+
+    def _read_loop(self):
+        for line in self.process.stdout:
+            self._lines.put(line)
+        self._lines.put(None) # 进程退出
+
+    def wait_ready(self, timeout: float) -> bool:
+        try:
+            line = self._lines.get(timeout=timeout)
+        except queue.Empty:
+            return False
+        return line is not None
+
+    def submit(self, code: str, timeout: float) -> Optional[dict]:
+        """
+        提交代码并等待结果，超时或进程异常退出时返回 None。
+        """
+        try:
+            self.process.stdin.write(json.dumps({"code": code}) + "\n")
+            self.process.stdin.flush()
+            line = self._lines.get(timeout=timeout)
+        except (queue.Empty, BrokenPipeError, OSError):
+            return None
+        return json.loads(line) if line is not None else None
+
+    def kill(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+        try:
+            self._workdir.cleanup()
+        except OSError:
+            # 代码片段可能留下了无法删除的文件 (例如去掉了写权限)，不影响进程池继续工作
+            pass
+
+
+class SandboxPool:
+    """
+    预热的沙箱解释器进程池。
+    - 每个工作进程只启动一次，反复执行代码片段，省去解释器冷启动的开销；
+    - 每次执行都使用全新的命名空间，并撤销代码片段对已导入模块 (含 builtins) 的修改，代码片段之间互不影响；
+      导入了新模块的代码片段执行完后，工作进程会被替换，因为无法确认新模块是否被改动过；
+    - 工作进程带有内存、文件大小与子进程数量限制，并在各自的临时目录中运行；
+    - 超时或崩溃的工作进程会被杀掉并替换为新的进程；
+    - 提供 cache 时，确定性代码的结果会被缓存，重复执行时直接返回，不再进入沙箱。
+    """
+
+    def __init__(self, size: int = 2, timeout: float = 30, memory_limit_mb: int = 512, file_size_limit_mb: int = 16,
+                 cache: SnippetCache = None):
+        """
+        参数:
+        - size (int): 工作进程数量，即可同时执行的代码片段数。
+        - timeout (float): 单个代码片段的墙钟超时时间 (秒)。
+        - memory_limit_mb (int): 每个工作进程的地址空间上限 (MB)。
+        - file_size_limit_mb (int): 每个工作进程可写文件的大小上限 (MB)。
+        - cache (SnippetCache): 可选的代码结果缓存。
+        """
+        self.size = size
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.file_size_limit_mb = file_size_limit_mb
+        self.cache = cache
+        # 队列中的 None 表示一个空位：它原来的工作进程已被回收，而替换进程启动失败，下次取到时再尝试启动
+        self._idle: "queue.Queue[Optional[_Worker]]" = queue.Queue()
+        self._closed = False
+        try:
+            for _ in range(size):
+                self._idle.put(self._spawn())
+        except Exception:
+            self.close()
+            raise
+
+    def _spawn(self) -> _Worker:
+        worker = _Worker(self.memory_limit_mb, self.file_size_limit_mb)
+        if not worker.wait_ready(timeout=30):
+            worker.kill()
+            raise RuntimeError("沙箱工作进程启动失败。")
+        return worker
+
+    def _replace(self, worker: _Worker):
+        """
+        在后台杀掉工作进程并启动替换进程，调用方不必等待新进程就绪。
+        启动失败时放回一个空位，而不是让进程池永久少一个工作进程 (否则 run() 可能永远阻塞)。
+        """
+        def refill():
+            worker.kill()
+            try:
+                replacement = self._spawn()
+            except Exception as e:
+                print(f"❌ 替换沙箱工作进程失败: {e}")
+                replacement = None
+            if self._closed and replacement is not None:
+                replacement.kill()
+                return
+            self._idle.put(replacement)
+
+        threading.Thread(target=refill, daemon=True).start()
+
+    def _acquire(self) -> _Worker:
+        worker = self._idle.get()
+        if worker is not None:
+            return worker
+        try:
+            return self._spawn()
+        except Exception:
+            self._idle.put(None)
+            raise
+
+    def run(self, code: str, timeout: float = None) -> SandboxResult:
+        """
+        在空闲的工作进程中执行代码，所有工作进程都忙碌时会阻塞等待。
+        """
+        if self._closed:
+            raise RuntimeError("沙箱进程池已关闭。")
+
+        if self.cache is not None:
+            cached = self.cache.get(code)
+            if cached is not None:
+                print("⚡ 命中代码执行结果缓存，跳过沙箱执行。")
+                return cached
+
+        timeout = timeout or self.timeout
+        worker = self._acquire()
+        start = time.perf_counter()
+        result = worker.submit(code, timeout)
+
+        if result is None:
+            # 超时或崩溃：替换掉这个工作进程，避免残留状态影响后续任务
+            elapsed = time.perf_counter() - start
+            timed_out = worker.process.poll() is None
+            returncode = worker.process.returncode
+            self._replace(worker)
+            if timed_out:
+                return SandboxResult("", f"执行超时 (超过 {timeout} 秒)，已终止。", -9, elapsed)
+            return SandboxResult("", f"工作进程异常退出 (返回码 {returncode})。", -1, elapsed)
+
+        if result.pop("recycle", False):
+            self._replace(worker)
+        else:
+            self._idle.put(worker)
+        result = SandboxResult(**result)
+        if self.cache is not None:
+            self.cache.put(code, result)
+        return result
+
+    def close(self):
+        """
+        关闭所有工作进程。
+        """
+        self._closed = True
+        while not self._idle.empty():
+            worker = self._idle.get_nowait()
+            if worker is not None:
+                worker.kill()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == '__main__':
+    with SandboxPool(size=2, timeout=2, cache=SnippetCache()) as pool:
+        print(pool.run("import calendar\nprint(calendar.monthrange(2025, 11))"))
+        print(pool.run("x = 1\nprint(x)"))
+        print(pool.run("print(x)")) # 命名空间已重置，x 不存在
+        print(pool.run("import builtins\nbuiltins.print = lambda *args: None"))
+        print(pool.run("print('builtins 已恢复')"))
+        print(pool.run("while True: pass"))
+        print(pool.run("print('超时后工作进程已被替换')"))
+        print(pool.run("import calendar\n\n# 格式不同但语义相同\nprint( calendar.monthrange(2025,11) )"))
+        print(pool.cache.stats())
@@ -0,0 +1,144 @@
+"""
+沙箱工作进程：由 sandbox.SandboxPool 启动，常驻后台反复执行代码片段。
+
+通信协议：父进程每次向 stdin 写入一行 JSON {"code": "..."}，
+工作进程执行完毕后向协议通道写回一行 JSON {"stdout", "stderr", "exit_code", "runtime", "recycle"}，
+recycle 为 True 表示代码片段导入了新模块，父进程应当替换掉这个工作进程。
+"""
+import builtins
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+import traceback
+
+# 预先导入常用模块，省去每个代码片段重复导入的开销
+import calendar
+import collections
+import datetime
+import itertools
+import math
+import re
+import tracemalloc # benchmark.py 的基准测试脚本会用到
+
+
+def apply_limits(memory_limit_mb: int, file_size_limit_mb: int):
+    """
+    设置资源限制。resource 模块仅在类 Unix 系统上可用。
+    """
+    try:
+        import resource
+    except ImportError:
+        return
+
+    limits = [
+        (getattr(resource, "RLIMIT_AS", None), memory_limit_mb * 1024 * 1024),
+        (getattr(resource, "RLIMIT_FSIZE", None), file_size_limit_mb * 1024 * 1024),
+        (getattr(resource, "RLIMIT_NPROC", None), 0),
+    ]
+    for limit, value in limits:
+        if limit is None or value < 0:
+            continue
+        try:
+            resource.setrlimit(limit, (value, value))
+        except (ValueError, OSError):
+            # 部分平台 (例如 macOS 上的 RLIMIT_AS) 不支持设置，忽略即可
+            pass
+
+
+def snapshot_modules() -> dict:
+    """
+    记录当前已导入的每个模块 (含 builtins) 及其属性字典的浅拷贝。
+    """
+    return {name: (module, dict(vars(module))) for name, module in list(sys.modules.items())
+            if hasattr(module, "__dict__")}
+
+
+def restore_modules(snapshot: dict) -> bool:
+    """
+    撤销代码片段对已导入模块的修改：恢复 sys.modules 中被替换的条目，以及模块中被改写、新增或删除的属性
+    (例如 builtins.print = ...、math.pi = 3)。
+    返回代码片段是否导入了新的模块。新模块没有执行前的快照可供对照，片段可能已经改动了它们，
+    因此由父进程替换掉整个工作进程。
+    对象内部的原地修改 (例如 sys.path.append) 无法通过快照发现，不在此处理。
+    """
+    for name, (module, attrs) in snapshot.items():
+        if sys.modules.get(name) is not module:
+            sys.modules[name] = module
+        current = vars(module)
+        if len(current) == len(attrs) and all(current.get(key, current) is value for key, value in attrs.items()):
+            continue
+        # 逐个属性恢复，而不是 clear() 后整体更新，避免 sys、builtins 在恢复过程中短暂地缺少属性
+        for key in [key for key in current if key not in attrs]:
+            del current[key]
+        for key, value in attrs.items():
+            if current.get(key, current) is not value:
+                current[key] = value
+    return any(name not in snapshot for name in sys.modules)
+
+
+def run_snippet(code: str) -> dict:
+    """
+    在全新的命名空间中执行代码，捕获标准输出与标准错误。
+    执行结束后撤销代码片段对已导入模块的修改，保证下一个代码片段看到的环境与这一个相同。
+    """
+    snapshot = snapshot_modules()
+    namespace = {"__name__": "__main__", "__builtins__": builtins}
+    stdout, stderr = io.StringIO(), io.StringIO()
+    exit_code = 0
+    start = time.perf_counter()
+
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            exec(compile(code, "<snippet>", "exec"), namespace)
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+            if e.code is not None and not isinstance(e.code, int):
+                print(e.code, file=sys.stderr)
+        except BaseException:
+            exit_code = 1
+            # 跳过工作进程自身的栈帧，只保留代码片段的调用栈
+            etype, value, tb = sys.exc_info()
+            traceback.print_exception(etype, value, tb.tb_next)
+    runtime = time.perf_counter() - start
+
+    return {
+        "stdout": stdout.getvalue(),
+        "stderr": stderr.getvalue(),
+        "exit_code": exit_code,
+        "runtime": runtime,
+        "recycle": restore_modules(snapshot),
+    }
+
+
+def main():
+    memory_limit_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 512
+    file_size_limit_mb = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+
+    # 复制一份真正的 stdout 作为协议通道，再把文件描述符 1 指向空设备，
+    # 防止代码片段直接写 fd 1 (例如 os.write) 破坏通信协议
+    protocol = os.fdopen(os.dup(1), "w", encoding="utf-8")
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.dup2(devnull, 2)
+
+    apply_limits(memory_limit_mb, file_size_limit_mb)
+
+    # 先执行一个会抛出异常的片段，让打印调用栈时才按需导入的模块 (linecache 等) 提前加载，
+    # 否则第一个出错的代码片段会被误判为导入了新模块
+    run_snippet("raise RuntimeError")
+
+    protocol.write(json.dumps({"ready": True}) + "\n")
+    protocol.flush()
+
+    for line in sys.stdin:
+        request = json.loads(line)
+        result = run_snippet(request["code"])
+        protocol.write(json.dumps(result, ensure_ascii=False) + "\n")
+        protocol.flush()
+
+
+if __name__ == "__main__":
+    main()
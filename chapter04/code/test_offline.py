@@ -0,0 +1,140 @@
+# test_offline.py
+# 不调用真实模型服务，验证响应缓存、ReAct 流式解析、计划规范化与工具执行器的超时逻辑
+# 本目录带有 __init__.py 且包名 code 与标准库重名，需在本目录下运行:
+#   python -m pytest --import-mode=importlib test_offline.py  或  python test_offline.py
+import asyncio
+import importlib.util
+import tempfile
+import time
+from pathlib import Path
+
+from cache import LRUCache, SQLiteCache, make_cache_key
+from ReAct import ReActStreamParser
+from tool import ToolExecutor
+
+# 文件名中包含 "&"，不能直接 import
+_spec = importlib.util.spec_from_file_location("plan_and_solve", Path(__file__).parent / "Plan&Solve.py")
+plan_and_solve = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(plan_and_solve)
+normalize_plan = plan_and_solve.normalize_plan
+
+
+def test_cache_key_ignores_dict_order():
+    a = make_cache_key("m", [{"role": "user", "content": "你好"}], 0.0)
+    b = make_cache_key("m", [{"content": "你好", "role": "user"}], 0.0)
+    assert a == b
+    assert a != make_cache_key("m", [{"role": "user", "content": "你好"}], 0.7)
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(max_bytes=10)
+    cache.set("a", "aaaa")
+    cache.set("b", "bbbb")
+    assert cache.get("a") == "aaaa" # a 变为最近使用
+    cache.set("c", "cccc")
+    assert cache.get("b") is None
+    assert cache.get("a") == "aaaa" and cache.get("c") == "cccc"
+    # 超过容量上限的单个值不会被缓存
+    cache.set("d", "d" * 11)
+    assert cache.get("d") is None
+    assert cache.stats()["hits"] == 3 and cache.stats()["misses"] == 2
+
+
+def test_lru_cache_expires_entries():
+    cache = LRUCache(ttl=0.05)
+    cache.set("a", "value")
+    assert cache.get("a") == "value"
+    time.sleep(0.1)
+    assert cache.get("a") is None
+
+
+def test_sqlite_cache_persists_and_evicts():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "cache.sqlite3"
+        cache = SQLiteCache(path, max_bytes=10)
+        cache.set("a", "aaaa")
+        time.sleep(0.01)
+        cache.set("b", "bbbb")
+        time.sleep(0.01)
+        assert cache.get("a") == "aaaa" # 更新 a 的访问时间
+        time.sleep(0.01)
+        cache.set("c", "cccc")
+        cache.close()
+
+        # 重新打开后数据依然存在，最久未访问的 b 已被淘汰
+        cache = SQLiteCache(path, max_bytes=10)
+        assert cache.get("a") == "aaaa" and cache.get("c") == "cccc"
+        assert cache.get("b") is None
+        cache.clear()
+        assert cache.get("a") is None
+        cache.close()
+
+
+def test_react_parser_stops_after_finish():
+    parser = ReActStreamParser()
+    chunks = ["Thought: 已经知道答案\nAct", "ion: Finish[列表 [1, ", "2]", "]\nObservation: 编造的内容"]
+    stopped = [parser.feed(chunk) for chunk in chunks]
+    # 括号闭合之前不能判定 Finish 已经完整
+    assert stopped == [False, False, False, True]
+    assert parser.finish() == ("已经知道答案", ["Finish[列表 [1, 2]]"])
+
+
+def test_react_parser_collects_parallel_actions():
+    parser = ReActStreamParser()
+    assert not parser.feed("Thought: 分别搜索\nAction: search[A]\nAction: search[B]\n")
+    # Action 段落之后出现其他内容，说明模型开始编造 Observation，可以停止生成
+    assert parser.feed("Observation")
+    assert parser.finish() == ("分别搜索", ["search[A]", "search[B]"])
+
+
+def test_normalize_plan_sanitizes_dependencies():
+    steps = normalize_plan([
+        "第一步",
+        {"step": "第二步", "depends_on": 1},
+        {"step": "第三步", "depends_on": [1, 1, 3, True, "2", [1]]},
+        {"step": "第四步", "depends_on": [5]},
+        {"step": "第五步", "depends_on": []},
+    ])
+    assert [step["depends_on"] for step in steps] == [[], [1], [1], [3], []]
+    assert [step["id"] for step in steps] == [1, 2, 3, 4, 5]
+
+
+def test_tool_executor_reports_timeout():
+    executor = ToolExecutor(max_workers=2, default_timeout=5)
+    executor.registerTool("slow", "慢工具", lambda x: time.sleep(0.5) or x, timeout=0.1)
+    executor.registerTool("fast", "快工具", lambda x: x.upper())
+    results = executor.executeMany([("slow", "a"), ("fast", "b"), ("missing", "c")])
+    executor.shutdown()
+
+    assert "超时" in results[0]
+    assert results[1] == "B"
+    assert "未找到" in results[2]
+    assert executor.getMetrics()["slow"]["timeouts"] == 1
+
+
+def test_tool_executor_timeout_excludes_queue_time():
+    # 只有一个线程：第二个调用要排队约 0.3 秒，但它自身只运行 0.3 秒，不应超时
+    executor = ToolExecutor(max_workers=1, default_timeout=0.5)
+    executor.registerTool("work", "耗时工具", lambda x: time.sleep(0.3) or x)
+    results = executor.executeMany([("work", "a"), ("work", "b")])
+    executor.shutdown()
+    assert results == ["a", "b"]
+
+
+def test_tool_executor_runs_coroutine_tools():
+    async def echo(x):
+        await asyncio.sleep(0.01)
+        return f"async:{x}"
+
+    executor = ToolExecutor()
+    executor.registerTool("echo", "异步工具", echo)
+    assert executor.execute("echo", "a") == "async:a"
+    assert asyncio.run(executor.aexecute("echo", "b")) == "async:b"
+    executor.shutdown()
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"✅ {name}")
@@ -1,27 +1,168 @@
-from serpapi import SerpApiClient
-from typing import Dict, Any
+import requests
+from requests.adapters import HTTPAdapter
+from typing import Dict, Any, List, Tuple, Optional
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import asyncio
+import threading
+import time
 
 import yaml
 
 from pathlib import Path
 current_dir = Path(__file__).parent
 
-# 读取配置文件
-with open(current_dir.parent.parent.parent / 'config.yaml', 'r') as f:
-    config = yaml.safe_load(f)
+# 读取配置文件；文件不存在时 (例如离线运行测试) 使用空配置，各参数取默认值
+config = {}
+config_path = current_dir.parent.parent.parent / 'config.yaml'
+if config_path.exists():
+    with open(config_path, 'r') as f:
+        config = yaml.safe_load(f) or {}
 
 
+SERPAPI_ENDPOINT = "https://serpapi.com/search.json"
 
-def search(query: str) -> str:
+# 不同类型结果的缓存时间 (秒)：直接答案变化慢，网页摘要变化快，空结果只短暂缓存
+SEARCH_TTL = {
+    "answer_box": 24 * 3600,
+    "knowledge_graph": 24 * 3600,
+    "organic": 3600,
+    "empty": 300,
+}
+
+
+class SearchCache:
     """
-    一个基于SerpApi的实战网页搜索引擎工具。
-    它会智能地解析搜索结果，优先返回直接答案或知识图谱信息。
+    搜索结果缓存，带有按结果类型区分的 TTL 与 LRU 容量上限。
+    同时实现 single-flight：相同查询同时只会有一个请求发往上游，其他调用方等待并共享结果。
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: Dict[str, float] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl or SEARCH_TTL
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "upstream_requests": 0, "errors": 0}
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        """
+        规范化查询：去掉首尾空白、合并连续空白并转为小写。
+        """
+        return " ".join(query.split()).lower()
+
+    def get_or_fetch(self, query: str, fetch: callable) -> str:
+        """
+        命中缓存时直接返回；否则调用 fetch(query) -> (结果文本, 结果类型)，
+        结果类型为 None 表示出错，不写入缓存。
+        """
+        key = self.normalize(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[0]
+
+            future = self._inflight.get(key)
+            if future is not None:
+                self.stats["coalesced"] += 1
+                leader = False
+            else:
+                future = Future()
+                self._inflight[key] = future
+                self.stats["misses"] += 1
+                self.stats["upstream_requests"] += 1
+                leader = True
+
+        if not leader:
+            return future.result()
+
+        try:
+            text, result_type = fetch(query)
+            with self._lock:
+                if result_type is None:
+                    self.stats["errors"] += 1
+                else:
+                    self._entries[key] = (text, time.monotonic() + self.ttl.get(result_type, 0))
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            future.set_result(text)
+            return text
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        导出缓存统计信息，coalesced 表示被合并到在途请求上的调用次数。
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats["cached_entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"] + stats["coalesced"]
+        stats["hit_rate"] = (stats["hits"] + stats["coalesced"]) / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_search_cache = SearchCache()
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+def _get_session() -> requests.Session:
+    """
+    获取共享的 HTTP 会话，复用连接池，避免每次搜索都重新建立 TLS 连接。
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=config.get('SEARCH_POOL_SIZE', 16))
+            _session.mount("https://", adapter)
+        return _session
+
+
+def _parse_results(query: str, results: Dict[str, Any]) -> Tuple[str, str]:
+    """
+    智能解析 SerpApi 的结果，返回 (结果文本, 结果类型)。
+    """
+    # 智能解析:优先寻找最直接的答案
+    if "answer_box_list" in results:
+        return "\n".join(results["answer_box_list"]), "answer_box"
+    if "answer_box" in results and "answer" in results["answer_box"]:
+        return results["answer_box"]["answer"], "answer_box"
+    if "knowledge_graph" in results and "description" in results["knowledge_graph"]:
+        return results["knowledge_graph"]["description"], "knowledge_graph"
+    if "organic_results" in results and results["organic_results"]:
+        # 如果没有直接答案，则返回前三个有机结果的摘要
+        snippets = [
+            f"[{i+1}] {res.get('title', '')}\n{res.get('snippet', '')}"
+            for i, res in enumerate(results["organic_results"][:3])
+        ]
+        return "\n\n".join(snippets), "organic"
+
+    return f"对不起，没有找到关于 '{query}' 的信息。", "empty"
+
+
+def _fetch_search(query: str) -> Tuple[str, Optional[str]]:
+    """
+    向 SerpApi 发起一次真实请求。出错时结果类型为 None，调用方不会缓存该结果。
     """
     print(f"🔍 正在执行 [SerpApi] 网页搜索: {query}")
     try:
         api_key = config['SERPAPI_API_KEY']
         if not api_key:
-            return "错误:SERPAPI_API_KEY 未在 .env 文件中配置。"
+            return "错误:SERPAPI_API_KEY 未在 .env 文件中配置。", None
 
         params = {
             "engine": "google",
@@ -31,62 +172,321 @@ def search(query: str) -> str:
             "hl": "zh-cn", # 语言代码
         }
 
-        client = SerpApiClient(params)
-        results = client.get_dict()
-
-        # 智能解析:优先寻找最直接的答案
-        if "answer_box_list" in results:
-            return "\n".join(results["answer_box_list"])
-        if "answer_box" in results and "answer" in results["answer_box"]:
-            return results["answer_box"]["answer"]
-        if "knowledge_graph" in results and "description" in results["knowledge_graph"]:
-            return results["knowledge_graph"]["description"]
-        if "organic_results" in results and results["organic_results"]:
-            # 如果没有直接答案，则返回前三个有机结果的摘要
-            snippets = [
-                f"[{i+1}] {res.get('title', '')}\n{res.get('snippet', '')}"
-                for i, res in enumerate(results["organic_results"][:3])
-            ]
-            return "\n\n".join(snippets)
-
-        return f"对不起，没有找到关于 '{query}' 的信息。"
+        response = _get_session().get(SERPAPI_ENDPOINT, params=params, timeout=config.get('SEARCH_TIMEOUT', 30))
+        response.raise_for_status()
+        results = response.json()
+        if "error" in results:
+            return f"搜索时发生错误: {results['error']}", None
+        return _parse_results(query, results)
 
     except Exception as e:
-        return f"搜索时发生错误: {e}"
+        return f"搜索时发生错误: {e}", None
+
 
+def search(query: str) -> str:
+    """
+    一个基于SerpApi的实战网页搜索引擎工具。
+    它会智能地解析搜索结果，优先返回直接答案或知识图谱信息。
+    相同的查询在缓存有效期内只会请求一次上游接口，并发的相同查询会合并为一次请求。
+    """
+    return _search_cache.get_or_fetch(query, _fetch_search)
+
+
+def get_search_stats() -> Dict[str, Any]:
+    """
+    导出搜索缓存的统计信息。
+    """
+    return _search_cache.get_stats()
+
+
+
+# 工具耗时直方图的桶上界 (秒)，最后一个桶收集所有更慢的调用
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float("inf"))
+
+
+class ToolRecord:
+    """
+    工具注册记录，使用 __slots__ 减少内存占用并加快属性访问。
+    除了工具本身的信息，还记录调用次数、错误、超时与耗时直方图。
+    """
+    __slots__ = (
+        "name", "description", "func", "timeout",
+        "calls", "errors", "timeouts", "total_time", "latency_counts", "_lock",
+    )
+
+    def __init__(self, name: str, description: str, func: callable, timeout: float = None):
+        self.name = name
+        self.description = description
+        self.func = func
+        self.timeout = timeout
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.total_time = 0.0
+        self.latency_counts = [0] * len(LATENCY_BUCKETS)
+        self._lock = threading.Lock()
+
+    def observe(self, elapsed: float, error: bool = False):
+        """
+        记录一次调用的耗时与是否出错。
+        """
+        index = next(i for i, bound in enumerate(LATENCY_BUCKETS) if elapsed <= bound)
+        with self._lock:
+            self.calls += 1
+            self.total_time += elapsed
+            self.latency_counts[index] += 1
+            if error:
+                self.errors += 1
+
+    def observe_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def percentile(self, q: float) -> float:
+        """
+        根据直方图估算耗时分位数，返回所在桶的上界。
+        """
+        if not self.calls:
+            return 0.0
+        target = q * self.calls
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.latency_counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return LATENCY_BUCKETS[-1]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "error_rate": self.errors / self.calls if self.calls else 0.0,
+            "avg_latency": self.total_time / self.calls if self.calls else 0.0,
+            "p50_latency": self.percentile(0.5),
+            "p95_latency": self.percentile(0.95),
+            "histogram": {
+                f"<={bound}s": count
+                for bound, count in zip(LATENCY_BUCKETS, self.latency_counts)
+            },
+        }
 
 
 class ToolExecutor:
     """
     一个工具执行器，负责管理和执行工具。
+    工具描述与 JSON Schema 按工具集版本缓存，只在工具集变化后重新渲染。
     """
-    def __init__(self):
-        self.tools: Dict[str, Dict[str, Any]] = {}
+    def __init__(self, max_workers: int = 8, default_timeout: float = 30):
+        """
+        参数:
+        - max_workers (int): 并行执行工具调用的最大线程数。
+        - default_timeout (float): 工具未单独指定超时时间时使用的默认超时 (秒)。
+        """
+        self.tools: Dict[str, ToolRecord] = {}
+        # 工具集版本号，每次注册工具时递增，供调用方判断缓存的工具描述是否过期
+        self.version = 0
+        self.max_workers = max_workers
+        self.default_timeout = default_timeout
+        self._pool = None # 线程池在第一次并行调用时创建
+        self._catalog = None
+        self._schemas = None
+        self._cache_version = None
 
-    def registerTool(self, name: str, description: str, func: callable):
+    def registerTool(self, name: str, description: str, func: callable, timeout: float = None):
         """
         向工具箱中注册一个新工具。
+        timeout 为该工具单次调用的超时时间 (秒)，不指定时使用 default_timeout。
         """
         if name in self.tools:
             print(f"警告:工具 '{name}' 已存在，将被覆盖。")
 
-        self.tools[name] = {"description": description, "func": func}
+        self.tools[name] = ToolRecord(name, description, func, timeout)
+        self.version += 1
         print(f"工具 '{name}' 已注册。")
 
     def getTool(self, name: str) -> callable:
         """
         根据名称获取一个工具的执行函数。
         """
-        return self.tools.get(name, {}).get("func")
+        record = self.tools.get(name)
+        return record.func if record else None
+
+    def _refresh_catalog(self):
+        """
+        工具集版本变化时重新渲染描述字符串与 JSON Schema。
+        """
+        if self._cache_version == self.version:
+            return
+        self._catalog = "\n".join([
+            f"- {name}: {record.description}"
+            for name, record in self.tools.items()
+        ])
+        self._schemas = [
+            {
+                "type": "function",
+                "function": {
+                    "name": name,
+                    "description": record.description,
+                    "parameters": {
+                        "type": "object",
+                        "properties": {"input": {"type": "string", "description": "工具的输入"}},
+                        "required": ["input"],
+                    },
+                },
+            }
+            for name, record in self.tools.items()
+        ]
+        self._cache_version = self.version
 
     def getAvailableTools(self) -> str:
         """
         获取所有可用工具的格式化描述字符串。
         """
-        return "\n".join([
-            f"- {name}: {info['description']}"
-            for name, info in self.tools.items()
-        ])
+        self._refresh_catalog()
+        return self._catalog
+
+    def getToolSchemas(self) -> List[Dict[str, Any]]:
+        """
+        获取所有工具的 OpenAI 函数调用格式 JSON Schema。
+        """
+        self._refresh_catalog()
+        return self._schemas
+
+    def _get_pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="tool")
+        return self._pool
+
+    def _timeout_of(self, record: ToolRecord) -> float:
+        # 显式指定的 timeout (包括 0) 优先，只有未指定时才使用默认值
+        return record.timeout if record.timeout is not None else self.default_timeout
+
+    def _invoke(self, record: ToolRecord, tool_input: str, on_start: callable = None):
+        """
+        调用工具函数并记录耗时与错误。
+        on_start 在工具真正开始执行时被调用，executeMany 据此从开始执行的时刻计算超时。
+        同步路径上调用协程工具时，在当前工作线程中用独立的事件循环运行它。
+        """
+        if on_start is not None:
+            on_start()
+        start = time.perf_counter()
+        try:
+            if asyncio.iscoroutinefunction(record.func):
+                result = asyncio.run(record.func(tool_input))
+            else:
+                result = record.func(tool_input)
+        except Exception:
+            record.observe(time.perf_counter() - start, error=True)
+            raise
+        record.observe(time.perf_counter() - start)
+        return result
+
+    def execute(self, name: str, tool_input: str) -> str:
+        """
+        执行单个工具调用，超时或出错时返回错误信息。
+        """
+        return self.executeMany([(name, tool_input)])[0]
+
+    async def aexecute(self, name: str, tool_input: str) -> str:
+        """
+        execute() 的异步版本。协程工具直接 await，普通函数在线程池中运行，不阻塞事件循环。
+        """
+        record = self.tools.get(name)
+        if record is None:
+            return f"错误:未找到名为 '{name}' 的工具。"
+
+        timeout = self._timeout_of(record)
+        if asyncio.iscoroutinefunction(record.func):
+            awaitable = self._ainvoke(record, tool_input)
+        else:
+            loop = asyncio.get_running_loop()
+            awaitable = loop.run_in_executor(self._get_pool(), self._invoke, record, tool_input)
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            record.observe_timeout()
+            return f"错误:工具 '{name}' 执行超时 (超过 {timeout} 秒)。"
+        except Exception as e:
+            return f"错误:工具 '{name}' 执行失败: {e}"
+
+    async def _ainvoke(self, record: ToolRecord, tool_input: str):
+        start = time.perf_counter()
+        try:
+            result = await record.func(tool_input)
+        except Exception:
+            record.observe(time.perf_counter() - start, error=True)
+            raise
+        record.observe(time.perf_counter() - start)
+        return result
+
+    def executeMany(self, calls: List[Tuple[str, str]]) -> List[str]:
+        """
+        通过有界线程池并行执行多个工具调用，结果按 calls 的顺序返回。
+        每个调用的超时从它真正开始执行时算起，在线程池中排队的时间不计入超时。
+        超时或出错的调用返回错误信息，不会影响其他调用。
+        注意：Python 线程无法被强制终止，超时的调用会在后台继续运行直至结束。
+        """
+        pool = self._get_pool()
+
+        batch_start = time.monotonic()
+        started = [threading.Event() for _ in calls]
+        start_times = [None] * len(calls)
+
+        def mark_started(i):
+            start_times[i] = time.monotonic()
+            started[i].set()
+
+        futures = []
+        for i, (name, tool_input) in enumerate(calls):
+            record = self.tools.get(name)
+            if record is None:
+                futures.append(None)
+            else:
+                futures.append(pool.submit(self._invoke, record, tool_input, lambda i=i: mark_started(i)))
+
+        # 排队等待的上限：包括自己所在的这一批在内，所有调用一批批执行完 (每批最多耗时一个超时) 所需的时间
+        timeouts = [self._timeout_of(self.tools[name]) for (name, _), f in zip(calls, futures) if f is not None]
+        waves = -(-len(timeouts) // self.max_workers) if timeouts else 0
+        queue_deadline = batch_start + max(timeouts + [self.default_timeout]) * waves
+
+        results = []
+        for i, ((name, tool_input), future) in enumerate(zip(calls, futures)):
+            if future is None:
+                results.append(f"错误:未找到名为 '{name}' 的工具。")
+                continue
+
+            record = self.tools[name]
+            timeout = self._timeout_of(record)
+            if not started[i].wait(timeout=max(0, queue_deadline - time.monotonic())) and future.cancel():
+                # 线程仍被之前超时的调用占用，这个调用始终没有开始执行
+                results.append(f"错误:工具 '{name}' 排队等待过久，未能开始执行。")
+                continue
+            started[i].wait()
+            remaining = max(0, start_times[i] + timeout - time.monotonic())
+            try:
+                results.append(future.result(timeout=remaining))
+            except FutureTimeoutError:
+                future.cancel()
+                record.observe_timeout()
+                results.append(f"错误:工具 '{name}' 执行超时 (超过 {timeout} 秒)。")
+            except Exception as e:
+                results.append(f"错误:工具 '{name}' 执行失败: {e}")
+        return results
+
+    def getMetrics(self) -> Dict[str, Dict[str, Any]]:
+        """
+        获取每个工具的调用统计：调用次数、错误率、超时次数与耗时分布。
+        """
+        return {name: record.stats() for name, record in self.tools.items()}
+
+    def shutdown(self):
+        """
+        关闭并行执行所用的线程池。
+        """
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
 
 
 
@@ -108,10 +508,15 @@ if __name__ == '__main__':
     tool_name = "Search"
     tool_input = "英伟达最新的GPU型号是什么"
 
-    tool_function = tool_executor.getTool(tool_name)
-    if tool_function:
-        observation = tool_function(tool_input)
-        print("--- 观察 (Observation) ---")
-        print(observation)
-    else:
-        print(f"错误:未找到名为 '{tool_name}' 的工具。")
+    observation = tool_executor.execute(tool_name, tool_input)
+    print("--- 观察 (Observation) ---")
+    print(observation)
+
+    # 5. 重复查询会命中缓存，不再请求 SerpApi
+    tool_executor.execute(tool_name, f"  {tool_input} ")
+    print("\n--- 搜索缓存统计 ---")
+    print(get_search_stats())
+
+    # 6. 工具调用统计
+    print("\n--- 工具调用统计 ---")
+    print(tool_executor.getMetrics())
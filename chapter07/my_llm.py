@@ -1,10 +1,18 @@
 # my_llm.py
 import os
-from typing import Optional
-from openai import OpenAI
+from typing import Optional, Iterator, List, Dict, Any
+from openai import OpenAI, BadRequestError, UnprocessableEntityError
 from hello_agents import HelloAgentsLLM
 
 
+class ToolsNotSupportedError(Exception):
+    """模型服务拒绝了 tools 参数，说明它不支持原生函数调用"""
+
+
+# 服务拒绝 tools= 参数时，报错信息中通常会提到这些词
+TOOLS_ERROR_KEYWORDS = ("tool", "function")
+
+
 class MyLLM(HelloAgentsLLM):
     def __init__(
         self,
@@ -39,3 +47,36 @@ class MyLLM(HelloAgentsLLM):
         else:
             # 如果不是 modelscope, 则完全使用父类的原始逻辑来处理
             super().__init__(model=model, api_key=api_key, base_url=base_url, provider=provider, **kwargs)
+
+    def stream_chat(self, messages: List[Dict[str, Any]], tools: Optional[list] = None, **kwargs) -> Iterator[Any]:
+        """
+        流式调用并逐块返回 delta (含 content 与 tool_calls 增量)，tools 为 OpenAI tools= 格式的 JSON Schema 列表
+        请求在调用时立即发出；服务因为 tools 参数拒绝请求时抛出 ToolsNotSupportedError，其他错误原样抛出
+        """
+        # 与 invoke 一致：temperature / max_tokens 有默认值，其余参数原样传给接口
+        params = {"model": self.model, "temperature": kwargs.pop("temperature", getattr(self, "temperature", 0.7))}
+        max_tokens = kwargs.pop("max_tokens", getattr(self, "max_tokens", None))
+        if max_tokens:
+            params["max_tokens"] = max_tokens
+        kwargs.pop("stream", None)
+        params.update(kwargs)
+        if tools:
+            params["tools"] = tools
+
+        try:
+            response = self._client.chat.completions.create(messages=messages, stream=True, **params)
+        except (BadRequestError, UnprocessableEntityError) as e:
+            # 只根据这次请求本身的报错判断，不再额外发送探测请求
+            if tools and any(keyword in str(e).lower() for keyword in TOOLS_ERROR_KEYWORDS):
+                raise ToolsNotSupportedError(str(e)) from e
+            raise
+        return self._iter_deltas(response)
+
+    @staticmethod
+    def _iter_deltas(response) -> Iterator[Any]:
+        try:
+            for chunk in response:
+                if chunk.choices:
+                    yield chunk.choices[0].delta
+        finally:
+            response.close()
@@ -0,0 +1,230 @@
+# my_memory.py
+import math
+import sys
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, List, Dict, Callable
+
+# token 计数复用第四章上下文压缩中的实现
+sys.path.append((Path(__file__).parent.parent / "chapter04" / "code").as_posix())
+from compaction import count_tokens
+
+
+SUMMARY_PROMPT = """请把下面的对话合并进已有的对话摘要，生成一份新的摘要。
+- 保留用户的身份、偏好、目标，以及已经确认的事实、数字和结论；
+- 删除寒暄与重复内容；
+- 摘要不超过 {max_tokens} 个 token，直接输出摘要本身。
+
+## 已有摘要
+{summary}
+
+## 新的对话
+{turns}
+"""
+
+
+class Turn:
+    """
+    一轮对话 (用户输入 + 助手回答)，token 数与向量只计算一次
+    """
+    __slots__ = ("user", "assistant", "tokens", "embedding")
+
+    def __init__(self, user: str, assistant: str):
+        self.user = user
+        self.assistant = assistant
+        self.tokens = count_tokens(user) + count_tokens(assistant)
+        self.embedding: Optional[List[float]] = None
+
+    def to_messages(self) -> List[Dict[str, str]]:
+        return [{"role": "user", "content": self.user}, {"role": "assistant", "content": self.assistant}]
+
+    def to_text(self) -> str:
+        return f"用户: {self.user}\n助手: {self.assistant}"
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class ConversationMemory:
+    """
+    按 token 预算管理对话上下文，每轮发送给模型的消息由四部分组成:
+    1. 固定区: 系统提示词 (含工具说明) 与 pin() 固定的内容，始终保留；
+    2. 摘要: 被移出窗口的旧对话由廉价模型在后台滚动压缩成一段摘要；
+    3. 召回: 可选，根据当前输入的向量相似度，从旧对话中找回最相关的几轮；
+    4. 窗口: 预算内最近的若干轮完整对话。
+    各部分都有上限，因此无论会话多长，每轮的提示词 token 数都保持稳定。
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 2000,
+        summarizer=None,
+        summary_max_tokens: int = 300,
+        embedder: Optional[Callable[[List[str]], List[List[float]]]] = None,
+        recall_k: int = 2,
+        recall_min_score: float = 0.75,
+        recall_max_tokens: int = 500,
+        archive_max_turns: Optional[int] = 200
+    ):
+        """
+        参数:
+        - max_tokens (int): 最近对话窗口的 token 预算。
+        - summarizer: 生成摘要的 LLM (需提供 invoke(messages))，建议使用更便宜的模型；为空时旧对话直接丢弃。
+        - summary_max_tokens (int): 摘要的 token 上限。
+        - embedder (callable): 文本列表 -> 向量列表，提供时启用旧对话召回。
+        - recall_k (int): 每轮最多召回的旧对话轮数。
+        - recall_min_score (float): 召回所需的最低余弦相似度。
+        - recall_max_tokens (int): 召回内容的 token 上限。
+        - archive_max_turns (int): 保留用于召回的旧对话轮数上限，超出后丢弃最旧的；为 None 时不限制。
+        """
+        self.max_tokens = max_tokens
+        self.summarizer = summarizer
+        self.summary_max_tokens = summary_max_tokens
+        self.embedder = embedder
+        self.recall_k = recall_k
+        self.recall_min_score = recall_min_score
+        self.recall_max_tokens = recall_max_tokens
+
+        self.pinned: Dict[str, str] = {}
+        self.window: deque = deque()
+        self.window_tokens = 0
+        self.summary = ""
+        self.archive: deque = deque(maxlen=archive_max_turns) # 已移出窗口的对话，用于召回
+        self._unsummarized: List[Turn] = [] # 已移出窗口、但还没有合并进摘要的对话
+        self._lock = threading.Lock()
+        self._worker: Optional[ThreadPoolExecutor] = None # 后台摘要线程，首次需要时创建，close() 之后可以重新创建
+        self._generation = 0 # 每次 clear() 加一，清空之前排队的后台任务完成后不再写回结果
+
+    def pin(self, name: str, content: str):
+        """固定一段内容 (例如用户资料、任务说明)，它会始终出现在系统消息中"""
+        self.pinned[name] = content
+
+    def unpin(self, name: str):
+        self.pinned.pop(name, None)
+
+    def add_turn(self, user: str, assistant: str):
+        """记录一轮对话；超出预算时把最旧的若干轮移出窗口，交给后台线程做摘要与向量化"""
+        turn = Turn(user, assistant)
+        evicted = []
+        with self._lock:
+            self.window.append(turn)
+            self.window_tokens += turn.tokens
+            # 至少保留最近的一轮
+            while self.window_tokens > self.max_tokens and len(self.window) > 1:
+                old = self.window.popleft()
+                self.window_tokens -= old.tokens
+                evicted.append(old)
+            self._unsummarized.extend(evicted)
+            generation = self._generation
+            if evicted and self._worker is None:
+                self._worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory")
+            worker = self._worker
+
+        if evicted:
+            print(f"🗜️ {len(evicted)} 轮旧对话移出窗口" + ("，后台生成摘要" if self.summarizer is not None else ""))
+            worker.submit(self._absorb, generation)
+
+    def _absorb(self, generation: int):
+        """
+        后台任务：为待处理的旧对话计算向量并合并进滚动摘要
+        失败时这些对话保持待处理状态，下一次有对话移出窗口时一并重试
+        """
+        with self._lock:
+            if generation != self._generation:
+                return
+            evicted = list(self._unsummarized)
+        if not evicted:
+            return
+
+        try:
+            if self.embedder is not None:
+                missing = [turn for turn in evicted if turn.embedding is None]
+                if missing:
+                    for turn, embedding in zip(missing, self.embedder([turn.to_text() for turn in missing])):
+                        turn.embedding = embedding
+
+            summary = self.summary
+            if self.summarizer is not None:
+                prompt = SUMMARY_PROMPT.format(
+                    max_tokens=self.summary_max_tokens,
+                    summary=self.summary or "(无)",
+                    turns="\n\n".join(turn.to_text() for turn in evicted),
+                )
+                summary = self.summarizer.invoke([{"role": "user", "content": prompt}]) or self.summary
+        except Exception as e:
+            print(f"❌ 生成对话摘要失败，{len(evicted)} 轮对话将在下次重试: {e}")
+            return
+
+        with self._lock:
+            if generation != self._generation:
+                # 任务排队期间记忆已被 clear()，丢弃结果
+                return
+            self.summary = summary
+            self.archive.extend(evicted)
+            self._unsummarized = [turn for turn in self._unsummarized if turn not in evicted]
+
+    def _recall(self, query: str) -> List[Turn]:
+        if self.embedder is None:
+            return []
+        with self._lock:
+            candidates = [turn for turn in self.archive if turn.embedding is not None]
+        if not candidates:
+            return []
+
+        query_embedding = self.embedder([query])[0]
+        scored = sorted(((_cosine(query_embedding, turn.embedding), turn) for turn in candidates),
+                        key=lambda item: item[0], reverse=True)
+        recalled, tokens = [], 0
+        for score, turn in scored[:self.recall_k]:
+            if score < self.recall_min_score or tokens + turn.tokens > self.recall_max_tokens:
+                break
+            recalled.append(turn)
+            tokens += turn.tokens
+        return recalled
+
+    def build_messages(self, system_prompt: str, user_input: str) -> List[Dict[str, str]]:
+        """组装本轮发送给模型的消息列表"""
+        sections = [system_prompt] if system_prompt else []
+        sections += [f"## {name}\n{content}" for name, content in self.pinned.items()]
+
+        with self._lock:
+            summary = self.summary
+            pending = list(self._unsummarized)
+            window = list(self.window)
+
+        if summary:
+            sections.append(f"## 之前对话的摘要\n{summary}")
+        if pending and self.summarizer is not None:
+            # 摘要还在后台生成，这几轮先原样附上，避免上下文出现空档
+            sections.append("## 较早的对话\n" + "\n\n".join(turn.to_text() for turn in pending))
+
+        recalled = self._recall(user_input)
+        if recalled:
+            sections.append("## 可能相关的历史对话\n" + "\n\n".join(turn.to_text() for turn in recalled))
+
+        messages = [{"role": "system", "content": "\n\n".join(sections)}] if sections else []
+        for turn in window:
+            messages.extend(turn.to_messages())
+        messages.append({"role": "user", "content": user_input})
+        return messages
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self.window.clear()
+            self.window_tokens = 0
+            self.summary = ""
+            self.archive.clear()
+            self._unsummarized.clear()
+
+    def close(self):
+        """等待后台摘要任务完成并关闭线程；之后再调用 add_turn() 会重新创建线程"""
+        with self._lock:
+            worker, self._worker = self._worker, None
+        if worker is not None:
+            worker.shutdown(wait=True)
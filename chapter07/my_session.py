@@ -0,0 +1,311 @@
+# my_session.py
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, List, Dict, Iterator
+
+from my_memory import count_tokens
+from my_simple_agent import MySimpleAgent
+
+
+class SessionStore:
+    """
+    会话历史存储的基类，按 session_id 保存消息列表 ({"role", "content"})
+    子类只需实现 _load / _append / _delete，线程安全由基类的锁保证
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def load(self, session_id: str, limit: Optional[int] = None) -> List[Dict[str, str]]:
+        """读取会话最近的 limit 条消息，会话不存在时返回空列表"""
+        with self._lock:
+            return self._load(session_id, limit)
+
+    def append(self, session_id: str, messages: List[Dict[str, str]]):
+        with self._lock:
+            self._append(session_id, messages)
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._delete(session_id)
+
+    def close(self):
+        pass
+
+    def _load(self, session_id: str, limit: Optional[int]) -> List[Dict[str, str]]:
+        raise NotImplementedError
+
+    def _append(self, session_id: str, messages: List[Dict[str, str]]):
+        raise NotImplementedError
+
+    def _delete(self, session_id: str):
+        raise NotImplementedError
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    进程内存储，超过 max_sessions 时淘汰最久未访问的会话
+    """
+
+    def __init__(self, max_sessions: int = 10000, max_messages: int = 200):
+        """
+        参数:
+        - max_sessions (int): 最多保留的会话数。
+        - max_messages (int): 每个会话最多保留的消息数，更早的消息会被丢弃。
+        """
+        super().__init__()
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self._sessions: "OrderedDict[str, List[Dict[str, str]]]" = OrderedDict()
+
+    def _load(self, session_id, limit):
+        messages = self._sessions.get(session_id)
+        if messages is None:
+            return []
+        self._sessions.move_to_end(session_id)
+        return list(messages[-limit:] if limit else messages)
+
+    def _append(self, session_id, messages):
+        history = self._sessions.setdefault(session_id, [])
+        history.extend(messages)
+        # 不能写成 del history[:-max_messages]：max_messages 为 0 时切片为空，什么都不会删除
+        del history[:len(history) - self.max_messages]
+        self._sessions.move_to_end(session_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    def _delete(self, session_id):
+        self._sessions.pop(session_id, None)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    基于 SQLite 的持久化存储，进程重启后会话依然可用
+    """
+
+    def __init__(self, path: str = ".sessions.sqlite3", max_messages: int = 200):
+        """
+        参数:
+        - path (str): 数据库文件路径。
+        - max_messages (int): 每个会话最多保留的消息数，更早的消息会被删除。
+        """
+        super().__init__()
+        self.path = Path(path)
+        self.max_messages = max_messages
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_session ON messages (session_id, id)")
+        self._conn.commit()
+
+    def _load(self, session_id, limit):
+        # 先按 id 倒序取最近的 limit 条，再恢复成时间顺序
+        rows = self._conn.execute(
+            "SELECT role, content FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+            (session_id, limit or -1),
+        ).fetchall()
+        return [{"role": role, "content": content} for role, content in reversed(rows)]
+
+    def _append(self, session_id, messages):
+        now = time.time()
+        self._conn.executemany(
+            "INSERT INTO messages (session_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+            [(session_id, m["role"], m["content"], now) for m in messages],
+        )
+        # 删除该会话中比最近 max_messages 条更早的消息
+        self._conn.execute(
+            """
+            DELETE FROM messages WHERE session_id = ? AND id <= (
+                SELECT id FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?
+            )
+            """,
+            (session_id, session_id, self.max_messages),
+        )
+        self._conn.commit()
+
+    def _delete(self, session_id):
+        self._conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RedisSessionStore(SessionStore):
+    """
+    基于 Redis 列表的存储，可在多个服务进程之间共享会话
+    只用到 RPUSH / LRANGE / LTRIM / EXPIRE / DELETE，兼容 Redis 协议的服务 (如 KeyDB、Valkey) 均可使用
+    """
+
+    def __init__(self, client=None, url: str = "redis://localhost:6379/0", prefix: str = "session:",
+                 ttl: Optional[int] = 7 * 24 * 3600, max_messages: int = 200):
+        """
+        参数:
+        - client: 已创建的 redis 客户端，为空时根据 url 创建 (需要安装 redis 包)。
+        - prefix (str): 键名前缀。
+        - ttl (int): 会话在最后一次写入后的过期时间 (秒)，None 表示不过期。
+        - max_messages (int): 每个会话最多保留的消息数。
+        """
+        super().__init__()
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImportError("使用 RedisSessionStore 需要先安装 redis: pip install redis")
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.max_messages = max_messages
+
+    # Redis 客户端自身是线程安全的，不需要基类的锁
+    def load(self, session_id, limit=None):
+        return self._load(session_id, limit)
+
+    def append(self, session_id, messages):
+        self._append(session_id, messages)
+
+    def delete(self, session_id):
+        self._delete(session_id)
+
+    def _load(self, session_id, limit):
+        items = self.client.lrange(self.prefix + session_id, -limit if limit else 0, -1)
+        return [json.loads(item) for item in items]
+
+    def _append(self, session_id, messages):
+        key = self.prefix + session_id
+        pipe = self.client.pipeline()
+        pipe.rpush(key, *[json.dumps(m, ensure_ascii=False) for m in messages])
+        if self.max_messages:
+            pipe.ltrim(key, -self.max_messages, -1)
+        else:
+            # LTRIM key -0 -1 会保留整个列表
+            pipe.delete(key)
+        if self.ttl:
+            pipe.expire(key, self.ttl)
+        pipe.execute()
+
+    def _delete(self, session_id):
+        self.client.delete(self.prefix + session_id)
+
+    def close(self):
+        self.client.close()
+
+
+class AgentPool:
+    """
+    多会话共享同一个 Agent 的服务方式
+    - LLM 客户端、工具注册表、工具线程池与渲染好的系统提示词只创建一次，所有会话复用；
+    - 每个请求按 session_id 从存储中读取最近的历史 (受消息条数与 token 预算限制)，调用无状态的 respond()，
+      再把新的一轮对话写回存储，Agent 实例上不保存任何会话状态；
+    - 会话锁只在读取与写回历史时持有，不跨越 LLM 调用，慢请求不会阻塞映射到同一把锁上的其他会话。
+    """
+
+    def __init__(self, agent: MySimpleAgent, store: SessionStore = None, max_history_messages: int = 20,
+                 max_history_tokens: int = 2000, num_lock_stripes: int = 256):
+        """
+        参数:
+        - agent (MySimpleAgent): 被所有会话共享的 Agent。
+        - store (SessionStore): 会话存储，默认使用进程内 LRU 存储。
+        - max_history_messages (int): 每次最多读取的历史消息数。
+        - max_history_tokens (int): 历史消息的 token 预算，从最新的消息开始保留。
+        - num_lock_stripes (int): 会话锁的分段数。会话锁按 session_id 哈希到固定数量的锁上，内存占用不随会话数增长。
+        """
+        self.agent = agent
+        self.store = store or InMemorySessionStore()
+        self.max_history_messages = max_history_messages
+        self.max_history_tokens = max_history_tokens
+        self._locks = [threading.Lock() for _ in range(num_lock_stripes)]
+
+    def _session_lock(self, session_id: str) -> threading.Lock:
+        return self._locks[hash(session_id) % len(self._locks)]
+
+    def _build_messages(self, session_id: str, input_text: str, system_prompt: Optional[str]) -> List[Dict[str, str]]:
+        history = self.store.load(session_id, limit=self.max_history_messages)
+
+        # 以 (用户, 助手) 一轮为单位从最新的开始向前保留，直到用完 token 预算，
+        # 这样历史不会以缺少提问的孤立回答开头；按条数截取后开头多出的单条消息也会被丢弃
+        rounds, total, end = [], 0, len(history)
+        while end >= 2 and history[end - 2]["role"] == "user":
+            pair = history[end - 2:end]
+            total += sum(count_tokens(message["content"]) for message in pair)
+            if rounds and total > self.max_history_tokens:
+                break
+            rounds.append(pair)
+            end -= 2
+
+        messages = [{"role": "system", "content": system_prompt}] if system_prompt else []
+        messages += [message for pair in reversed(rounds) for message in pair]
+        return messages + [{"role": "user", "content": input_text}]
+
+    def run(self, session_id: str, input_text: str, **kwargs) -> str:
+        with self._session_lock(session_id):
+            messages = self._build_messages(session_id, input_text, self.agent._get_enhanced_system_prompt())
+        response = self.agent.respond(messages, **kwargs)
+        with self._session_lock(session_id):
+            self.store.append(session_id, [
+                {"role": "user", "content": input_text},
+                {"role": "assistant", "content": response},
+            ])
+        return response
+
+    def stream_run(self, session_id: str, input_text: str, **kwargs) -> Iterator[str]:
+        agent = self.agent
+        system_prompt = agent._get_enhanced_system_prompt() if agent.enable_tool_calling else agent.system_prompt
+        # 锁只用于读取与写回历史，不能跨越 yield 持有：调用方可能读一半就停下或不再迭代，
+        # 那样会阻塞本会话以及映射到同一把锁上的其他会话
+        with self._session_lock(session_id):
+            messages = self._build_messages(session_id, input_text, system_prompt)
+        # 与 run() 一致，只把最后一轮的回答写入历史，不包含工具调用之前的过渡文本
+        response = yield from agent.stream_respond(messages, **kwargs)
+        # 只有完整生成的回答才写入历史
+        with self._session_lock(session_id):
+            self.store.append(session_id, [
+                {"role": "user", "content": input_text},
+                {"role": "assistant", "content": response},
+            ])
+
+    def reset(self, session_id: str):
+        """清空一个会话的历史记录"""
+        self.store.delete(session_id)
+
+    def close(self):
+        self.agent.close()
+        self.store.close()
+
+
+if __name__ == '__main__':
+    from concurrent.futures import ThreadPoolExecutor
+    from dotenv import load_dotenv
+    from hello_agents import HelloAgentsLLM
+
+    load_dotenv()
+    agent = MySimpleAgent(name="共享助手", llm=HelloAgentsLLM(), system_prompt="你是一个友好的AI助手，请用简洁明了的方式回答问题。")
+    pool = AgentPool(agent, store=SQLiteSessionStore())
+
+    # 不同用户的会话并发处理，共享同一个 Agent
+    def chat(user: str) -> str:
+        pool.run(user, f"你好，我叫{user}")
+        return pool.run(user, "我叫什么名字？")
+
+    users = ["小明", "小红", "小刚"]
+    with ThreadPoolExecutor(max_workers=len(users)) as executor:
+        for user, answer in zip(users, executor.map(chat, users)):
+            print(f"[{user}] {answer}")
+
+    pool.close()
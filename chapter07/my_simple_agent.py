@@ -1,8 +1,109 @@
 # my_simple_agent.py
-from typing import Optional, Iterator
+from typing import Optional, Iterator, List, Tuple, Any
+from concurrent.futures import ThreadPoolExecutor, Future, CancelledError, TimeoutError as FutureTimeoutError
+import json
+import time
 from hello_agents import SimpleAgent, HelloAgentsLLM, Config, Message
+from my_llm import ToolsNotSupportedError
+from my_memory import ConversationMemory
 import re
 
+TOOL_CALL_PREFIX = "[TOOL_CALL:"
+TOOL_CALL_PATTERN = re.compile(r'\[TOOL_CALL:([^:]+):([^\]]+)\]')
+
+# 工具参数类型 -> JSON Schema 类型
+JSON_SCHEMA_TYPES = {
+    "string": "string", "str": "string",
+    "integer": "integer", "int": "integer",
+    "number": "number", "float": "number",
+    "boolean": "boolean", "bool": "boolean",
+    "array": "array", "list": "array",
+    "object": "object", "dict": "object",
+}
+
+
+def _drain(stream: Iterator) -> Any:
+    """消费完生成器，返回它的返回值"""
+    while True:
+        try:
+            next(stream)
+        except StopIteration as stop:
+            return stop.value
+
+
+class ToolCallStreamParser:
+    """
+    增量识别流式输出中的 [TOOL_CALL:name:params] 标记
+    - 普通文本立即作为 ("text", str) 事件返回，可以马上展示给用户；
+    - 可能是标记开头的 "[" 会暂存，直到确认它是 (或不是) 工具调用；
+    - 标记一闭合就返回 ("tool_call", call) 事件，调用方可以立即开始执行工具。
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self.text_parts = []
+        self.tool_calls = []
+
+    @property
+    def text(self) -> str:
+        """本轮输出中去掉工具调用标记后的文本"""
+        return "".join(self.text_parts)
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        self._buffer += chunk
+        events = []
+        while self._buffer:
+            start = self._buffer.find("[")
+            if start < 0:
+                self._emit_text(events, self._buffer)
+                self._buffer = ""
+                break
+            if start > 0:
+                self._emit_text(events, self._buffer[:start])
+                self._buffer = self._buffer[start:]
+                continue
+
+            # 缓冲区以 "[" 开头：不可能是标记时立即输出，可能是标记时等待更多内容
+            head = self._buffer[:len(TOOL_CALL_PREFIX)]
+            if not TOOL_CALL_PREFIX.startswith(head):
+                self._emit_text(events, "[")
+                self._buffer = self._buffer[1:]
+                continue
+            end = self._buffer.find("]")
+            if len(head) < len(TOOL_CALL_PREFIX) or end < 0:
+                break
+
+            marker = self._buffer[:end + 1]
+            self._buffer = self._buffer[end + 1:]
+            match = TOOL_CALL_PATTERN.fullmatch(marker)
+            if match:
+                call = {
+                    'tool_name': match.group(1).strip(),
+                    'parameters': match.group(2).strip(),
+                    'original': marker,
+                }
+                self.tool_calls.append(call)
+                events.append(("tool_call", call))
+            else:
+                self._emit_text(events, marker)
+        return events
+
+    def finish(self) -> List[Tuple[str, Any]]:
+        """流结束时，未闭合的标记按普通文本输出"""
+        events = []
+        if self._buffer:
+            self._emit_text(events, self._buffer)
+            self._buffer = ""
+        return events
+
+    def _emit_text(self, events: list, text: str):
+        self.text_parts.append(text)
+        if events and events[-1][0] == "text":
+            events[-1] = ("text", events[-1][1] + text)
+        else:
+            events.append(("text", text))
+
+
 class MySimpleAgent(SimpleAgent):
     """
     重写的简单对话Agent
@@ -16,11 +117,33 @@ class MySimpleAgent(SimpleAgent):
         system_prompt: Optional[str] = None,
         config: Optional[Config] = None,
         tool_registry: Optional['ToolRegistry'] = None,
-        enable_tool_calling: bool = True
+        enable_tool_calling: bool = True,
+        max_tool_workers: int = 4,
+        tool_timeout: float = 30,
+        memory: Optional[ConversationMemory] = None,
+        tool_mode: str = "auto"
     ):
+        """
+        参数:
+        - tool_mode (str): 工具调用协议。"native": 以 OpenAI tools= JSON Schema 发送工具并解析 tool_calls；
+          "text": 在系统提示词中描述工具并解析 [TOOL_CALL:...] 标记；"auto": 优先 native，服务不支持时自动退回 text。
+          native 需要 llm 提供 stream_chat(messages, tools=...) (见 my_llm.MyLLM)，否则使用 text。
+        - max_tool_workers (int): 同时执行的工具调用数上限。
+        - tool_timeout (float): 单个工具调用的超时时间 (秒)。
+        - memory (ConversationMemory): 按 token 预算管理上下文的记忆；为空时每轮发送完整的历史记录。
+        """
         super().__init__(name, llm, system_prompt, config)
         self.tool_registry = tool_registry
         self.enable_tool_calling = enable_tool_calling and tool_registry is not None
+        self.max_tool_workers = max_tool_workers
+        self.tool_timeout = tool_timeout
+        self._tool_pool: Optional[ThreadPoolExecutor] = None
+        self.memory = memory
+        assert tool_mode in ("auto", "native", "text"), f"未知的 tool_mode: {tool_mode}"
+        self.tool_mode = tool_mode
+        self._native_tools_supported: Optional[bool] = None # None 表示尚未确认
+        self._system_prompt_cache = None
+        self._tool_schemas_cache = None
         print(f"✅ {name} 初始化完成，工具调用: {'启用' if self.enable_tool_calling else '禁用'}")
     
     def run(self, input_text: str, max_tool_iterations: int = 3, **kwargs) -> str:
@@ -29,12 +152,70 @@ class MySimpleAgent(SimpleAgent):
         """
         print(f"🤖 {self.name} 正在处理: {input_text}")
 
-        # 构建消息列表
-        messages = []
+        # 构建消息列表（系统消息可能包含工具信息）
+        messages = self._build_messages(input_text, self._get_enhanced_system_prompt())
+        response = self.respond(messages, max_tool_iterations, **kwargs)
 
-        # 添加系统消息（可能包含工具信息）
-        enhanced_system_prompt = self._get_enhanced_system_prompt()
-        messages.append({"role": "system", "content": enhanced_system_prompt})
+        # 保存到历史记录
+        self._remember(input_text, response)
+        print(f"✅ {self.name} 响应完成")
+        return response
+
+    def respond(self, messages: list, max_tool_iterations: int = 3, **kwargs) -> str:
+        """
+        无状态的核心逻辑：根据给定的消息列表生成回答，不读写实例上的历史记录
+        多个会话可以共享同一个 Agent 并发调用 (见 my_session.AgentPool)
+        """
+        # 如果没有启用工具调用，使用简单对话逻辑
+        if not self.enable_tool_calling:
+            return self.llm.invoke(messages, **kwargs)
+
+        if self._use_native_tools():
+            # 原生函数调用内部始终使用流式接口，这样工具调用一完整就能开始执行
+            try:
+                # 与文本协议一致，只返回最后一轮的回答，不包含工具调用之前的过渡文本
+                return _drain(self._stream_native(messages, max_tool_iterations, **kwargs))
+            except ToolsNotSupportedError as e:
+                messages = self._fallback_to_text_tools(messages, e)
+
+        # 支持多轮工具调用的逻辑
+        return self._run_with_tools(list(messages), max_tool_iterations, **kwargs)
+
+    def _use_native_tools(self) -> bool:
+        return (self.enable_tool_calling and self.tool_mode != "text"
+                and self._native_tools_supported is not False and callable(getattr(self.llm, "stream_chat", None)))
+
+    def _fallback_to_text_tools(self, messages: list, error: Exception) -> list:
+        """
+        服务不支持原生函数调用：以后都改用文本标记协议，并把系统提示词换成包含工具调用格式说明的版本
+        """
+        # 之前已经成功使用过原生函数调用，说明不是服务不支持，不做降级
+        if self._native_tools_supported:
+            raise error
+        if self.tool_mode == "native":
+            raise RuntimeError(f"模型服务不支持原生函数调用: {error}")
+        print(f"⚠️ 模型服务不支持原生函数调用，改用 [TOOL_CALL:...] 文本协议: {error}")
+        native_prompt = self._get_enhanced_system_prompt()
+        self._native_tools_supported = False
+        messages = list(messages)
+        if messages and messages[0]["role"] == "system":
+            # 系统消息之后可能还附有记忆中的摘要等内容，只替换开头的提示词部分
+            content = messages[0]["content"]
+            if content.startswith(native_prompt):
+                content = content[len(native_prompt):]
+            messages[0] = {"role": "system", "content": self._get_enhanced_system_prompt() + content}
+        return messages
+
+    def _build_messages(self, input_text: str, system_prompt: Optional[str]) -> list:
+        """
+        构建本轮的消息列表：配置了 memory 时由它按 token 预算组装，否则附上完整的历史记录
+        """
+        if self.memory is not None:
+            return self.memory.build_messages(system_prompt, input_text)
+
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
 
         # 添加历史消息
         for msg in self._history:
@@ -42,23 +223,30 @@ class MySimpleAgent(SimpleAgent):
 
         # 添加当前用户消息
         messages.append({"role": "user", "content": input_text})
+        return messages
 
-        # 如果没有启用工具调用，使用简单对话逻辑
-        if not self.enable_tool_calling:
-            response = self.llm.invoke(messages, **kwargs)
-            self.add_message(Message(input_text, "user"))
-            self.add_message(Message(response, "assistant"))
-            print(f"✅ {self.name} 响应完成")
-            return response
-
-        # 支持多轮工具调用的逻辑
-        return self._run_with_tools(messages, input_text, max_tool_iterations, **kwargs)
+    def _remember(self, input_text: str, response: str) -> None:
+        """保存一轮对话到历史记录与记忆"""
+        self.add_message(Message(input_text, "user"))
+        self.add_message(Message(response, "assistant"))
+        if self.memory is not None:
+            self.memory.add_turn(input_text, response)
 
     def _get_enhanced_system_prompt(self) -> str:
-        """构建增强的系统提示词，包含工具信息"""
+        """构建增强的系统提示词，包含工具信息；工具列表不变时直接复用上次的结果"""
+        cache_key = (self.system_prompt, self.enable_tool_calling, self._use_native_tools(),
+                     tuple(self.tool_registry.list_tools()) if self.tool_registry else ())
+        if self._system_prompt_cache is not None and self._system_prompt_cache[0] == cache_key:
+            return self._system_prompt_cache[1]
+        prompt = self._render_system_prompt()
+        self._system_prompt_cache = (cache_key, prompt)
+        return prompt
+
+    def _render_system_prompt(self) -> str:
         base_prompt = self.system_prompt or "你是一个有用的AI助手。"
 
-        if not self.enable_tool_calling or not self.tool_registry:
+        # 原生函数调用时工具以 JSON Schema 的形式单独发送，提示词中不再需要工具说明
+        if not self.enable_tool_calling or not self.tool_registry or self._use_native_tools():
             return base_prompt
 
         # 获取工具描述
@@ -78,7 +266,7 @@ class MySimpleAgent(SimpleAgent):
 
         return base_prompt + tools_section
     
-    def _run_with_tools(self, messages: list, input_text: str, max_tool_iterations: int, **kwargs) -> str:
+    def _run_with_tools(self, messages: list, max_tool_iterations: int, **kwargs) -> str:
         """支持工具调用的运行逻辑"""
         current_iteration = 0
         final_response = ""
@@ -87,27 +275,19 @@ class MySimpleAgent(SimpleAgent):
             # 调用LLM
             response = self.llm.invoke(messages, **kwargs)
 
-            # 检查是否有工具调用
-            tool_calls = self._parse_tool_calls(response)
+            # 检查是否有工具调用，同时一次性移除工具调用标记
+            clean_response, tool_calls = self._split_tool_calls(response)
 
             if tool_calls:
-                print(f"🔧 检测到 {len(tool_calls)} 个工具调用")
-                # 执行所有工具调用并收集结果
-                tool_results = []
-                clean_response = response
-
-                for call in tool_calls:
-                    result = self._execute_tool_call(call['tool_name'], call['parameters'])
-                    tool_results.append(result)
-                    # 从响应中移除工具调用标记
-                    clean_response = clean_response.replace(call['original'], "")
+                print(f"🔧 检测到 {len(tool_calls)} 个工具调用，并发执行")
+                # 并发执行所有工具调用，结果按标记出现的顺序排列
+                tool_results = self._execute_tool_calls(tool_calls)
 
                 # 构建包含工具结果的消息
                 messages.append({"role": "assistant", "content": clean_response})
 
                 # 添加工具结果
-                tool_results_text = "\n\n".join(tool_results)
-                messages.append({"role": "user", "content": f"工具执行结果：\n{tool_results_text}\n\n请基于这些结果给出完整的回答。"})
+                messages.append(self._tool_results_message(tool_results))
 
                 current_iteration += 1
                 continue
@@ -120,27 +300,207 @@ class MySimpleAgent(SimpleAgent):
         if current_iteration >= max_tool_iterations and not final_response:
             final_response = self.llm.invoke(messages, **kwargs)
 
-        # 保存到历史记录
-        self.add_message(Message(input_text, "user"))
-        self.add_message(Message(final_response, "assistant"))
-        print(f"✅ {self.name} 响应完成")
-
         return final_response
 
-    def _parse_tool_calls(self, text: str) -> list:
-        """解析文本中的工具调用"""
-        pattern = r'\[TOOL_CALL:([^:]+):([^\]]+)\]'
-        matches = re.findall(pattern, text)
+    def _get_tool_schemas(self) -> list:
+        """把 ToolRegistry 中的工具转换为 OpenAI tools= 格式的 JSON Schema，工具列表不变时复用"""
+        tool_names = tuple(self.tool_registry.list_tools())
+        if self._tool_schemas_cache is not None and self._tool_schemas_cache[0] == tool_names:
+            return self._tool_schemas_cache[1]
+
+        functions = getattr(self.tool_registry, "_functions", {})
+        schemas = []
+        for name in tool_names:
+            tool = self.tool_registry.get_tool(name)
+            properties, required = {}, []
+            if tool is not None and hasattr(tool, "get_parameters"):
+                description = tool.description
+                for param in tool.get_parameters():
+                    properties[param.name] = {
+                        "type": JSON_SCHEMA_TYPES.get(str(param.type).lower(), "string"),
+                        "description": param.description,
+                    }
+                    if param.required:
+                        required.append(param.name)
+            else:
+                # 以函数形式注册的工具只接收一个字符串输入
+                description = functions.get(name, {}).get("description", "")
+                properties["input"] = {"type": "string", "description": "工具的输入"}
+                required.append("input")
+
+            schemas.append({
+                "type": "function",
+                "function": {
+                    "name": name,
+                    "description": description,
+                    "parameters": {"type": "object", "properties": properties, "required": required},
+                },
+            })
+
+        self._tool_schemas_cache = (tool_names, schemas)
+        return schemas
+
+    def _stream_native(self, messages: list, max_tool_iterations: int, **kwargs) -> Iterator[str]:
+        """
+        原生函数调用：以 tools= 发送工具的 JSON Schema，从流中累积 tool_calls 增量
+        某个工具调用之后出现了下一个调用 (index 增加) 时，说明它的参数已经完整，立即提交执行；
+        本轮结束后以 role=tool 的消息返回结果，继续下一轮
+        逐块返回文本；生成器的返回值是最后一轮的回答，不包含工具调用之前的过渡文本
+        """
+        messages = list(messages)
+        for iteration in range(max_tool_iterations + 1):
+            # 达到最大工具调用轮数后，最后一轮不再提供工具，要求模型直接回答
+            tools = self._get_tool_schemas() if iteration < max_tool_iterations else None
+            deltas = self.llm.stream_chat(messages, tools=tools, **kwargs)
+            if tools:
+                self._native_tools_supported = True
+
+            calls = {} # index -> {"id", "name", "arguments"}
+            submitted = {} # index -> (call, future)
+            text_parts = []
+            try:
+                for delta in deltas:
+                    if delta.content:
+                        text_parts.append(delta.content)
+                        yield delta.content
+                    for tool_call in delta.tool_calls or []:
+                        if tool_call.index not in calls:
+                            if tools:
+                                self._submit_native_calls(calls, submitted, below=tool_call.index)
+                            calls[tool_call.index] = {"id": tool_call.id or f"call_{tool_call.index}", "name": "", "arguments": ""}
+                        entry = calls[tool_call.index]
+                        if tool_call.id:
+                            entry["id"] = tool_call.id
+                        if tool_call.function is not None:
+                            entry["name"] += tool_call.function.name or ""
+                            entry["arguments"] += tool_call.function.arguments or ""
+                if tools:
+                    self._submit_native_calls(calls, submitted)
+            except GeneratorExit:
+                self.cancel_pending_tools(list(submitted.values()))
+                raise
+            finally:
+                deltas.close()
+
+            if not calls:
+                return "".join(text_parts)
+            if not tools:
+                # 最后一轮没有提供工具，模型仍然返回了 tool_calls：不再执行，明确告知没有得到最终回答
+                print(f"⚠️ 已达到最大工具调用轮数，忽略模型请求的 {len(calls)} 个工具调用")
+                if not text_parts:
+                    notice = f"⚠️ 已达到最大工具调用轮数 ({max_tool_iterations})，模型仍在请求调用工具，未能给出最终回答。"
+                    text_parts.append(notice)
+                    yield notice
+                return "".join(text_parts)
+
+            ordered = [submitted[index] for index in sorted(submitted)]
+            results = self._collect_tool_results(ordered)
+            messages.append({
+                "role": "assistant",
+                "content": "".join(text_parts) or None,
+                "tool_calls": [
+                    {"id": call["id"], "type": "function", "function": {"name": call["tool_name"], "arguments": call["arguments"]}}
+                    for call, _ in ordered
+                ],
+            })
+            for (call, _), result in zip(ordered, results):
+                messages.append({"role": "tool", "tool_call_id": call["id"], "content": result})
+
+    def _submit_native_calls(self, calls: dict, submitted: dict, below: int = None):
+        """提交参数已经完整、但尚未开始执行的工具调用"""
+        for index, entry in calls.items():
+            if index in submitted or (below is not None and index >= below):
+                continue
+            call = {"tool_name": entry["name"], "arguments": entry["arguments"], "id": entry["id"]}
+            print(f"\n🔧 检测到工具调用 {call['tool_name']}({call['arguments']})，立即开始执行")
+            submitted[index] = (call, self._get_tool_pool().submit(self._execute_native_call, call["tool_name"], call["arguments"]))
+
+    def _execute_native_call(self, tool_name: str, arguments: str) -> str:
+        """执行原生函数调用，参数是模型生成的 JSON 字符串，不需要再做文本解析"""
+        if not self.tool_registry:
+            return f"❌ 错误：未配置工具注册表"
+
+        try:
+            params = json.loads(arguments) if arguments.strip() else {}
+        except json.JSONDecodeError as e:
+            return f"❌ 工具 {tool_name} 的参数不是合法的 JSON：{e}"
+
+        try:
+            tool = self.tool_registry.get_tool(tool_name)
+            if tool is not None:
+                result = tool.run(params)
+            else:
+                # 以函数形式注册的工具
+                result = self.tool_registry.execute_tool(tool_name, params.get("input", ""))
+            return f"🔧 工具 {tool_name} 执行结果：\n{result}"
+
+        except Exception as e:
+            return f"❌ 工具调用失败：{str(e)}"
+
+    def _tool_results_message(self, tool_results: list) -> dict:
+        """把工具执行结果包装成下一轮的用户消息"""
+        tool_results_text = "\n\n".join(tool_results)
+        return {"role": "user", "content": f"工具执行结果：\n{tool_results_text}\n\n请基于这些结果给出完整的回答。"}
+
+    def _get_tool_pool(self) -> ThreadPoolExecutor:
+        """工具执行线程池，首次使用时创建"""
+        if self._tool_pool is None:
+            self._tool_pool = ThreadPoolExecutor(max_workers=self.max_tool_workers, thread_name_prefix=f"{self.name}-tool")
+        return self._tool_pool
+
+    def _submit_tool_call(self, call: dict) -> Future:
+        """提交一个工具调用到线程池，立即返回 Future"""
+        return self._get_tool_pool().submit(self._execute_tool_call, call['tool_name'], call['parameters'])
 
+    def _collect_tool_results(self, submitted: List[Tuple[dict, Future]], timeout: float = None) -> List[str]:
+        """
+        按提交顺序收集工具结果。所有调用共享同一个截止时间，总等待时间约为最慢的那个工具的耗时。
+        超时的调用会被取消：尚未开始的直接取消，已经在运行的线程无法强制终止，其结果会被丢弃。
+        已被取消的调用 (例如 close() 关闭了线程池) 返回一条取消说明，不会中断其他结果的收集。
+        """
+        timeout = timeout or self.tool_timeout
+        deadline = time.monotonic() + timeout
+        results = []
+        for call, future in submitted:
+            try:
+                results.append(future.result(timeout=max(0.0, deadline - time.monotonic())))
+            except FutureTimeoutError:
+                future.cancel()
+                print(f"⏱️ 工具 {call['tool_name']} 执行超时，已取消")
+                results.append(f"❌ 工具 {call['tool_name']} 执行超时 (超过 {timeout} 秒)，已取消")
+            except CancelledError:
+                print(f"⏹️ 工具 {call['tool_name']} 已被取消")
+                results.append(f"❌ 工具 {call['tool_name']} 已被取消，未能执行")
+        return results
+
+    def _execute_tool_calls(self, tool_calls: list, timeout: float = None) -> List[str]:
+        """并发执行多个工具调用，结果与 tool_calls 的顺序一一对应"""
+        return self._collect_tool_results([(call, self._submit_tool_call(call)) for call in tool_calls], timeout)
+
+    def cancel_pending_tools(self, submitted: List[Tuple[dict, Future]]):
+        """取消尚未开始执行的工具调用，例如流式输出被调用方提前中止时"""
+        for _, future in submitted:
+            future.cancel()
+
+    def _split_tool_calls(self, text: str) -> Tuple[str, list]:
+        """
+        一次扫描同时完成两件事：解析所有工具调用，并返回去掉标记后的文本
+        """
         tool_calls = []
-        for tool_name, parameters in matches:
+
+        def _collect(match):
             tool_calls.append({
-                'tool_name': tool_name.strip(),
-                'parameters': parameters.strip(),
-                'original': f'[TOOL_CALL:{tool_name}:{parameters}]'
+                'tool_name': match.group(1).strip(),
+                'parameters': match.group(2).strip(),
+                'original': match.group(0),
             })
+            return ""
+
+        return TOOL_CALL_PATTERN.sub(_collect, text), tool_calls
 
-        return tool_calls
+    def _parse_tool_calls(self, text: str) -> list:
+        """解析文本中的工具调用"""
+        return self._split_tool_calls(text)[1]
 
     def _execute_tool_call(self, tool_name: str, parameters: str) -> str:
         """执行工具调用"""
@@ -193,37 +553,85 @@ class MySimpleAgent(SimpleAgent):
 
         return param_dict
     
-    def stream_run(self, input_text: str, **kwargs) -> Iterator[str]:
+    def stream_run(self, input_text: str, max_tool_iterations: int = 3, **kwargs) -> Iterator[str]:
         """
-        自定义的流式运行方法
+        自定义的流式运行方法，支持工具调用
         """
         print(f"🌊 {self.name} 开始流式处理: {input_text}")
 
-        messages = []
-
-        if self.system_prompt:
-            messages.append({"role": "system", "content": self.system_prompt})
-
-        for msg in self._history:
-            messages.append({"role": msg.role, "content": msg.content})
-
-        messages.append({"role": "user", "content": input_text})
+        system_prompt = self._get_enhanced_system_prompt() if self.enable_tool_calling else self.system_prompt
+        messages = self._build_messages(input_text, system_prompt)
 
-        # 流式调用LLM
-        full_response = ""
+        # 流式调用LLM；与 run() 一致，历史记录中只保存最后一轮的回答
         print("📝 实时响应: ", end="")
-        for chunk in self.llm.stream_invoke(messages, **kwargs):
-            full_response += chunk
-            print(chunk, end="", flush=True)
-            yield chunk
+        stream = self.stream_respond(messages, max_tool_iterations, **kwargs)
+        try:
+            while True:
+                try:
+                    chunk = next(stream)
+                except StopIteration as stop:
+                    response = stop.value
+                    break
+                print(chunk, end="", flush=True)
+                yield chunk
+        finally:
+            stream.close()
 
         print()  # 换行
 
         # 保存完整对话到历史记录
-        self.add_message(Message(input_text, "user"))
-        self.add_message(Message(full_response, "assistant"))
+        self._remember(input_text, response)
         print(f"✅ {self.name} 流式响应完成")
 
+    def stream_respond(self, messages: list, max_tool_iterations: int = 3, **kwargs) -> Iterator[str]:
+        """
+        respond() 的流式版本，同样不读写实例上的历史记录
+        用户可见的文本逐块返回；工具调用标记一闭合就提交到线程池执行，不必等待整段回答结束，
+        本轮流结束后把工具结果注入对话，继续流式生成下一轮回答
+        生成器的返回值是最后一轮的回答 (与 respond() 的返回值相同)，可以用 yield from 取得
+        """
+        if self._use_native_tools():
+            try:
+                return (yield from self._stream_native(messages, max_tool_iterations, **kwargs))
+            except ToolsNotSupportedError as e:
+                messages = self._fallback_to_text_tools(messages, e)
+
+        messages = list(messages)
+        final_parts = []
+        for iteration in range(max_tool_iterations + 1):
+            # 达到最大工具调用轮数后，最后一轮不再解析工具调用
+            parser = ToolCallStreamParser() if self.enable_tool_calling and iteration < max_tool_iterations else None
+            pending = []
+            final_parts = []
+
+            try:
+                for chunk in self.llm.stream_invoke(messages, **kwargs):
+                    events = parser.feed(chunk) if parser else [("text", chunk)]
+                    for kind, value in events:
+                        if kind == "tool_call":
+                            print(f"\n🔧 检测到工具调用 {value['original']}，立即开始执行")
+                            pending.append((value, self._submit_tool_call(value)))
+                            continue
+                        final_parts.append(value)
+                        yield value
+
+                if parser:
+                    for _, value in parser.finish():
+                        final_parts.append(value)
+                        yield value
+            except GeneratorExit:
+                # 调用方提前停止迭代，尚未开始的工具调用不再执行
+                self.cancel_pending_tools(pending)
+                raise
+
+            if not pending:
+                break
+
+            # 工具在流式输出期间已经开始执行，这里只需等待结果
+            messages.append({"role": "assistant", "content": parser.text})
+            messages.append(self._tool_results_message(self._collect_tool_results(pending)))
+        return "".join(final_parts)
+
     def add_tool(self, tool) -> None:
         """添加工具到Agent（便利方法）"""
         if not self.tool_registry:
@@ -245,6 +653,23 @@ class MySimpleAgent(SimpleAgent):
             return True
         return False
     
+    def clear_history(self) -> None:
+        """清空历史记录，配置了 memory 时一并清空其中的窗口、摘要与召回记录"""
+        super().clear_history()
+        if self.memory is not None:
+            self.memory.clear()
+
+    def close(self) -> None:
+        """
+        关闭工具线程池，未开始执行的工具调用会被取消；
+        memory 只会等待后台摘要完成，之后仍可继续使用 (例如交给另一个 Agent)
+        """
+        if self._tool_pool is not None:
+            self._tool_pool.shutdown(wait=False, cancel_futures=True)
+            self._tool_pool = None
+        if self.memory is not None:
+            self.memory.close()
+
     def list_tools(self) -> list:
         """列出所有可用工具"""
         if self.tool_registry:
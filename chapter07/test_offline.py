@@ -0,0 +1,251 @@
+# test_offline.py
+# 不调用真实模型服务，用假的 LLM 验证流式工具调用、并发工具收集、会话存储与 AgentPool 的逻辑
+import threading
+import time
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+from my_llm import ToolsNotSupportedError
+from my_session import AgentPool, InMemorySessionStore, SQLiteSessionStore
+from my_simple_agent import MySimpleAgent, ToolCallStreamParser
+
+
+def delta(content=None, tool_calls=None):
+    return SimpleNamespace(content=content, tool_calls=tool_calls)
+
+
+def tool_call_delta(index, name="", arguments="", call_id=None):
+    return SimpleNamespace(index=index, id=call_id, function=SimpleNamespace(name=name, arguments=arguments))
+
+
+class FakeLLM:
+    """
+    按顺序返回预设的每一轮输出：stream_invoke / invoke 使用文本块，stream_chat 使用 delta 块
+    reject_tools=True 时模拟不支持 tools= 参数的服务
+    """
+
+    def __init__(self, rounds, reject_tools=False, delay=0.0):
+        self.model = "fake"
+        self.rounds = list(rounds)
+        self.reject_tools = reject_tools
+        self.delay = delay
+        self.requests = []
+
+    def _next_round(self, messages):
+        self.requests.append(list(messages))
+        chunks = self.rounds.pop(0)
+        time.sleep(self.delay)
+        return chunks
+
+    def invoke(self, messages, **kwargs):
+        return "".join(self._next_round(messages))
+
+    def stream_invoke(self, messages, **kwargs):
+        yield from self._next_round(messages)
+
+    def stream_chat(self, messages, tools=None, **kwargs):
+        if tools and self.reject_tools:
+            raise ToolsNotSupportedError("tools is not supported")
+        return (chunk for chunk in self._next_round(messages))
+
+
+class TextOnlyLLM(FakeLLM):
+    """没有 stream_chat 的 LLM，只能使用文本标记协议"""
+    stream_chat = None
+
+
+class EchoTool:
+    name = "echo"
+    description = "原样返回输入"
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+
+    def run(self, params):
+        time.sleep(self.delay)
+        return f"echo:{params.get('input', '')}"
+
+
+class FakeRegistry:
+    def __init__(self, *tools):
+        self.tools = {tool.name: tool for tool in tools}
+
+    def list_tools(self):
+        return list(self.tools)
+
+    def get_tool(self, name):
+        return self.tools.get(name)
+
+    def get_tools_description(self):
+        return "\n".join(f"- {tool.name}: {tool.description}" for tool in self.tools.values())
+
+    def execute_tool(self, name, tool_input):
+        return self.tools[name].run({"input": tool_input})
+
+
+def make_agent(llm, *tools, **kwargs):
+    registry = FakeRegistry(*tools) if tools else None
+    return MySimpleAgent(name="测试助手", llm=llm, tool_registry=registry, **kwargs)
+
+
+def test_stream_parser_splits_markers_across_chunks():
+    parser = ToolCallStreamParser()
+    events = []
+    for chunk in ["答案是 [注", "意] 需要 [TOOL_", "CALL:echo:", "hi] 之后", " [TOOL_CALL:未闭合"]:
+        events += parser.feed(chunk)
+    events += parser.finish()
+
+    assert [value for kind, value in events if kind == "tool_call"] == [
+        {"tool_name": "echo", "parameters": "hi", "original": "[TOOL_CALL:echo:hi]"}
+    ]
+    assert parser.text == "答案是 [注意] 需要  之后 [TOOL_CALL:未闭合"
+    # 普通的 "[" 不会被暂存到流结束
+    assert events[0] == ("text", "答案是 [注")
+
+
+def test_tool_calls_run_concurrently_in_order():
+    agent = make_agent(TextOnlyLLM([]), EchoTool(delay=0.3))
+    calls = [{"tool_name": "echo", "parameters": str(i)} for i in range(3)]
+    start = time.monotonic()
+    results = agent._execute_tool_calls(calls)
+    elapsed = time.monotonic() - start
+    agent.close()
+
+    assert [result.splitlines()[-1] for result in results] == ["echo:0", "echo:1", "echo:2"]
+    assert elapsed < 0.8, elapsed
+
+
+def test_collect_tool_results_handles_timeout_and_cancel():
+    agent = make_agent(TextOnlyLLM([]), EchoTool(delay=1.0), tool_timeout=0.1)
+    slow = agent._submit_tool_call({"tool_name": "echo", "parameters": "slow"})
+    cancelled = Future()
+    cancelled.cancel()
+    results = agent._collect_tool_results([({"tool_name": "echo"}, slow), ({"tool_name": "other"}, cancelled)])
+    agent.close()
+
+    assert "超时" in results[0]
+    assert "已被取消" in results[1]
+
+
+def test_text_protocol_streams_and_returns_final_round():
+    llm = TextOnlyLLM([["先查一下 [TOOL_CALL:echo:", "x]"], ["最终", "回答"]])
+    agent = make_agent(llm, EchoTool())
+    chunks = list(agent.stream_run("问题"))
+    agent.close()
+
+    assert chunks == ["先查一下 ", "最终", "回答"]
+    # 工具结果注入到第二轮请求中，历史记录只保存最后一轮的回答
+    assert "echo:x" in llm.requests[1][-1]["content"]
+    assert agent.get_history()[-1].content == "最终回答"
+
+
+def test_native_tools_run_and_return_final_round():
+    llm = FakeLLM([
+        [delta("思考中 "), delta(tool_calls=[tool_call_delta(0, "echo", '{"input": ', "call_1")]),
+         delta(tool_calls=[tool_call_delta(0, arguments='"a"}')])],
+        [delta("完成")],
+    ])
+    agent = make_agent(llm, EchoTool())
+    response = agent.respond([{"role": "user", "content": "问题"}])
+    agent.close()
+
+    assert response == "完成"
+    tool_message = llm.requests[1][-1]
+    assert tool_message["role"] == "tool" and tool_message["tool_call_id"] == "call_1"
+    assert "echo:a" in tool_message["content"]
+
+
+def test_native_tool_calls_on_last_round_are_not_executed():
+    calls = [delta(tool_calls=[tool_call_delta(0, "echo", "{}")])]
+    agent = make_agent(FakeLLM([calls, calls]), EchoTool())
+    response = agent.respond([{"role": "user", "content": "问题"}], max_tool_iterations=1)
+    agent.close()
+
+    assert "最大工具调用轮数" in response
+
+
+def test_native_tools_fall_back_to_text_protocol():
+    llm = FakeLLM([["[TOOL_CALL:echo:y]"], ["好的"]], reject_tools=True)
+    agent = make_agent(llm, EchoTool())
+    native_prompt = agent._get_enhanced_system_prompt()
+    assert "[TOOL_CALL:" not in native_prompt
+
+    chunks = list(agent.stream_respond([{"role": "system", "content": native_prompt}, {"role": "user", "content": "问题"}]))
+    agent.close()
+
+    assert chunks == ["好的"]
+    assert agent._native_tools_supported is False
+    # 退回文本协议后，系统提示词换成包含工具调用格式说明的版本
+    assert "[TOOL_CALL:" in llm.requests[0][0]["content"]
+
+
+def test_in_memory_store_trims_messages_and_sessions():
+    store = InMemorySessionStore(max_sessions=2, max_messages=3)
+    store.append("a", [{"role": "user", "content": str(i)} for i in range(5)])
+    assert [m["content"] for m in store.load("a")] == ["2", "3", "4"]
+    assert [m["content"] for m in store.load("a", limit=2)] == ["3", "4"]
+
+    store.append("b", [{"role": "user", "content": "b"}])
+    store.load("a")
+    store.append("c", [{"role": "user", "content": "c"}])
+    # b 最久未访问，被淘汰
+    assert store.load("b") == [] and store.load("a") != []
+
+    empty = InMemorySessionStore(max_messages=0)
+    empty.append("a", [{"role": "user", "content": "x"}])
+    assert empty.load("a") == []
+
+
+def test_sqlite_store_trims_messages():
+    store = SQLiteSessionStore(":memory:", max_messages=3)
+    store.append("a", [{"role": "user", "content": str(i)} for i in range(5)])
+    store.append("b", [{"role": "user", "content": "b"}])
+    assert [m["content"] for m in store.load("a")] == ["2", "3", "4"]
+    assert [m["content"] for m in store.load("a", limit=1)] == ["4"]
+    assert [m["content"] for m in store.load("b")] == ["b"]
+    store.delete("a")
+    assert store.load("a") == []
+    store.close()
+
+
+def test_agent_pool_history_is_trimmed_by_rounds():
+    pool = AgentPool(make_agent(TextOnlyLLM([])), max_history_messages=5, max_history_tokens=10_000)
+    pool.store.append("s", [{"role": "user" if i % 2 == 0 else "assistant", "content": str(i)} for i in range(6)])
+    messages = pool._build_messages("s", "新问题", "系统")
+
+    # 按条数截取后开头多出的单条助手消息被丢弃，历史以完整的 (用户, 助手) 轮次开始
+    assert [m["content"] for m in messages] == ["系统", "2", "3", "4", "5", "新问题"]
+
+
+def test_agent_pool_sessions_do_not_block_each_other():
+    llm = TextOnlyLLM([["慢"], ["快"]], delay=0.5)
+    # 只有一把分段锁，两个会话一定映射到同一把锁上
+    pool = AgentPool(make_agent(llm), num_lock_stripes=1)
+    slow = threading.Thread(target=pool.run, args=("slow", "问题"))
+    slow.start()
+    time.sleep(0.1)
+    llm.delay = 0.0
+    start = time.monotonic()
+    answer = pool.run("fast", "问题")
+    elapsed = time.monotonic() - start
+    slow.join()
+
+    assert answer == "快" and elapsed < 0.3, elapsed
+    assert [m["content"] for m in pool.store.load("slow")] == ["问题", "慢"]
+
+
+def test_agent_pool_stream_run_stores_final_round():
+    llm = TextOnlyLLM([["查询 [TOOL_CALL:echo:z]"], ["结论"]])
+    pool = AgentPool(make_agent(llm, EchoTool()))
+    chunks = list(pool.stream_run("s", "问题"))
+    pool.close()
+
+    assert chunks == ["查询 ", "结论"]
+    assert pool.store.load("s") == [{"role": "user", "content": "问题"}, {"role": "assistant", "content": "结论"}]
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and callable(test):
+            test()
+            print(f"✅ {name}")